@@ -1,41 +1,102 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context
-from functools import wraps
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context, send_file, abort, g, has_request_context
+from functools import wraps, lru_cache
+import click
 import os
 import json
 from PIL import Image
 from werkzeug.utils import secure_filename
+from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.http import is_resource_modified
+from werkzeug.datastructures import ContentRange
 import requests
+import requests.adapters
 import json
 import io
+import shutil
+import re
+import glob
+import collections
+import hashlib
+import contextlib
+import tempfile
 import logging
 import threading
 import queue
-import time
+import socket
+import sqlite3
+import heapq
+import bisect
+import array
+import itertools
+import multiprocessing
+import atexit
+import contextvars
+import math
+import base64
+import uuid
+import gzip
+import mimetypes
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.utils import parseaddr
 
-# optional advanced libs
-try:
-    import cv2
-    CV2_AVAILABLE = True
-except Exception:
-    cv2 = None
-    CV2_AVAILABLE = False
+# optional advanced libs; OpenCV, NumPy, tesseract and PDFium are imported
+# by load_image_libs() on first use, most requests never need them
+cv2 = np = pytesseract = pdfium = None
+CV2_AVAILABLE = NUMPY_AVAILABLE = TESSERACT_AVAILABLE = PDFIUM_AVAILABLE = False
+_IMAGE_LIBS = {'loaded': False, 'seconds': None}
+_IMAGE_LIBS_LOCK = threading.Lock()
+
+
+def load_image_libs():
+    """Import the image processing libraries (once per process)."""
+    global cv2, np, pytesseract, pdfium, CV2_AVAILABLE, NUMPY_AVAILABLE, TESSERACT_AVAILABLE, PDFIUM_AVAILABLE
+    if _IMAGE_LIBS['loaded']:
+        return
+    with _IMAGE_LIBS_LOCK:
+        if _IMAGE_LIBS['loaded']:
+            return
+        start = time.perf_counter()
+        try:
+            import cv2
+            CV2_AVAILABLE = True
+        except Exception:
+            cv2 = None
+            CV2_AVAILABLE = False
+
+        try:
+            import numpy as np
+            NUMPY_AVAILABLE = True
+        except Exception:
+            np = None
+            NUMPY_AVAILABLE = False
+
+        try:
+            import pytesseract
+            TESSERACT_AVAILABLE = True
+        except Exception:
+            pytesseract = None
+            TESSERACT_AVAILABLE = False
+
+        try:
+            import pypdfium2 as pdfium
+            PDFIUM_AVAILABLE = True
+        except Exception:
+            pdfium = None
+            PDFIUM_AVAILABLE = False
+        _IMAGE_LIBS.update(loaded=True, seconds=round(time.perf_counter() - start, 4))
 
-try:
-    import numpy as np
-    NUMPY_AVAILABLE = True
-except Exception:
-    np = None
-    NUMPY_AVAILABLE = False
 
 try:
-    import pytesseract
-    TESSERACT_AVAILABLE = True
+    import brotli
+    BROTLI_AVAILABLE = True
 except Exception:
-    pytesseract = None
-    TESSERACT_AVAILABLE = False
+    brotli = None
+    BROTLI_AVAILABLE = False
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'change-me-please')
@@ -88,47 +149,118 @@ PROFILE = {
 }
 
 # Data persistence path
-DATA_PATH = os.path.join(os.path.dirname(__file__), 'data.json')
+DATA_PATH = os.environ.get('DATA_PATH', os.path.join(os.path.dirname(__file__), 'data.json'))
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
 THUMB_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbs')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(THUMB_FOLDER, exist_ok=True)
+# untouched copies of enhanced uploads (mirroring their path below
+# UPLOAD_FOLDER), kept out of static/ so camera EXIF is never served
+ORIGINALS_FOLDER = os.environ.get('ORIGINALS_FOLDER', os.path.join(os.path.dirname(__file__), 'originals'))
+# multi-tenant mode: '' (one portfolio), 'host' (<tenant>.TENANT_DOMAIN) or
+# 'path' (TENANT_PATH_PREFIX/<tenant>/...); tenants live in TENANTS_DIR/<tenant>/
+TENANT_MODE = os.environ.get('TENANT_MODE', '')
+TENANTS_DIR = os.environ.get('TENANTS_DIR', os.path.join(os.path.dirname(__file__), 'tenants'))
+TENANT_DOMAIN = os.environ.get('TENANT_DOMAIN', '').lower()
+TENANT_PATH_PREFIX = os.environ.get('TENANT_PATH_PREFIX', '/t').rstrip('/')
+TENANT_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'tenants')
 ALLOWED_EXT = {'png','jpg','jpeg','gif','webp','bmp','tiff','svg','pdf','doc','docx'}
 IMAGE_EXTS = {'png','jpg','jpeg','gif','webp','bmp','tiff','svg'}
+# bounding boxes of the enhanced uploads and of legacy thumbnails
+ENHANCE_MAX_SIZE = (2000, 2000)
+THUMB_SIZE = (400, 300)
 
 def allowed(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in ALLOWED_EXT
 
-def make_thumbnail(src_path, dest_path, size=(400,300)):
+def make_thumbnail(src_path, dest_path, size=THUMB_SIZE, img=None):
+    """Fixed-size thumbnail for legacy (non content-addressed) uploads.
+    Pass an already decoded `img` to skip reading `src_path` again."""
     try:
-        img = Image.open(src_path)
+        if img is None:
+            img = open_image(src_path, size)
+        else:
+            img = img.copy()
         img.thumbnail(size)
-        img.save(dest_path, optimize=True, quality=85)
+        if img.mode not in ('RGB', 'L') and os.path.splitext(dest_path)[1].lower() in ('.jpg', '.jpeg'):
+            img = img.convert('RGB')
+        img.save(dest_path, optimize=True, quality=85, icc_profile=img.info.get('icc_profile'))
     except Exception:
-        pass
+        logging.exception('thumbnail failed for %s', src_path)
+        METRICS.swallowed('thumbnail')
 
 
-def enhance_image(path, max_size=(2000,2000)):
-    """Simple enhancement: auto-orient, resize to max_size, and apply slight contrast/auto-level."""
-    try:
-        img = Image.open(path)
-        # auto-orient via EXIF
-        try:
-            from PIL import ExifTags
-            exif = img._getexif()
-            if exif:
-                for k,v in ExifTags.TAGS.items():
-                    if v == 'Orientation':
-                        orientation_key = k; break
-                orient = exif.get(orientation_key, None) if 'orientation_key' in locals() else None
-                if orient == 3:
-                    img = img.rotate(180, expand=True)
-                elif orient == 6:
-                    img = img.rotate(270, expand=True)
-                elif orient == 8:
-                    img = img.rotate(90, expand=True)
-        except Exception:
+def original_path(path):
+    """Where the original of the stored upload `path` is kept (None for files
+    outside UPLOAD_FOLDER)."""
+    rel = os.path.relpath(path, UPLOAD_FOLDER)
+    if rel == os.curdir or rel.startswith(os.pardir + os.sep) or rel == os.pardir:
+        return None
+    return os.path.join(ORIGINALS_FOLDER, rel)
+
+
+def keep_original(path, source=None):
+    """Save the bytes of `source` (default: `path` itself, before enhancement
+    rewrites it) as the original of `path`, unless it already has one.
+    Returns the original's path, or None."""
+    dest = original_path(path)
+    if dest is None or os.path.exists(dest):
+        return dest
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f'{dest}.{uuid.uuid4().hex}.tmp'
+    try:
+        # enhanced files are replaced by rename, so a hard link keeps the old bytes
+        os.link(source or path, tmp)
+    except OSError:
+        shutil.copyfile(source or path, tmp)
+    os.replace(tmp, dest)
+    return dest
+
+
+def drop_original(path):
+    dest = original_path(path)
+    if dest is not None:
+        try:
+            os.unlink(dest)
+        except FileNotFoundError:
             pass
+
+
+EXIF_ORIENTATION = 0x0112
+
+
+def open_image(path, max_size=None):
+    """Decode an image upright, as small as `max_size` allows.
+
+    JPEGs larger than needed are decoded with libjpeg's DCT scaling (draft
+    mode) and all eight EXIF orientations are applied in one transpose.
+    """
+    from PIL import ImageOps
+    img = Image.open(path)
+    if max_size and img.format == 'JPEG':
+        bound = max_size
+        if img.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            # stored sideways: the bounds apply to the other axes
+            bound = (max_size[1], max_size[0])
+        scale = min(bound[0] / img.width, bound[1] / img.height, 1.0)
+        # draft() keeps at least this size in both dimensions
+        img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    fmt = img.format
+    img = ImageOps.exif_transpose(img)
+    img.format = fmt
+    return img
+
+
+def enhance_image(path, max_size=ENHANCE_MAX_SIZE):
+    """Simple enhancement: auto-orient, resize to max_size, and apply slight contrast/auto-level.
+
+    The file is rewritten with the orientation applied, the ICC profile kept
+    and other EXIF data (camera, GPS) dropped, as for the resized variants.
+    Returns the enhanced image so callers can derive thumbnails from it
+    without decoding the file again (None if it could not be processed).
+    """
+    try:
+        img = open_image(path, max_size)
+        fmt = img.format
+        icc = img.info.get('icc_profile')
         img.thumbnail(max_size)
         # slight auto-contrast (low amount)
         try:
@@ -137,451 +269,5010 @@ def enhance_image(path, max_size=(2000,2000)):
             enhancer = ImageEnhance.Sharpness(img)
             img = enhancer.enhance(1.05)
         except Exception:
-            pass
-        img.save(path, optimize=True, quality=90)
+            METRICS.swallowed('autocontrast')
+        img.info['icc_profile'] = icc
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, optimize=True, quality=90, icc_profile=icc)
+        _atomic_write(path, buf.getvalue())
+        return img
     except Exception:
-        pass
+        logging.exception('enhance failed for %s', path)
+        METRICS.swallowed('enhance')
+        return None
 
-    # Note: advanced OpenCV/pytesseract processing is intentionally moved to a background worker
-    # to avoid blocking request handlers. See advanced_enhance() below which will be called
-    # asynchronously by a worker thread when available.
 
+# Metrics for /metrics (Prometheus text format). Each process keeps its own
+# values in memory and writes them to a shared SQLite file every
+# METRICS_FLUSH_INTERVAL seconds, so whichever gunicorn worker answers a
+# scrape reports the totals of all of them. METRICS_ENABLED=0 turns every
+# call into an early return and skips the per-request hooks.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+METRICS_DB_PATH = os.environ.get('METRICS_DB_PATH', os.path.join(os.path.dirname(__file__), 'metrics.sqlite3'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
-# Background processing queue & SSE client registry
-PROCESS_QUEUE = queue.Queue()
-CLIENTS = set()
-CLIENTS_LOCK = threading.Lock()
 
-def send_sse(event, data):
-    """Push an event to all connected SSE clients (non-blocking)."""
-    payload = {'event': event, 'data': data}
-    with CLIENTS_LOCK:
-        for q in list(CLIENTS):
-            try:
-                q.put(payload, block=False)
-            except Exception:
-                pass
+class SQLiteBacked:
+    """State kept in the SQLite file at `db_path`, shared by processes.
 
+    The file and its tables are created by the first _db() call (see
+    _create()), so instances can be built at import time without touching
+    the disk.
+    """
 
-def event_stream(client_q):
-    try:
-        while True:
-            msg = client_q.get()
-            # format as SSE
-            s = ''
-            if 'event' in msg:
-                s += f"event: {msg['event']}\n"
-            s += f"data: {json.dumps(msg['data'], ensure_ascii=False)}\n\n"
-            yield s
-    except GeneratorExit:
-        return
+    row_factory = None
+    _created = False
 
+    def _create(self, db):
+        pass
 
-@app.route('/stream')
-def stream():
-    # Server-Sent Events endpoint
-    def gen():
-        q = queue.Queue()
-        with CLIENTS_LOCK:
-            CLIENTS.add(q)
-        try:
-            # send a welcome ping
-            q.put({'event': 'connected', 'data': {'time': time.time()}})
-            for chunk in event_stream(q):
-                yield chunk
+    @contextlib.contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = self.row_factory
+        try:
+            if not self._created:
+                # idempotent, so a race between threads only repeats it
+                db.execute('PRAGMA journal_mode=WAL')
+                self._create(db)
+                self._created = True
+            yield db
         finally:
-            with CLIENTS_LOCK:
-                try:
-                    CLIENTS.discard(q)
-                except Exception:
-                    pass
-    return Response(stream_with_context(gen()), mimetype='text/event-stream')
+            db.close()
 
 
-def advanced_enhance(path, max_size=(2000,2000)):
-    """Advanced processing ported from the previous inline block: uses OpenCV and pytesseract when available.
-    This function is safe to call in a background thread and will attempt best-effort processing.
+class Metrics(SQLiteBacked):
+    """Counters, gauges and histograms merged across processes.
+
+    Values are keyed on (name, sorted label pairs). Counters and histograms
+    of processes that have exited keep counting (they are folded into one
+    'retired' row); gauges only count while their process is alive, i.e.
+    has flushed within the last three intervals. A live process that was
+    retired for flushing too rarely writes only what it counted since. `collectors` are called
+    at every flush and return (name, labels, value) gauges of this process;
+    `shared_collectors` are called only when rendering, for values that
+    are already shared (e.g. the SQLite job queue depth).
     """
-    if not CV2_AVAILABLE:
-        return
-    try:
-        # read with cv2 (keeps orientation after Pillow work)
-        if NUMPY_AVAILABLE:
-            try:
-                im = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
-            except Exception:
-                im = cv2.imread(path)
-        else:
-            im = cv2.imread(path)
-        if im is None:
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS samples (
+            owner TEXT NOT NULL,
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (owner, name, labels)
+        );
+        CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, seen REAL NOT NULL);
+    '''
+    RETIRED = 'retired'
+
+    def __init__(self, db_path, enabled=True, flush_interval=5.0):
+        self.db_path = db_path
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.help = {}
+        self.collectors = []
+        self.shared_collectors = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def _create(self, db):
+        db.executescript(self.SCHEMA)
+
+    def _reset(self):
+        # a forked process starts from zero under its own name
+        self._lock = threading.Lock()
+        self._values = {}
+        # counters and histograms as last written under _owner
+        self._flushed = {}
+        self._owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._thread = None
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, value=1.0, **labels):
+        if not self.enabled:
             return
-        gray = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
-        # denoise
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._values.get(key)
+            self._values[key] = ['counter', (entry[1] if entry else 0.0) + value]
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = ['gauge', float(value)]
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ['histogram', {'buckets': list(buckets), 'counts': [0] * len(buckets),
+                                                           'sum': 0.0, 'count': 0}]
+            h = entry[1]
+            for i, bound in enumerate(h['buckets']):
+                if value <= bound:
+                    h['counts'][i] += 1
+                    break
+            h['sum'] += value
+            h['count'] += 1
+
+    def timer(self, name, **labels):
+        """Context manager observing its duration in histogram `name`."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timer(name, labels)
+
+    @contextlib.contextmanager
+    def _timer(self, name, labels):
+        start = time.perf_counter()
         try:
-            im = cv2.fastNlMeansDenoisingColored(im,None,10,10,7,21)
-        except Exception:
-            pass
-        # deskew: compute largest contour / minAreaRect
-        try:
-            blur = cv2.GaussianBlur(gray, (5,5), 0)
-            thresh = cv2.adaptiveThreshold(blur,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,11,2)
-            contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-            if contours:
-                largest = max(contours, key=cv2.contourArea)
-                rect = cv2.minAreaRect(largest)
-                angle = rect[-1]
-                if angle < -45:
-                    angle = 90 + angle
-                (h, w) = im.shape[:2]
-                center = (w // 2, h // 2)
-                M = cv2.getRotationMatrix2D(center, angle, 1.0)
-                im = cv2.warpAffine(im, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-        except Exception:
-            pass
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
 
-        # OCR-based crop (if tesseract available): find text boxes and crop to union
-        if TESSERACT_AVAILABLE:
+    def swallowed(self, stage):
+        """Count an exception that was logged (or ignored) and not raised."""
+        self.inc('swallowed_exceptions_total', stage=stage)
+
+    def flush(self):
+        if not self.enabled:
+            return
+        for collect in self.collectors:
             try:
-                rgb = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
-                pil_img = Image.fromarray(rgb)
-                data = pytesseract.image_to_data(pil_img, output_type=pytesseract.Output.DICT)
-                n = len(data.get('level', []))
-                xs, ys, xe, ye = [], [], [], []
-                for i in range(n):
-                    try:
-                        x = int(data['left'][i]); y = int(data['top'][i]); w = int(data['width'][i]); h = int(data['height'][i]);
-                        conf = int(float(data['conf'][i])) if str(data['conf'][i]).strip() not in ['', 'nan'] else -1
-                    except Exception:
-                        conf = -1
-                    if conf > 30:
-                        xs.append(x); ys.append(y); xe.append(x+w); ye.append(y+h)
-                if xs and ys and xe and ye:
-                    x1, y1, x2, y2 = min(xs), min(ys), max(xe), max(ye)
-                    padx = int((x2-x1)*0.06); pady = int((y2-y1)*0.06)
-                    x1 = max(0, x1-padx); y1 = max(0, y1-pady); x2 = min(im.shape[1], x2+padx); y2 = min(im.shape[0], y2+pady)
-                    im = im[y1:y2, x1:x2]
+                for name, labels, value in collect():
+                    self.set(name, value, **labels)
             except Exception:
-                pass
+                logging.exception('metrics collector failed')
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                retired = bool(self._flushed) and db.execute(
+                    'SELECT 1 FROM owners WHERE owner = ?', (self._owner,)).fetchone() is None
+                rows, written = [], {}
+                with self._lock:
+                    if retired:
+                        # folded into the retired row by another process's _retire(): only add what came since
+                        for key, prior in self._flushed.items():
+                            entry = self._values.get(key)
+                            if entry is not None:
+                                entry[1] = self._minus(entry[0], entry[1], prior)
+                        self._flushed = {}
+                    for (name, labels), (kind, value) in self._values.items():
+                        rows.append((self._owner, name, json.dumps(labels), kind, json.dumps(value)))
+                        if kind != 'gauge':
+                            written[(name, labels)] = json.loads(rows[-1][4])
+                db.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?)', rows)
+                db.execute('INSERT OR REPLACE INTO owners VALUES (?, ?)', (self._owner, time.time()))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        self._flushed = written
 
-        # final resize to max_size
-        try:
-            h, w = im.shape[:2]
-            scale = min(max_size[0]/w, max_size[1]/h, 1.0)
-            if scale < 1.0:
-                im = cv2.resize(im, (int(w*scale), int(h*scale)), interpolation=cv2.INTER_AREA)
-        except Exception:
-            pass
+    def _retire(self, db):
+        """Fold counters and histograms of processes that stopped flushing into
+        the retired row and drop their gauges."""
+        dead = [r[0] for r in db.execute('SELECT owner FROM owners WHERE seen < ?',
+                                         (time.time() - 3 * self.flush_interval,))]
+        for owner in dead:
+            for name, labels, kind, value in db.execute(
+                    "SELECT name, labels, kind, value FROM samples WHERE owner = ? AND kind != 'gauge'", (owner,)).fetchall():
+                row = db.execute('SELECT value FROM samples WHERE owner = ? AND name = ? AND labels = ?',
+                                 (self.RETIRED, name, labels)).fetchone()
+                merged = self._merge(kind, json.loads(row[0]) if row else None, json.loads(value))
+                db.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?)',
+                           (self.RETIRED, name, labels, kind, json.dumps(merged)))
+            db.execute('DELETE FROM samples WHERE owner = ?', (owner,))
+            db.execute('DELETE FROM owners WHERE owner = ?', (owner,))
 
-        # write back (use imencode to handle unicode paths)
-        try:
-            ext = os.path.splitext(path)[1].lower()
-            success, encimg = cv2.imencode(ext, im)
-            if success:
-                with open(path, 'wb') as f:
-                    f.write(encimg.tobytes())
-        except Exception:
+    @staticmethod
+    def _merge(kind, total, value):
+        if total is None:
+            return value
+        if kind == 'histogram':
+            return {'buckets': total['buckets'], 'counts': [a + b for a, b in zip(total['counts'], value['counts'])],
+                    'sum': total['sum'] + value['sum'], 'count': total['count'] + value['count']}
+        return total + value
+
+    @staticmethod
+    def _minus(kind, value, prior):
+        if kind == 'histogram':
+            return {'buckets': value['buckets'], 'counts': [a - b for a, b in zip(value['counts'], prior['counts'])],
+                    'sum': value['sum'] - prior['sum'], 'count': value['count'] - prior['count']}
+        return value - prior
+
+    def collect(self):
+        """{name: (kind, {labels: value})} summed over every process."""
+        self.flush()
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
             try:
-                cv2.imwrite(path, im)
+                self._retire(db)
+                rows = db.execute('SELECT name, labels, kind, value FROM samples').fetchall()
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        out = {}
+        for name, labels, kind, value in rows:
+            series = out.setdefault(name, (kind, {}))[1]
+            key = tuple(tuple(pair) for pair in json.loads(labels))
+            series[key] = self._merge(kind, series.get(key), json.loads(value))
+        for collect in self.shared_collectors:
+            try:
+                for name, labels, value in collect():
+                    out.setdefault(name, ('gauge', {}))[1][tuple(sorted(labels.items()))] = value
             except Exception:
-                pass
-    except Exception as e:
-        logging.exception('advanced enhance failed: %s', e)
+                logging.exception('metrics collector failed')
+        return out
 
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        esc = (lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
 
-def _worker_loop():
-    while True:
-        try:
-            task = PROCESS_QUEUE.get()
-            if task is None:
-                break
-            path = task.get('path')
-            kind = task.get('kind')
-            name = task.get('name')
-            # perform advanced processing
-            advanced_enhance(path)
-            # re-generate thumbnail (best-effort)
+    def render(self):
+        lines = []
+        for name, (kind, series) in sorted(self.collect().items()):
+            text = self.help.get(name, (kind, ''))[1]
+            if text:
+                lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(labels)} {value:g}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(value['buckets'], value['counts']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._labels(labels + (("le", f"{bound:g}"),))} {cumulative}')
+                lines.append(f'{name}_bucket{self._labels(labels + (("le", "+Inf"),))} {value["count"]}')
+                lines.append(f'{name}_sum{self._labels(labels)} {value["sum"]:g}')
+                lines.append(f'{name}_count{self._labels(labels)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def start(self):
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
             try:
-                thumb_path = os.path.join(THUMB_FOLDER, os.path.basename(path))
-                make_thumbnail(path, thumb_path)
+                self.flush()
             except Exception:
-                pass
-            # notify clients that processing finished for this item
+                logging.exception('metrics flush failed')
+
+
+METRICS = Metrics(METRICS_DB_PATH, enabled=METRICS_ENABLED, flush_interval=METRICS_FLUSH_INTERVAL)
+os.register_at_fork(after_in_child=METRICS._reset)
+for _name, _kind, _text in (
+        ('http_request_duration_seconds', 'histogram', 'Time to produce a response, by endpoint.'),
+        ('swallowed_exceptions_total', 'counter', 'Exceptions logged or ignored instead of raised, by stage.'),
+        ('profile_store_seconds', 'histogram', 'data.json reads (cache misses) and writes.'),
+        ('image_stage_seconds', 'histogram', 'Image processing stages.'),
+        ('image_job_seconds', 'histogram', 'Background image jobs, by final status.'),
+        ('image_jobs_running', 'gauge', 'Image jobs running in child processes.'),
+        ('image_jobs_queued', 'gauge', 'Image jobs waiting in the shared queue.'),
+        ('outbox_queued', 'gauge', 'Contact mails waiting to be sent.'),
+        ('upstream_request_seconds', 'histogram', 'Calls to the LLM API and the SMTP server.'),
+        ('sse_clients', 'gauge', 'Connected /stream clients.')):
+    METRICS.describe(_name, _kind, _text)
+
+
+def _add_column(db, table, column, decl):
+    # upgrade tables created by an older version in place
+    if column not in {row[1] for row in db.execute(f'PRAGMA table_info({table})')}:
+        try:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+        except sqlite3.OperationalError:
+            # another process added it first
+            pass
+
+
+# Server-Sent Events: events are appended to a small SQLite log shared by all
+# worker processes; each process polls it and fans out to its own clients.
+EVENTS_DB_PATH = os.environ.get('EVENTS_DB_PATH', os.path.join(os.path.dirname(__file__), 'events.sqlite3'))
+SSE_CLIENT_BUFFER = int(os.environ.get('SSE_CLIENT_BUFFER', '100'))
+SSE_OVERFLOW = os.environ.get('SSE_OVERFLOW', 'disconnect')  # or 'drop' (drop oldest)
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', '15'))
+SSE_REPLAY = int(os.environ.get('SSE_REPLAY', '500'))
+
+
+class SSEClient:
+    """Bounded per-connection buffer.
+
+    When a slow client's buffer is full it is either disconnected (it will
+    reconnect and catch up via Last-Event-ID) or its oldest message is
+    dropped, depending on `overflow`.
+    """
+
+    def __init__(self, maxsize=SSE_CLIENT_BUFFER, overflow=SSE_OVERFLOW, tenant=None):
+        self.queue = queue.Queue(maxsize)
+        # only events published for this tenant (None: the single-portfolio mode) are offered
+        self.tenant = tenant
+        self.overflow = overflow
+        self.closed = False
+        self.dropped = 0
+
+    def offer(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == 'drop':
             try:
-                payload = {'kind': kind, 'name': name, 'url': f"/static/uploads/{os.path.basename(path)}", 'thumb': f"/static/uploads/thumbs/{os.path.basename(path)}"}
-                send_sse('processed', payload)
-            except Exception:
+                self.queue.get_nowait()
+                self.queue.put_nowait(msg)
+            except (queue.Empty, queue.Full):
                 pass
-        except Exception:
-            logging.exception('worker exception')
+            self.dropped += 1
+        else:
+            self.closed = True
 
 
-# start worker thread
-WORKER_THREAD = threading.Thread(target=_worker_loop, daemon=True)
-WORKER_THREAD.start()
+class EventBus(SQLiteBacked):
+    """Cross-process broadcast with monotonically increasing event ids.
 
+    publish() appends to the shared log; a poller thread in every process
+    reads new rows and hands them to local SSEClients. The most recent
+    `replay` events are kept in memory (and in the log) so reconnecting
+    clients can resume from their Last-Event-ID. Events carry the tenant
+    they were published for and only reach that tenant's clients.
+    """
 
-def load_data():
-    if os.path.exists(DATA_PATH):
-        try:
-            with open(DATA_PATH, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return PROFILE.copy()
-    else:
-        # write default
-        save_data(PROFILE)
-        return PROFILE.copy()
+    def __init__(self, db_path, replay=SSE_REPLAY, poll_interval=0.25):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.clients = set()
+        self.ring = collections.deque(maxlen=replay)  # (tenant, message)
+        self.published = 0
+        self.delivered = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_id = None
+        self._last_trim = 0.0
 
+    def _create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                   'event TEXT NOT NULL, data TEXT NOT NULL, time REAL NOT NULL, tenant TEXT)')
+        _add_column(db, 'events', 'tenant', 'TEXT')
 
-def save_data(obj):
-    with open(DATA_PATH, 'w', encoding='utf-8') as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    def publish(self, event, data, tenant=None):
+        with self._db() as db:
+            event_id = db.execute('INSERT INTO events (event, data, time, tenant) VALUES (?, ?, ?, ?)',
+                                  (event, json.dumps(data, ensure_ascii=False), time.time(), tenant)).lastrowid
+        self.published += 1
+        self._wake.set()
+        return event_id
 
-def answer_bot(message: str) -> str:
-    if not message:
-        return "Hi — ask me about skills, projects, education, achievements, or contact details."
-    m = message.lower()
-    # greetings
-    if any(w in m for w in ["hello","hi","hey","greetings"]):
-        return f"Hi, I'm {PROFILE.get('name')} — ask me about skills, projects or contact details."
-    # contact
-    if any(w in m for w in ["email","mail","gmail","contact email"]):
-        return f"Email: {PROFILE.get('email')}"
-    if any(w in m for w in ["phone","call","contact number","mobile"]):
-        return f"Phone: {PROFILE.get('phone')}"
-    if "linkedin" in m:
-        return f"LinkedIn: {PROFILE.get('linkedin')}"
-    # personal / location
-    if any(w in m for w in ["where","location","hyderabad","city"]):
-        return PROFILE.get('location')
-    # objective/education
-    if any(w in m for w in ["objective","goal","seeking"]):
-        return PROFILE.get('objective')
-    if any(w in m for w in ["education","college","degree","school"]):
-        return PROFILE.get('education')
-    # lists
-    if any(w in m for w in ["skill","skills","tech","technologies"]):
-        return ", ".join(load_data().get('skills', []))
-    if any(w in m for w in ["project","portfolio"]):
-        projects = load_data().get('projects', [])
-        titles = [p.get('title', str(p)) for p in projects]
-        return "Projects: " + ", ".join(titles)
-    if any(w in m for w in ["certificate","certificates"]):
-        certs = load_data().get('certificates', [])
-        if certs: return "Certificates: " + ", ".join([c.get('name') if isinstance(c, dict) else str(c) for c in certs])
-        return "No certificates listed yet."
-    if any(w in m for w in ["snap","photo","image","gallery"]):
-        snaps = load_data().get('snaps', [])
-        return f"I have {len(snaps)} snaps. Visit the Snaps page to view them." if snaps else "No snaps available yet."
-    if any(w in m for w in ["hackathon","award","achievement"]):
-        return ", ".join(load_data().get('achievements', []))
-    # fallback
-    return "I can share info about education, skills, projects, achievements, or contact details. Try: 'skills', 'projects', or 'email'."
+    def subscribe(self, last_event_id=None, client=None, tenant=None):
+        """Register a client; returns (client, missed events to send first)."""
+        self._ensure_started()
+        client = client or SSEClient(tenant=tenant)
+        with self._lock:
+            self.clients.add(client)
+            backlog = self.replay(last_event_id, client.tenant) if last_event_id is not None else []
+        return client, backlog
 
+    def unsubscribe(self, client):
+        with self._lock:
+            self.clients.discard(client)
 
-@app.context_processor
-def inject_ui_mode():
-    try:
-        data = load_data()
-        m = data.get('ui_mode') or ''
-        return {'UI_MODE': f"mode-{m}" if m else ''}
-    except Exception:
-        return {'UI_MODE': ''}
+    def replay(self, after_id, tenant=None):
+        ring = list(self.ring)
+        if ring and ring[0][1]['id'] <= after_id + 1:
+            return [m for owner, m in ring if m['id'] > after_id and owner == tenant]
+        # older than the in-memory window: read from the shared log
+        with self._db() as db:
+            # newer rows are delivered by the poller
+            rows = db.execute('SELECT id, event, data FROM events WHERE id > ? AND id <= ? AND tenant IS ? '
+                              'ORDER BY id LIMIT ?',
+                              (after_id, self._last_id or 0, tenant, self.ring.maxlen * 4)).fetchall()
+        return [{'id': r[0], 'event': r[1], 'data': json.loads(r[2])} for r in rows]
 
-# simple auth decorator
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if not session.get('admin'):
-            return redirect(url_for('admin_login'))
-        return f(*args, **kwargs)
-    return decorated
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            with self._db() as db:
+                self._last_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            self._thread = threading.Thread(target=self._poll, name='sse-poller', daemon=True)
+            self._thread.start()
 
+    def poll_once(self):
+        with self._db() as db:
+            rows = db.execute('SELECT id, event, data, tenant FROM events WHERE id > ? ORDER BY id',
+                              (self._last_id,)).fetchall()
+            if time.time() - self._last_trim > 60:
+                self._last_trim = time.time()
+                db.execute('DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?',
+                           (self.ring.maxlen * 4,))
+        for event_id, event, data, tenant in rows:
+            msg = {'id': event_id, 'event': event, 'data': json.loads(data)}
+            with self._lock:
+                self.ring.append((tenant, msg))
+                self._last_id = event_id
+                clients = list(self.clients)
+            for client in clients:
+                if client.tenant != tenant:
+                    continue
+                client.offer(msg)
+                self.delivered += 1
+        return len(rows)
 
-@app.route('/admin')
-@admin_required
-def admin():
-    data = load_data()
-    return render_template('admin.html', data=data)
+    def _poll(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.poll_once()
+            except Exception:
+                logging.exception('event poll failed')
+                METRICS.swallowed('event_poll')
 
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self.clients), 'published': self.published, 'delivered': self.delivered,
+                    'last_id': self._last_id, 'dropped': sum(c.dropped for c in self.clients)}
 
-@app.route('/admin/login', methods=['GET','POST'])
-def admin_login():
-    if request.method == 'GET':
-        return render_template('admin_login.html')
-    body = request.form or {}
-    username = body.get('username')
-    password = body.get('password')
-    if username == 'Nani@2821' and password == 'Nani@2821':
-        session['admin'] = True
-        return redirect(url_for('admin'))
-    return render_template('admin_login.html', error='Invalid credentials')
 
+EVENTS = EventBus(EVENTS_DB_PATH)
 
-@app.route('/admin/logout')
-def admin_logout():
-    session.pop('admin', None)
-    return redirect(url_for('index'))
 
+def send_sse(event, data):
+    """Broadcast an event to the current tenant's SSE clients of every worker
+    process (non-blocking)."""
+    try:
+        EVENTS.publish(event, data, current_tenant().name)
+    except Exception:
+        logging.exception('failed to publish %s event', event)
+        METRICS.swallowed('event_publish')
 
-@app.route('/api/data', methods=['GET','POST','PUT','DELETE'])
-@admin_required
-def api_data():
-    if request.method == 'GET':
-        data = load_data()
-        return jsonify(data)
-    if request.method in ('POST','PUT'):
-        obj = request.get_json() or {}
-        # Normalize incoming payload to preserve lottie/description fields and ensure
-        # arrays like certificates/snaps/events are objects with consistent shape.
-        def normalize_items(arr):
-            if not arr or not isinstance(arr, list):
-                return []
-            out = []
-            for it in arr:
-                if isinstance(it, str):
-                    out.append({'name': it})
-                elif isinstance(it, dict):
-                    item = it.copy()
-                    # preserve lottie if present and non-empty
-                    l = it.get('lottie')
-                    if isinstance(l, str) and l.strip():
-                        item['lottie'] = l
-                    # preserve description if present and non-empty
-                    d = it.get('description')
-                    if isinstance(d, str) and d.strip():
-                        item['description'] = d
-                    out.append(item)
-                else:
-                    out.append(it)
-            return out
-
-        # normalize specific collections
-        try:
-            if 'certificates' in obj:
-                obj['certificates'] = normalize_items(obj.get('certificates'))
-            if 'snaps' in obj:
-                obj['snaps'] = normalize_items(obj.get('snaps'))
-            if 'events' in obj:
-                obj['events'] = normalize_items(obj.get('events'))
-            # projects should be arrays of dicts; convert strings to dicts if needed
-            if 'projects' in obj and isinstance(obj.get('projects'), list):
-                proj = []
-                for p in obj.get('projects'):
-                    if isinstance(p, str):
-                        proj.append({"title": p, "description": "", "languages": "", "github": "", "images": [], "lottie": ""})
-                    elif isinstance(p, dict):
-                        proj.append(p)
-                obj['projects'] = proj
-            if 'skills' in obj and isinstance(obj.get('skills'), list):
-                skl = []
-                for s in obj.get('skills'):
-                    if isinstance(s, str):
-                        skl.append(s)
-                    elif isinstance(s, dict):
-                        skl.append(s.get('name', str(s)))
-                obj['skills'] = [x for x in skl if x]
-        except Exception:
-            pass
 
-        save_data(obj)
-        # Notify connected clients about UI mode change so public pages can update live
-        try:
-            ui = obj.get('ui_mode')
-            if ui:
-                send_sse('ui_mode', {'mode': ui})
-        except Exception:
-            pass
-        return jsonify({'ok': True})
-    if request.method == 'DELETE':
-        kind = request.form.get('kind', 'cert')
-        save_data(PROFILE)
-        return jsonify({'ok': True})
+def format_sse(msg):
+    s = ''
+    if msg.get('id') is not None:
+        s += f"id: {msg['id']}\n"
+    if 'event' in msg:
+        s += f"event: {msg['event']}\n"
+    s += f"data: {json.dumps(msg['data'], ensure_ascii=False)}\n\n"
+    return s
 
 
-@app.route('/contact', methods=['POST'])
-def contact():
-    data = request.form or {}
-    name = data.get('from_name', '').strip()
-    user_email = data.get('from_email', '').strip()
-    message_text = data.get('message', '').strip()
-    if not all([name, user_email, message_text]):
-        return jsonify({'ok': False, 'error': 'Missing required fields'}), 400
-    # Profile email
-    profile = load_data()
-    to_email = profile.get('email', 'simonbaler21@gmail.com')
-    from_email = to_email  # Use same for sender
-    subject = f"New Contact Form Message from {name}"
-    body = f"Name: {name}\nEmail: {user_email}\nMessage:\n{message_text}"
-    # SMTP setup
-    smtp_server = 'smtp.gmail.com'
-    smtp_port = 587
-    password = os.environ.get('EMAIL_PASSWORD')
-    if not password:
-        return jsonify({'ok': False, 'error': 'Email configuration missing'}), 500
+def event_stream(client, backlog=(), heartbeat=SSE_HEARTBEAT):
+    # send a welcome ping
+    yield format_sse({'event': 'connected', 'data': {'time': time.time()}})
+    for msg in backlog:
+        yield format_sse(msg)
+    while not client.closed:
+        try:
+            msg = client.queue.get(timeout=heartbeat)
+        except queue.Empty:
+            # comment line keeps proxies from timing out and surfaces dead
+            # connections (the write fails and the generator is closed)
+            yield ': ping\n\n'
+            continue
+        yield format_sse(msg)
 
-    msg = MIMEMultipart()
-    msg['From'] = from_email
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
 
+def _last_event_id():
+    value = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(from_email, password)
-        text = msg.as_string()
-        server.sendmail(from_email, to_email, text)
-        server.quit()
+        return int(value) if value else None
+    except ValueError:
+        return None
 
-        return jsonify({'ok': True, 'message': 'Email sent successfully'})
-    except Exception as e:
-        print(f'Email error: {e}')
-        return jsonify({'ok': False, 'error': 'Failed to send email'}), 500
 
+@app.route('/stream')
+def stream():
+    # Server-Sent Events endpoint
+    client, backlog = EVENTS.subscribe(_last_event_id(), tenant=current_tenant().name)
 
-@app.route('/events')
-def events():
-    data = load_data()
-    events = data.get('events', [])
-    return render_template('events.html', events=events)
+    def gen():
+        try:
+            yield from event_stream(client, backlog)
+        finally:
+            EVENTS.unsubscribe(client)
+    resp = Response(stream_with_context(gen()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
 
 
-@app.route('/gallery')
-def gallery():
-    return render_template('gallery.html')
+# analysis (deskew, text box) runs on a proxy whose longest side is this long
+ENHANCE_ANALYSIS_SIZE = int(os.environ.get('ENHANCE_ANALYSIS_SIZE', '1024'))
+# denoising works on tiles of this size to bound peak memory
+ENHANCE_TILE = int(os.environ.get('ENHANCE_TILE', '512'))
+# OCR reads a binarized copy at most this long; words below OCR_MIN_CONF are ignored
+OCR_MAX_SIDE = int(os.environ.get('OCR_MAX_SIDE', '1600'))
+OCR_MIN_CONF = float(os.environ.get('OCR_MIN_CONF', '30'))
+OCR_CONFIG = os.environ.get('OCR_CONFIG', '')
+OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'ocr_cache.sqlite3'))
+JPEG_REDUCED_FLAGS = ((8, 'IMREAD_REDUCED_COLOR_8'), (4, 'IMREAD_REDUCED_COLOR_4'), (2, 'IMREAD_REDUCED_COLOR_2'))
 
 
-@app.route('/resume')
-def resume():
-    data = load_data()
-    resume = data.get('resume', {})
-    return render_template('resume.html', resume=resume)
+class OCRCache(SQLiteBacked):
+    """Persistent OCR results keyed by input content hash + OCR settings,
+    shared by all processes (image jobs run in child processes)."""
 
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
 
-@app.route('/projects')
-def projects():
-    data = load_data()
-    projects = data.get('projects', [])
-    return render_template('projects.html', profile=data, projects=projects)
+    def _create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, boxes TEXT NOT NULL, '
+                   'created REAL NOT NULL)')
 
-@app.errorhandler(404)
-def page_not_found(e):
-    # render a friendly 404 page that matches the site style
-    return render_template('404.html'), 404
+    def get(self, key):
+        with self._db() as db:
+            row = db.execute('SELECT boxes FROM ocr WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
 
+    def set(self, key, boxes):
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO ocr (key, boxes, created) VALUES (?, ?, ?)',
+                       (key, json.dumps(boxes), time.time()))
 
-@app.route('/')
-def index():
-    data = load_data()
-    lang = session.get('lang', 'english')
-    return render_template('index.html', profile=data, lang=lang)
+    def stats(self):
+        with self._db() as db:
+            entries = db.execute('SELECT COUNT(*) FROM ocr').fetchone()[0]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
 
 
-@app.route('/welcome')
-def welcome():
-    return render_template('welcome.html')
-    
+OCR_CACHE = OCRCache(OCR_CACHE_PATH)
+
+
+@contextlib.contextmanager
+def _stage(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe('image_stage_seconds', elapsed, stage=name)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def _fit_scale(w, h, max_size):
+    return min(max_size[0] / w, max_size[1] / h, 1.0)
+
+
+def _decode_for_enhance(buf, max_size, headroom):
+    """Decode the encoded bytes in `buf` once, as small as possible while
+    keeping `headroom` x the output size (JPEGs use libjpeg's reduced DCT
+    decoding)."""
+    flags = cv2.IMREAD_COLOR
+    try:
+        with Image.open(io.BytesIO(buf)) as probe:
+            fmt, (w, h) = probe.format, probe.size
+    except Exception:
+        fmt, w, h = None, 0, 0
+    if fmt == 'JPEG':
+        # either orientation, since EXIF rotation is applied while decoding
+        need = headroom * max(_fit_scale(w, h, max_size), _fit_scale(h, w, max_size))
+        for factor, name in JPEG_REDUCED_FLAGS:
+            if need * factor <= 1.0 and hasattr(cv2, name):
+                flags = getattr(cv2, name)
+                break
+    im = cv2.imdecode(buf, flags)
+    if im is None:
+        return None
+    h, w = im.shape[:2]
+    scale = headroom * _fit_scale(w, h, max_size)
+    if scale < 1.0:
+        im = cv2.resize(im, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return im
+
+
+def _deskew_angle(gray):
+    """Skew angle (degrees, within +-45) of the largest contour."""
+    blur = cv2.GaussianBlur(gray, (5,5), 0)
+    thresh = cv2.adaptiveThreshold(blur,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,11,2)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return 0.0
+    angle = cv2.minAreaRect(max(contours, key=cv2.contourArea))[-1]
+    # minAreaRect reports (-90, 0] or [0, 90) depending on the OpenCV version
+    if angle < -45:
+        angle = 90 + angle
+    elif angle > 45:
+        angle = angle - 90
+    return angle
+
+
+def _confident_boxes(data, min_conf=OCR_MIN_CONF):
+    """(N, 4) array of x1, y1, x2, y2 for the words of an image_to_data()
+    dict whose confidence is above `min_conf`."""
+    conf = np.char.strip(np.asarray(data.get('conf', []), dtype=str))
+    conf = np.where((conf == '') | (conf == 'nan'), '-1', conf).astype(float)
+    if not conf.size:
+        return np.empty((0, 4))
+    x, y, w, h = (np.asarray(data[k]).astype(float) for k in ('left', 'top', 'width', 'height'))
+    keep = (conf > min_conf) & (w > 0) & (h > 0)
+    return np.stack([x, y, x + w, y + h], axis=1)[keep]
+
+
+@lru_cache(maxsize=None)
+def _ocr_settings():
+    try:
+        version = str(pytesseract.get_tesseract_version())
+    except Exception:
+        version = '?'
+    return f'v1:{OCR_MAX_SIDE}:{OCR_MIN_CONF}:{OCR_CONFIG}:{version}'
+
+
+def _ocr_boxes(im, angle, digest):
+    """Word boxes of `im` after rotating by `angle`, as fractions of its size.
+
+    Tesseract reads a binarized grayscale copy at most OCR_MAX_SIDE pixels
+    long; results are kept in OCR_CACHE under the hash of the input file and
+    the OCR settings.
+    """
+    key = f'{digest}:{_ocr_settings()}'
+    cached = OCR_CACHE.get(key)
+    if cached is not None:
+        return np.asarray(cached, dtype=float).reshape(-1, 4)
+    h, w = im.shape[:2]
+    q = min(OCR_MAX_SIDE / max(w, h), 1.0)
+    small = cv2.resize(im, (max(1, round(w * q)), max(1, round(h * q))), interpolation=cv2.INTER_AREA) \
+        if q < 1.0 else im
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    sh, sw = gray.shape
+    if abs(angle) >= 0.1:
+        M = cv2.getRotationMatrix2D((sw / 2, sh / 2), angle, 1.0)
+        gray = cv2.warpAffine(gray, M, (sw, sh), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    data = pytesseract.image_to_data(Image.fromarray(binary), config=OCR_CONFIG,
+                                     output_type=pytesseract.Output.DICT)
+    # rounded before use so cached and fresh results crop identically
+    boxes = (_confident_boxes(data) / [sw, sh, sw, sh]).round(5)
+    OCR_CACHE.set(key, boxes.tolist())
+    return boxes
+
+
+def _text_box(boxes, w, h):
+    """Padded union of relative word `boxes` in a w x h image, or None."""
+    if not len(boxes):
+        return None
+    x1, y1 = boxes[:, :2].min(axis=0) * (w, h)
+    x2, y2 = boxes[:, 2:].max(axis=0) * (w, h)
+    padx = (x2-x1)*0.06; pady = (y2-y1)*0.06
+    box = (max(0, int(x1-padx)), max(0, int(y1-pady)), min(w, int(x2+padx)), min(h, int(y2+pady)))
+    if box[2] - box[0] < 2 or box[3] - box[1] < 2:
+        return None
+    return box
+
+
+def _final_transform(im, angle, box, max_size):
+    """Rotate, crop to `box` (in rotated coordinates) and scale to fit
+    `max_size` with a single resampling of the full image."""
+    h, w = im.shape[:2]
+    x1, y1, x2, y2 = box or (0, 0, w, h)
+    cw, ch = x2 - x1, y2 - y1
+    scale = _fit_scale(cw, ch, max_size)
+    size = (max(1, round(cw * scale)), max(1, round(ch * scale)))
+    if abs(angle) < 0.1:
+        im = im[y1:y2, x1:x2]
+        return cv2.resize(im, size, interpolation=cv2.INTER_AREA) if scale < 1.0 else im
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    M[0, 2] -= x1
+    M[1, 2] -= y1
+    M *= scale
+    return cv2.warpAffine(im, M, size, flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def _denoise_tiled(im, tile=ENHANCE_TILE, strength=10, template=7, search=21):
+    """fastNlMeansDenoisingColored tile by tile. Each tile is denoised with a
+    margin covering the search and template windows, so the result matches
+    a whole-image pass while only one tile's buffers are alive at a time."""
+    pad = search // 2 + template // 2
+    h, w = im.shape[:2]
+    out = np.empty_like(im)
+    for y in range(0, h, tile):
+        for x in range(0, w, tile):
+            y0, x0 = max(0, y - pad), max(0, x - pad)
+            y1, x1 = min(h, y + tile + pad), min(w, x + tile + pad)
+            den = cv2.fastNlMeansDenoisingColored(im[y0:y1, x0:x1], None, strength, strength, template, search)
+            th, tw = min(tile, h - y), min(tile, w - x)
+            out[y:y + th, x:x + tw] = den[y - y0:y - y0 + th, x - x0:x - x0 + tw]
+    return out
+
+
+def advanced_enhance(path, max_size=ENHANCE_MAX_SIZE, timings=None):
+    """Advanced processing ported from the previous inline block: uses OpenCV and pytesseract when available.
+    This function is safe to call in a background thread and will attempt best-effort processing.
+
+    The file is decoded once at the smallest useful size; deskew and text
+    detection look at a downscaled proxy, the full image goes through one
+    combined rotate/crop/resize and is denoised tile by tile afterwards.
+    Per-stage durations (seconds) are added to `timings` when given.
+    """
+    load_image_libs()
+    if not (CV2_AVAILABLE and NUMPY_AVAILABLE):
+        return
+    try:
+        with _stage(timings, 'decode'):
+            buf = np.fromfile(path, dtype=np.uint8)
+            digest = hashlib.sha256(buf).hexdigest()
+            # keep extra resolution when an OCR crop may zoom into the image
+            im = _decode_for_enhance(buf, max_size, headroom=2 if TESSERACT_AVAILABLE else 1)
+        if im is None:
+            return
+        h, w = im.shape[:2]
+        with _stage(timings, 'analyse'):
+            p = min(ENHANCE_ANALYSIS_SIZE / max(w, h), 1.0)
+            proxy = cv2.resize(im, (max(1, round(w * p)), max(1, round(h * p))), interpolation=cv2.INTER_AREA) \
+                if p < 1.0 else im
+            angle = 0.0
+            # deskew: compute largest contour / minAreaRect
+            try:
+                angle = _deskew_angle(cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY))
+            except Exception:
+                METRICS.swallowed('deskew')
+        box = None
+        # OCR-based crop (if tesseract available): find text boxes and crop to union
+        if TESSERACT_AVAILABLE:
+            with _stage(timings, 'ocr'):
+                try:
+                    box = _text_box(_ocr_boxes(im, angle, digest), w, h)
+                except Exception:
+                    logging.exception('OCR failed for %s', path)
+                    METRICS.swallowed('ocr')
+        with _stage(timings, 'transform'):
+            im = _final_transform(im, angle, box, max_size)
+        # denoise
+        with _stage(timings, 'denoise'):
+            try:
+                im = _denoise_tiled(im)
+            except Exception:
+                METRICS.swallowed('denoise')
+
+        # write back (use imencode to handle unicode paths)
+        with _stage(timings, 'encode'):
+            ext = os.path.splitext(path)[1].lower()
+            success, encimg = cv2.imencode(ext, im)
+            if success:
+                data = encimg.tobytes()
+                _atomic_write(path, data)
+                if TESSERACT_AVAILABLE:
+                    # the output is already cropped: reprocessing it must not crop again
+                    OCR_CACHE.set(f'{hashlib.sha256(data).hexdigest()}:{_ocr_settings()}', [])
+    except Exception as e:
+        logging.exception('advanced enhance failed: %s', e)
+        METRICS.swallowed('advanced_enhance')
+
+
+PDF_PREVIEW_FOLDER = os.path.join(UPLOAD_FOLDER, 'previews')
+PDF_PREVIEW_WIDTH = int(os.environ.get('PDF_PREVIEW_WIDTH', '1280'))
+
+
+def pdf_preview_path(path):
+    return os.path.join(PDF_PREVIEW_FOLDER, os.path.splitext(os.path.basename(path))[0] + '.png')
+
+
+def render_pdf_preview(path, width=PDF_PREVIEW_WIDTH, dest=None, force=False):
+    """Rasterize the first page of the PDF at `path` to a PNG (once; kept
+    until the PDF changes, unless `force`). Returns the preview path, or None
+    without pdfium."""
+    dest = dest or pdf_preview_path(path)
+    try:
+        if not force and os.path.getmtime(dest) >= os.path.getmtime(path):
+            return dest
+    except OSError:
+        pass
+    load_image_libs()
+    if not PDFIUM_AVAILABLE:
+        return None
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page = pdf[0]
+        img = page.render(scale=width / page.get_width()).to_pil()
+    finally:
+        pdf.close()
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', optimize=True)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    _atomic_write(dest, buf.getvalue())
+    return dest
+
+
+def process_upload(path):
+    """Background job handler: first-page preview for PDFs, OpenCV pass for images."""
+    try:
+        if path.lower().endswith('.pdf'):
+            with METRICS.timer('image_stage_seconds', stage='pdf_preview'):
+                render_pdf_preview(path)
+        else:
+            advanced_enhance(path)
+    finally:
+        # runs in a short-lived child process: hand its stage timings over now
+        METRICS.flush()
+
+
+LQIP_SIZE = 16
+
+
+def image_placeholder(img):
+    """Data URI of a ~16 px version of `img`, shown blurred while the real
+    image loads."""
+    scale = LQIP_SIZE / max(img.width, img.height)
+    small = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR,
+                       reducing_gap=2.0)
+    if small.mode not in ('RGB', 'L'):
+        small = small.convert('RGB')
+    buf = io.BytesIO()
+    if 'webp' in DERIVED_FORMATS:
+        small.save(buf, 'WEBP', quality=40)
+        return 'data:image/webp;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+    small.save(buf, 'PNG', optimize=True)
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def media_meta(path=None, img=None):
+    """width, height and LQIP placeholder of an upload (PDFs: of their
+    first-page preview). Pass a decoded, upright `img` to skip reading."""
+    if img is None:
+        if path.lower().endswith('.pdf'):
+            path = render_pdf_preview(path)
+            if not path:
+                return None
+        with Image.open(path) as probe:
+            width, height = probe.size
+            if probe.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width
+        img = open_image(path, (LQIP_SIZE * 4, LQIP_SIZE * 4))
+    else:
+        width, height = img.size
+    return {'width': width, 'height': height, 'lqip': image_placeholder(img)}
+
+
+def _apply_media_meta(node, digest, meta):
+    """Set `meta` on every entry in `node` whose url is the blob `digest`;
+    returns True if anything changed."""
+    changed = False
+    if isinstance(node, dict):
+        if _blob_digest(node.get('url')) == digest and any(node.get(k) != v for k, v in meta.items()):
+            if isinstance(node, ReadOnlyDict):
+                return True
+            node.update(meta)
+            changed = True
+        for value in node.values():
+            changed = _apply_media_meta(value, digest, meta) or changed
+    elif isinstance(node, list):
+        for value in node:
+            changed = _apply_media_meta(value, digest, meta) or changed
+    return changed
+
+
+def known_media_meta(node, digest):
+    """width/height/LQIP already recorded for blob `digest` in `node`, or None."""
+    if isinstance(node, dict):
+        if _blob_digest(node.get('url')) == digest and node.get('lqip'):
+            return {k: node.get(k) for k in ('width', 'height', 'lqip')}
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for value in children:
+        meta = known_media_meta(value, digest)
+        if meta:
+            return meta
+    return None
+
+
+def record_media_meta(digest, meta):
+    """Store width/height/LQIP on the data.json entries of a blob (no-op
+    when they are already up to date)."""
+    record_media_metas({digest: meta})
+
+
+def _apply_preview(node, url, preview):
+    """Set `preview` on every entry in `node` whose url is `url`; returns True
+    if anything changed."""
+    changed = False
+    if isinstance(node, dict):
+        if node.get('url') == url and node.get('preview') != preview:
+            if isinstance(node, ReadOnlyDict):
+                return True
+            node['preview'] = preview
+            changed = True
+        for value in node.values():
+            changed = _apply_preview(value, url, preview) or changed
+    elif isinstance(node, list):
+        for value in node:
+            changed = _apply_preview(value, url, preview) or changed
+    return changed
+
+
+def record_pdf_previews(previews):
+    """Point the data.json entries of loose (pre-blob) PDFs at their rendered
+    first page ({PDF url: preview url}) in one write."""
+    store = current_tenant().store
+
+    def apply(doc):
+        changed = False
+        for url, preview in previews.items():
+            changed = _apply_preview(doc, url, preview) or changed
+        return changed
+    if not apply(store.get()):
+        return
+
+    def mutate(doc):
+        apply(doc)
+        return doc
+    store.update(mutate, op='pdf-previews')
+
+
+def record_media_metas(metas):
+    """record_media_meta() for many blobs ({digest: meta}) in one write."""
+    store = current_tenant().store
+
+    def apply(doc):
+        changed = False
+        for digest, meta in metas.items():
+            changed = _apply_media_meta(doc, digest, meta) or changed
+        return changed
+    if not apply(store.get()):
+        return
+
+    def mutate(doc):
+        apply(doc)
+        return doc
+    store.update(mutate, op='media-meta')
+
+
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+IMAGE_JOB_TIMEOUT = float(os.environ.get('IMAGE_JOB_TIMEOUT', '120'))
+IMAGE_QUEUE_MAX = int(os.environ.get('IMAGE_QUEUE_MAX', '200'))
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join(os.path.dirname(__file__), 'jobs.sqlite3'))
+
+# lower runs first
+PRIORITY_PREVIEW = 0
+PRIORITY_UPLOAD = 10
+PRIORITY_BULK = 20
+PRIORITIES = {'preview': PRIORITY_PREVIEW, 'upload': PRIORITY_UPLOAD, 'bulk': PRIORITY_BULK}
+
+
+class ImageJobEngine(SQLiteBacked):
+    """Durable image job queue backed by a local SQLite table.
+
+    Every process (e.g. each gunicorn worker) runs a dispatcher that claims
+    jobs from the shared table under a lease and runs them in child
+    processes, at most `workers` at a time per dispatcher. Jobs are picked
+    by priority (then FIFO). Submitting a path that is already queued or
+    running returns the existing job instead of adding a duplicate. A job
+    that runs longer than `timeout` seconds is killed; failed jobs are
+    retried with exponential backoff up to `max_attempts` times. put()
+    raises queue.Full once `max_depth` jobs are waiting so callers can answer
+    "busy" instead of growing the backlog without bound.
+
+    Leases are renewed while a job runs. Jobs whose lease expired (their
+    process crashed or was redeployed) are put back in the queue by sweep(),
+    which runs at start-up and periodically afterwards. `preload` runs once
+    in the dispatcher before the first job so job processes inherit its
+    imports; stop(timeout) hands jobs still running at the deadline back to
+    the queue for another dispatcher.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            coalesced INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(status, priority, id);
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_path ON jobs(path) WHERE status IN ('queued', 'running');
+    '''
+    ACTIVE = ('queued', 'running')
+
+    row_factory = sqlite3.Row
+
+    def __init__(self, handler, db_path, workers=1, max_depth=100, timeout=120.0,
+                 max_attempts=3, backoff=5.0, poll_interval=0.5, keep_finished=1000, preload=None):
+        self.handler = handler
+        self.preload = preload
+        self.db_path = db_path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.keep_finished = keep_finished
+        self.lease_time = timeout + 30
+        # callables invoked as callback(job) in the process that ran the job
+        self.on_done = []
+        methods = multiprocessing.get_all_start_methods()
+        self._ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self._owner = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+        self._cond = threading.Condition()
+        self._running = {}
+        self._thread = None
+        self._stopping = False
+        self._deadline = None
+        self._last_sweep = 0.0
+
+    def _create(self, db):
+        db.executescript(self.SCHEMA)
+
+    def _job(self, row):
+        if row is None:
+            return None
+        job = json.loads(row['payload'])
+        job.update({k: row[k] for k in ('id', 'path', 'priority', 'status', 'attempts', 'coalesced',
+                                        'created', 'started', 'finished', 'error', 'run_after')})
+        return job
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._deadline = None
+            # a forked worker must not renew or finish its parent's leases
+            self._owner = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+            self._running = {}
+            self.sweep()
+            self._thread = threading.Thread(target=self._dispatch, name='image-jobs', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop claiming new jobs and let running ones finish; after `timeout`
+        seconds the rest are killed and put back in the queue."""
+        with self._cond:
+            self._stopping = True
+            self._deadline = time.time() + timeout if timeout is not None else None
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout + 5 if timeout is not None else None)
+
+    def running_count(self):
+        """Jobs this process's dispatcher is running right now."""
+        return len(self._running)
+
+    def depth(self):
+        with self._db() as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def full(self):
+        return self.depth() >= self.max_depth
+
+    def put(self, task, priority=PRIORITY_UPLOAD):
+        """Queue `task` (a dict with at least 'path'); returns the job dict."""
+        path = task['path']
+        payload = json.dumps({k: v for k, v in task.items() if k != 'path'}, ensure_ascii=False)
+        now = time.time()
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute("SELECT * FROM jobs WHERE path = ? AND status IN ('queued', 'running')",
+                                 (path,)).fetchone()
+                if row is not None and 'lease' in json.loads(row['payload']):
+                    # held by lease(): the lease row is queued as this job once it is released
+                    db.execute("UPDATE jobs SET coalesced = coalesced + 1, priority = MIN(priority, ?), "
+                               "payload = CASE WHEN json_extract(payload, '$.queued') IS NULL "
+                               "THEN json_set(payload, '$.queued', json(?)) ELSE payload END WHERE id = ?",
+                               (priority, payload, row['id']))
+                    job_id = row['id']
+                elif row is not None:
+                    db.execute('UPDATE jobs SET coalesced = coalesced + 1, priority = MIN(priority, ?) '
+                               "WHERE id = ? AND status = 'queued'", (priority, row['id']))
+                    db.execute("UPDATE jobs SET coalesced = coalesced + 1 WHERE id = ? AND status = 'running'",
+                               (row['id'],))
+                    job_id = row['id']
+                else:
+                    depth = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                    if depth >= self.max_depth:
+                        raise queue.Full('image queue is full')
+                    job_id = db.execute(
+                        "INSERT INTO jobs (path, payload, priority, status, run_after, created) "
+                        "VALUES (?, ?, ?, 'queued', ?, ?)", (path, payload, priority, now, now)).lastrowid
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            job = self._job(db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+        with self._cond:
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._db() as db:
+            return self._job(db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it already ended."""
+        with self._db() as db:
+            cur = db.execute("UPDATE jobs SET status = 'cancelled', finished = ?, error = 'cancelled' "
+                             "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+            if cur.rowcount:
+                return True
+            # the owning dispatcher (possibly another process) kills it on its next poll
+            cur = db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        with self._cond:
+            self._cond.notify()
+        return bool(cur.rowcount)
+
+    def jobs(self, limit=200, match=None):
+        """Active jobs in the order they will run, then recent ones; `match`
+        ({payload key: value}) narrows the list, e.g. to one tenant."""
+        where, args = '', []
+        if match:
+            where = 'WHERE ' + ' AND '.join('json_extract(payload, ?) IS ?' for _ in match)
+            for key, value in match.items():
+                args += [f'$.{key}', value]
+        with self._db() as db:
+            rows = db.execute(
+                f"SELECT * FROM jobs {where} ORDER BY status != 'running', status != 'queued', "
+                "CASE WHEN status IN ('queued', 'running') THEN priority ELSE 0 END, "
+                "CASE WHEN status IN ('queued', 'running') THEN id ELSE -id END LIMIT ?", args + [limit]).fetchall()
+        return [self._job(r) for r in rows]
+
+    @contextlib.contextmanager
+    def lease(self, path, holder):
+        """Hold the job lease on `path` while working on it outside the
+        dispatcher (e.g. `flask reprocess-uploads`). Yields False, without
+        waiting, if a job for `path` is queued or running. While held, the
+        lease is renewed every third of lease_time, and a job submitted for
+        `path` is kept on the lease row and queued when the lease is released.
+        A lease left behind by a crash expires and is dropped, not run (its
+        submitted job is queued then)."""
+        now = time.time()
+        payload = json.dumps({'lease': holder})
+        with self._db() as db:
+            try:
+                job_id = db.execute(
+                    "INSERT INTO jobs (path, payload, priority, status, attempts, run_after, lease_owner, "
+                    "lease_expires, created, started) VALUES (?, ?, ?, 'running', 1, ?, ?, ?, ?, ?)",
+                    (path, payload, PRIORITY_BULK, now, f'{holder}:{socket.gethostname()}:{os.getpid()}',
+                     now + self.lease_time, now, now)).lastrowid
+            except sqlite3.IntegrityError:
+                job_id = None
+        released = threading.Event()
+
+        def renew():
+            # like the dispatcher renews the leases of its running jobs
+            while not released.wait(self.lease_time / 3):
+                try:
+                    with self._db() as db:
+                        db.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running'",
+                                   (time.time() + self.lease_time, job_id))
+                except sqlite3.Error:
+                    logging.exception('renewing the job lease on %s failed', path)
+                    METRICS.swallowed('image_job_lease')
+
+        renewer = None
+        if job_id is not None:
+            renewer = threading.Thread(target=renew, name='job-lease', daemon=True)
+            renewer.start()
+        error = 'failed'
+        try:
+            yield job_id is not None
+            error = None
+        finally:
+            if renewer is not None:
+                released.set()
+                renewer.join()
+                now = time.time()
+                with self._db() as db:
+                    db.execute('BEGIN IMMEDIATE')
+                    try:
+                        requeued = db.execute(
+                            "UPDATE jobs SET status = 'queued', payload = json_extract(payload, '$.queued'), "
+                            "attempts = 0, run_after = ?, lease_owner = NULL, lease_expires = NULL, started = NULL "
+                            "WHERE id = ? AND status = 'running' AND json_extract(payload, '$.queued') IS NOT NULL",
+                            (now, job_id)).rowcount
+                        db.execute("UPDATE jobs SET status = ?, finished = ?, error = ?, lease_owner = NULL "
+                                   "WHERE id = ? AND status = 'running'",
+                                   ('failed' if error else 'done', now, error, job_id))
+                        db.execute('COMMIT')
+                    except BaseException:
+                        db.execute('ROLLBACK')
+                        raise
+                if requeued:
+                    with self._cond:
+                        self._cond.notify()
+
+    def sweep(self):
+        """Re-queue jobs whose lease expired and prune old finished jobs."""
+        now = time.time()
+        self._last_sweep = now
+        with self._db() as db:
+            db.execute("UPDATE jobs SET status = 'queued', payload = json_extract(payload, '$.queued'), "
+                       "attempts = 0, run_after = ?, lease_owner = NULL, lease_expires = NULL, started = NULL "
+                       "WHERE status = 'running' AND lease_expires < ? AND json_extract(payload, '$.lease') "
+                       "IS NOT NULL AND json_extract(payload, '$.queued') IS NOT NULL", (now, now))
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, error = 'lease expired', lease_owner = NULL "
+                       "WHERE status = 'running' AND lease_expires < ? AND json_extract(payload, '$.lease') "
+                       "IS NOT NULL", (now, now))
+            cur = db.execute(
+                "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires = NULL, run_after = ?, "
+                "error = 'lease expired' WHERE status = 'running' AND lease_expires < ?", (now, now))
+            if cur.rowcount:
+                logging.warning('re-queued %d image jobs with expired leases', cur.rowcount)
+            db.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND id NOT IN "
+                "(SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') ORDER BY id DESC LIMIT ?)",
+                (self.keep_finished,))
+            return cur.rowcount
+
+    def _claim(self, db):
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute("SELECT * FROM jobs WHERE status = 'queued' AND run_after <= ? "
+                             "ORDER BY priority, id LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+                           "attempts = attempts + 1, started = ? WHERE id = ?",
+                           (self._owner, now + self.lease_time, now, row['id']))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return self.get(row['id']) if row is not None else None
+
+    def _finish(self, db, job, error):
+        now = time.time()
+        if error is None:
+            db.execute("UPDATE jobs SET status = 'done', finished = ?, error = NULL, lease_owner = NULL "
+                       "WHERE id = ?", (now, job['id']))
+            job.update(status='done', finished=now, error=None)
+        elif error == 'shutdown':
+            # interrupted, not failed: does not count as an attempt
+            db.execute("UPDATE jobs SET status = 'queued', run_after = ?, attempts = attempts - 1, "
+                       "lease_owner = NULL, lease_expires = NULL WHERE id = ?", (now, job['id']))
+            job.update(status='queued', attempts=job['attempts'] - 1)
+        elif error != 'cancelled' and job['attempts'] < self.max_attempts:
+            delay = self.backoff * 2 ** (job['attempts'] - 1)
+            db.execute("UPDATE jobs SET status = 'queued', run_after = ?, error = ?, lease_owner = NULL, "
+                       "lease_expires = NULL WHERE id = ?", (now + delay, error, job['id']))
+            job.update(status='queued', error=error)
+        else:
+            status = 'cancelled' if error == 'cancelled' else 'failed'
+            db.execute("UPDATE jobs SET status = ?, finished = ?, error = ?, lease_owner = NULL WHERE id = ?",
+                       (status, now, error, job['id']))
+            job.update(status=status, finished=now, error=error)
+
+    def _dispatch(self):
+        while True:
+            ended = []
+            with self._db() as db:
+                with self._cond:
+                    stopping = self._stopping
+                if stopping and not self._running:
+                    return
+                if time.time() - self._last_sweep > 30:
+                    self.sweep()
+                while not stopping and len(self._running) < self.workers:
+                    job = self._claim(db)
+                    if job is None:
+                        break
+                    if self.preload is not None:
+                        try:
+                            self.preload()
+                        except Exception:
+                            logging.exception('image job preload failed')
+                            METRICS.swallowed('image_job_preload')
+                        self.preload = None
+                    proc = self._ctx.Process(target=self.handler, args=(job['path'],), daemon=True)
+                    proc.start()
+                    self._running[job['id']] = (job, proc)
+                now = time.time()
+                cancelled = set()
+                if self._running:
+                    ids = list(self._running)
+                    # renew our leases and pick up cancellation requests
+                    db.execute(f"UPDATE jobs SET lease_expires = ? WHERE id IN ({','.join('?' * len(ids))})",
+                               [now + self.lease_time] + ids)
+                    cancelled = {r[0] for r in db.execute(
+                        f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({','.join('?' * len(ids))})", ids)}
+                for job_id, (job, proc) in list(self._running.items()):
+                    error = None
+                    if proc.is_alive():
+                        if job_id in cancelled:
+                            error = 'cancelled'
+                        elif now - job['started'] > self.timeout:
+                            error = 'timeout'
+                        elif stopping and self._deadline is not None and now > self._deadline:
+                            error = 'shutdown'
+                        else:
+                            continue
+                        proc.kill()
+                    proc.join()
+                    del self._running[job_id]
+                    if error is None and proc.exitcode != 0:
+                        error = f'exit code {proc.exitcode}'
+                    self._finish(db, job, error)
+                    METRICS.observe('image_job_seconds', now - job['started'], status=job['status'])
+                    ended.append(job)
+            for job in ended:
+                if job['status'] == 'queued':
+                    continue
+                for callback in self.on_done:
+                    try:
+                        callback(job)
+                    except Exception:
+                        logging.exception('image job callback failed')
+                        METRICS.swallowed('image_job_callback')
+            if not ended:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(0.1 if self._running else self.poll_interval)
+
+
+def _image_job_done(job):
+    if job['status'] == 'cancelled':
+        return
+    tenant = TENANTS.get(job['tenant']) if job.get('tenant') else None
+    if job.get('tenant') and tenant is None:
+        logging.warning('image job %s finished for unknown tenant %s', job['id'], job['tenant'])
+        return
+    with use_tenant(tenant):
+        _record_job_result(job)
+
+
+def _record_job_result(job):
+    path = job['path']
+    if job.get('digest'):
+        # resized variants are rebuilt lazily from the enhanced blob (or new PDF preview)
+        DERIVATIVES.purge(job['digest'])
+        try:
+            meta = media_meta(path)
+            if meta:
+                record_media_meta(job['digest'], meta)
+        except Exception:
+            logging.exception('could not compute placeholder for %s', path)
+            METRICS.swallowed('placeholder')
+    elif not path.lower().endswith('.pdf'):
+        thumb_path = os.path.join(THUMB_FOLDER, os.path.basename(path))
+        make_thumbnail(path, thumb_path)
+    # notify clients that processing finished for this item
+    try:
+        payload = {'kind': job.get('kind'), 'name': job.get('name'),
+                   'url': job.get('url') or f"/static/uploads/{os.path.basename(path)}",
+                   'thumb': job.get('thumb') or f"/static/uploads/thumbs/{os.path.basename(path)}"}
+        send_sse('processed', payload)
+    except Exception:
+        METRICS.swallowed('event_publish')
+
+
+# Background processing: advanced_enhance runs in child processes, jobs are
+# shared between gunicorn workers through JOBS_DB_PATH
+PROCESS_QUEUE = ImageJobEngine(process_upload, JOBS_DB_PATH, workers=IMAGE_WORKERS,
+                               max_depth=IMAGE_QUEUE_MAX, timeout=IMAGE_JOB_TIMEOUT,
+                               preload=load_image_libs)
+PROCESS_QUEUE.on_done.append(_image_job_done)
+
+
+class ReadOnlyDict(dict):
+    """dict that refuses in-place changes; handed out by ProfileStore so request
+    handlers cannot mutate the shared cached document."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('profile data is read-only; use thaw() to get a mutable copy')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def copy(self):
+        return thaw(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class ReadOnlyList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('profile data is read-only; use thaw() to get a mutable copy')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def copy(self):
+        return thaw(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(obj):
+    if isinstance(obj, dict):
+        return ReadOnlyDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return ReadOnlyList(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """Return a plain, mutable deep copy of a (possibly frozen) document."""
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+class PreconditionFailed(Exception):
+    """Raised when an If-Match ETag no longer matches the stored document."""
+
+
+class PatchError(ValueError):
+    """Raised for malformed or inapplicable JSON Patch / merge-patch bodies."""
+
+
+def _pointer_parts(pointer):
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchError(f'invalid JSON pointer: {pointer!r}')
+    return [p.replace('~1', '/').replace('~0', '~') for p in pointer[1:].split('/')]
+
+
+def _pointer_index(container, part, allow_end=False):
+    if part == '-' and allow_end:
+        return len(container)
+    if not part.isdigit():
+        raise PatchError(f'invalid array index: {part!r}')
+    idx = int(part)
+    if idx > len(container) or (idx == len(container) and not allow_end):
+        raise PatchError(f'array index out of range: {idx}')
+    return idx
+
+
+def _pointer_parent(doc, pointer):
+    parts = _pointer_parts(pointer)
+    if not parts:
+        raise PatchError('operation on the document root is not supported')
+    target = doc
+    for part in parts[:-1]:
+        try:
+            target = target[_pointer_index(target, part)] if isinstance(target, list) else target[part]
+        except (KeyError, TypeError):
+            raise PatchError(f'path not found: {pointer}')
+    if not isinstance(target, (dict, list)):
+        raise PatchError(f'path not found: {pointer}')
+    return target, parts[-1]
+
+
+def _pointer_get(doc, pointer):
+    target, key = _pointer_parent(doc, pointer)
+    try:
+        return target[_pointer_index(target, key)] if isinstance(target, list) else target[key]
+    except KeyError:
+        raise PatchError(f'path not found: {pointer}')
+
+
+def _pointer_remove(doc, pointer):
+    target, key = _pointer_parent(doc, pointer)
+    try:
+        return target.pop(_pointer_index(target, key)) if isinstance(target, list) else target.pop(key)
+    except KeyError:
+        raise PatchError(f'path not found: {pointer}')
+
+
+def _pointer_add(doc, pointer, value):
+    target, key = _pointer_parent(doc, pointer)
+    if isinstance(target, list):
+        target.insert(_pointer_index(target, key, allow_end=True), value)
+    else:
+        target[key] = value
+
+
+def apply_json_patch(doc, ops):
+    """Apply an RFC 6902 JSON Patch to a mutable document (in place) and return it."""
+    if not isinstance(ops, list):
+        raise PatchError('JSON Patch body must be an array of operations')
+    for op in ops:
+        if not isinstance(op, dict) or 'op' not in op or 'path' not in op:
+            raise PatchError(f'invalid patch operation: {op!r}')
+        kind, path = op['op'], op['path']
+        if kind in ('add', 'replace', 'test') and 'value' not in op:
+            raise PatchError(f'{kind} requires a value')
+        if kind == 'add':
+            _pointer_add(doc, path, thaw(op['value']))
+        elif kind == 'remove':
+            _pointer_remove(doc, path)
+        elif kind == 'replace':
+            _pointer_get(doc, path)
+            target, key = _pointer_parent(doc, path)
+            if isinstance(target, list):
+                target[_pointer_index(target, key)] = thaw(op['value'])
+            else:
+                target[key] = thaw(op['value'])
+        elif kind == 'move':
+            value = _pointer_remove(doc, op.get('from', ''))
+            _pointer_add(doc, path, value)
+        elif kind == 'copy':
+            _pointer_add(doc, path, thaw(_pointer_get(doc, op.get('from', ''))))
+        elif kind == 'test':
+            if _pointer_get(doc, path) != op['value']:
+                raise PatchError(f'test failed at {path}')
+        else:
+            raise PatchError(f'unknown patch op: {kind!r}')
+    return doc
+
+
+def apply_merge_patch(doc, patch):
+    """Apply an RFC 7396 merge patch and return the result."""
+    if not isinstance(patch, dict):
+        return thaw(patch)
+    if not isinstance(doc, dict):
+        doc = {}
+    for k, v in patch.items():
+        if v is None:
+            doc.pop(k, None)
+        else:
+            doc[k] = apply_merge_patch(doc.get(k), v)
+    return doc
+
+
+def merge_diff(old, new):
+    """Smallest RFC 7396 merge patch that turns `old` into `new`."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return thaw(new)
+    out = {}
+    for k in old:
+        if k not in new:
+            out[k] = None
+    for k, v in new.items():
+        if k not in old:
+            out[k] = thaw(v)
+        elif old[k] != v:
+            out[k] = merge_diff(old[k], v)
+    return out
+
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+JOURNAL_MAX_ENTRIES = int(os.environ.get('DATA_JOURNAL_MAX', '500'))
+JOURNAL_KEEP_ENTRIES = int(os.environ.get('DATA_JOURNAL_KEEP', '100'))
+
+
+def _atomic_write(path, data):
+    """Write bytes to `path` via temp file + fsync + rename so readers never see
+    a partially written file."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    try:
+        dfd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+    except OSError:
+        pass
+
+
+class ProfileStore:
+    """In-process cache of data.json.
+
+    The parsed document is kept in memory and only re-read when the file's
+    mtime, size or inode changes (e.g. another gunicorn worker saved it), or
+    when save() replaces it. Every change bumps `version`, which other caches
+    can use as part of their keys.
+
+    Writes go through a temp file + rename and are recorded in an append-only
+    journal (`<path>.journal`, one JSON object per line) that is compacted to
+    the most recent entries once it grows past JOURNAL_MAX_ENTRIES.
+    """
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        self.version = 0
+        self.etag = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._view = None
+        self._stamp = None
+        self._journal_seq = None
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+        self._flock_depth = 0
+        # callables invoked as listener(before, after) after every write
+        self.listeners = []
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self):
+        stamp = self._file_stamp()
+        with self._lock:
+            if self._view is not None and stamp is not None and stamp == self._stamp:
+                self.hits += 1
+                return self._view
+            self.misses += 1
+            if stamp is None:
+                # write default
+                self.save(self.default)
+                return self._view
+            try:
+                with METRICS.timer('profile_store_seconds', op='load'):
+                    with open(self.path, 'rb') as f:
+                        raw = f.read()
+                    data = json.loads(raw.decode('utf-8'))
+            except Exception:
+                logging.exception('failed to read %s', self.path)
+                METRICS.swallowed('data_load')
+                # keep serving the last good copy rather than the defaults
+                if self._view is None:
+                    self._set(thaw(self.default), None, _etag_for(b''))
+                return self._view
+            if self._view is not None:
+                self.reloads += 1
+            self._set(data, stamp, _etag_for(raw))
+            return self._view
+
+    def save(self, obj, op='replace', change=None):
+        """Atomically replace the stored document with `obj`."""
+        with self._locked():
+            if self._file_stamp() is not None:
+                self.get()
+            self._write(thaw(obj), op, change)
+
+    def update(self, mutate, if_match=None, op='patch', change=None):
+        """Read-modify-write under an exclusive (cross-process) lock.
+
+        `mutate` receives a mutable copy of the current document and returns
+        the new one. Raises PreconditionFailed if `if_match` is given and does
+        not match the current ETag.
+        """
+        with self._locked():
+            # force a stat check so we see writes from other processes
+            current = self.get()
+            if if_match and not etag_matches(if_match, self.etag):
+                raise PreconditionFailed(self.etag)
+            new = mutate(thaw(current))
+            self._write(new, op, change)
+            return self._view
+
+    def _write(self, obj, op, change):
+        before = self._view
+        with METRICS.timer('profile_store_seconds', op='save'):
+            raw = json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+            base_etag = self.etag
+            etag = _etag_for(raw)
+            if change is None:
+                change = merge_diff(before if before is not None else {}, obj)
+            self._append_journal({'op': op, 'base': base_etag, 'etag': etag, 'change': change})
+            _atomic_write(self.path, raw)
+            self._set(obj, self._file_stamp(), etag)
+        for listener in list(self.listeners):
+            try:
+                listener(before, self._view)
+            except Exception:
+                logging.exception('data listener failed')
+                METRICS.swallowed('data_listener')
+
+    def _set(self, data, stamp, etag):
+        self._view = freeze(data)
+        self._stamp = stamp
+        self.etag = etag
+        self.version += 1
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # thread lock for this process plus flock() so gunicorn workers
+        # serialize their read-modify-write cycles
+        with self._lock:
+            fh = None
+            if fcntl is not None and self._flock_depth == 0:
+                try:
+                    fh = open(self.lock_path, 'a')
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                except OSError:
+                    fh = None
+            self._flock_depth += 1
+            try:
+                yield
+            finally:
+                self._flock_depth -= 1
+                if fh is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+                    fh.close()
+
+    def _append_journal(self, entry):
+        if self._journal_seq is None:
+            self._journal_seq, self._journal_entries = self._scan_journal()
+        self._journal_seq += 1
+        self._journal_entries += 1
+        entry = dict(entry, seq=self._journal_seq, time=time.time())
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            if self._journal_entries > JOURNAL_MAX_ENTRIES:
+                self.compact_journal()
+        except OSError:
+            logging.exception('failed to append to %s', self.journal_path)
+
+    def _scan_journal(self):
+        seq, count = 0, 0
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        seq = max(seq, int(json.loads(line).get('seq', 0)))
+                        count += 1
+                    except Exception:
+                        continue
+        except OSError:
+            pass
+        return seq, count
+
+    def read_journal(self, since=0):
+        out = []
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except Exception:
+                        continue
+                    if entry.get('seq', 0) > since:
+                        out.append(entry)
+        except OSError:
+            pass
+        return out
+
+    def compact_journal(self, keep=None):
+        """Drop all but the newest `keep` journal entries (data.json is the snapshot)."""
+        keep = JOURNAL_KEEP_ENTRIES if keep is None else keep
+        with self._lock:
+            entries = self.read_journal()[-keep:] if keep else []
+            raw = ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entries)
+            _atomic_write(self.journal_path, raw.encode('utf-8'))
+            self._journal_entries = len(entries)
+
+    def invalidate(self):
+        with self._lock:
+            self._view = None
+            self._stamp = None
+
+    @property
+    def modified(self):
+        """mtime (seconds) of the document currently served, if known."""
+        stamp = self._stamp
+        return stamp[0] / 1e9 if stamp else None
+
+    def stats(self):
+        with self._lock:
+            return {'version': self.version, 'etag': self.etag, 'hits': self.hits,
+                    'misses': self.misses, 'reloads': self.reloads,
+                    'journal_entries': self._journal_entries}
+
+
+def _etag_for(raw):
+    return '"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+
+def etag_matches(header, etag):
+    """Check an If-Match / If-None-Match header value against a strong ETag."""
+    if not header or not etag:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with an optional per-entry TTL (seconds)."""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is not self._MISSING:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def values(self):
+        """Snapshot of the cached values, oldest first (expired ones included)."""
+        with self._lock:
+            return [value for value, _ in self._data.values()]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'hit_ratio': round(self.hits / total, 4) if total else None}
+
+
+PROFILE_STORE = ProfileStore(DATA_PATH, PROFILE)
+
+
+def load_data():
+    """Return the current profile document (of the request's tenant) as a read-only view."""
+    return current_tenant().store.get()
+
+
+def save_data(obj):
+    current_tenant().store.save(obj)
+
+
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', '64'))
+# templates and static references only change on deploy, i.e. with a new process
+_STARTED_AT = time.time()
+
+
+class PageCache:
+    """Rendered public pages keyed on (endpoint, data version, lang, ui_mode).
+
+    Entries carry a strong ETag (hash of the body) and Last-Modified so
+    browsers revalidate with a 304. The data version changes whenever
+    data.json is written (by this or any other process), and every save
+    also clears the cache through a ProfileStore listener.
+    """
+
+    def __init__(self, maxsize=64):
+        self.entries = LRUCache(maxsize=maxsize)
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.not_modified = 0
+
+    def clear(self, before=None, after=None):
+        self.entries.clear()
+
+    def size(self):
+        """Bytes of rendered HTML held."""
+        return sum(len(entry[0]) for entry in self.entries.values())
+
+    def respond(self, render, store):
+        data = store.get()
+        lang = session.get('lang', 'english')
+        key = (request.endpoint, store.version, lang, data.get('ui_mode') or '')
+        entry = self.entries.get(key)
+        if entry is None:
+            start = time.perf_counter()
+            body = render(data, lang).encode('utf-8')
+            elapsed = time.perf_counter() - start
+            self.renders += 1
+            self.render_seconds += elapsed
+            entry = (body, hashlib.sha1(body).hexdigest()[:20], max(store.modified or 0, _STARTED_AT))
+            self.entries.set(key, entry)
+        body, etag, modified = entry
+        resp = Response(body, mimetype='text/html')
+        resp.set_etag(etag)
+        resp.last_modified = modified
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp = resp.make_conditional(request)
+        if resp.status_code == 304:
+            self.not_modified += 1
+        return resp
+
+    def stats(self):
+        return dict(self.entries.stats(), renders=self.renders, not_modified=self.not_modified,
+                    avg_render_ms=round(self.render_seconds * 1000 / self.renders, 3) if self.renders else None)
+
+
+PAGES = PageCache(PAGE_CACHE_SIZE)
+PROFILE_STORE.listeners.append(PAGES.clear)
+
+
+def cached_page(render):
+    """Serve a view through the tenant's PageCache (PAGES in the single-portfolio
+    mode); `render(data, lang)` returns the HTML."""
+    @wraps(render)
+    def view():
+        tenant = current_tenant()
+        return tenant.pages.respond(render, tenant.store)
+    return view
+
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class BlobStore:
+    """Content-addressed storage for uploads.
+
+    Files are stored once under the SHA-256 of the uploaded bytes
+    (`blobs/<h[:2]>/<h>.<ext>`, thumbnail in `thumbs/<h>.<ext>`); uploading
+    the same content again reuses the existing blob. The key is the hash of
+    the *original* bytes, so a blob keeps its address after enhance_image()
+    rewrites it. Reference counts are the number of URLs in data.json that
+    point at a blob; a blob whose count drops to zero on save is deleted.
+    Each tenant has a store of its own under `uploads/tenants/<name>/`, whose
+    URLs (and /img/t/<name>/ variants) name the tenant.
+    """
+
+    URL_RE = re.compile(r'(?:/static/uploads/(?:tenants/(?P<tenant>[a-z0-9-]+)/)?(?:blobs/[0-9a-f]{2}|thumbs)'
+                        r'|/img(?:/t/(?P<img_tenant>[a-z0-9-]+))?)/(?P<digest>[0-9a-f]{64})[./]')
+
+    def __init__(self, root, thumb_root, url_root='/static/uploads', img_root='/img'):
+        self.root = root
+        self.thumb_root = thumb_root
+        self.url_root = url_root
+        self.img_root = img_root
+        # callables invoked with the digest of every released blob
+        self.on_release = []
+
+    def path_for(self, digest, ext):
+        return os.path.join(self.root, digest[:2], f'{digest}.{ext}')
+
+    def url_for(self, digest, ext):
+        return f'{self.url_root}/blobs/{digest[:2]}/{digest}.{ext}'
+
+    def thumb_url_for(self, digest, ext):
+        # thumbnails are served by the on-demand derivative service
+        return f'{self.img_root}/{digest}/{DERIVED_THUMB_WIDTH}.auto'
+
+    def find(self, digest):
+        matches = glob.glob(os.path.join(self.root, digest[:2], digest + '.*'))
+        return matches[0] if matches else None
+
+    def ingest(self, stream):
+        """Copy `stream` to a temp file in chunks while hashing it.
+
+        Returns (digest, size, temp_path); pass the temp path to commit()."""
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(prefix='.upload-', suffix='.part', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return sha.hexdigest(), size, tmp
+
+    def commit(self, tmp, digest, ext):
+        """Move an ingested temp file into place; returns (path, created)."""
+        path = self.path_for(digest, ext)
+        if os.path.exists(path):
+            os.unlink(tmp)
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+        return path, True
+
+    def refcounts(self, doc):
+        counts = collections.Counter()
+
+        def walk(o):
+            if isinstance(o, dict):
+                for v in o.values():
+                    walk(v)
+            elif isinstance(o, list):
+                for v in o:
+                    walk(v)
+            elif isinstance(o, str) and '/static/uploads/' in o:
+                # count each referencing string once (url and thumb of one entry share a hash)
+                counts.update({m.group('digest') for m in self.URL_RE.finditer(o)})
+
+        walk(doc)
+        return counts
+
+    def release(self, digest):
+        """Delete every stored file for `digest` (blob, original and thumbnail)."""
+        blobs = glob.glob(os.path.join(self.root, digest[:2], digest + '.*'))
+        for path in blobs:
+            drop_original(path)
+        for path in blobs + glob.glob(os.path.join(self.thumb_root, digest + '.*')):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        for callback in self.on_release:
+            callback(digest)
+
+    def collect(self, before, after):
+        """ProfileStore listener: free blobs that `after` no longer references."""
+        if before is None:
+            return
+        dropped = set(self.refcounts(before)) - set(self.refcounts(after))
+        for digest in dropped:
+            logging.info('releasing unreferenced upload %s', digest)
+            self.release(digest)
+
+
+BLOBS = BlobStore(BLOB_FOLDER, THUMB_FOLDER)
+PROFILE_STORE.listeners.append(BLOBS.collect)
+
+
+DERIVED_FOLDER = os.path.join(UPLOAD_FOLDER, 'derived')
+DERIVED_WIDTHS = (160, 320, 480, 640, 960, 1280, 1920)
+DERIVED_THUMB_WIDTH = 480
+DERIVED_CACHE_BYTES = int(os.environ.get('DERIVED_CACHE_MB', '256')) * 1024 * 1024
+DERIVED_QUALITY = {'avif': 55, 'webp': 80, 'jpg': 82, 'png': None}
+DERIVED_MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpg': 'image/jpeg', 'png': 'image/png'}
+
+
+def _pil_can_save(fmt):
+    try:
+        from PIL import features
+        return bool(features.check(fmt))
+    except Exception:
+        return False
+
+
+DERIVED_FORMATS = {'jpg', 'png'} | {f for f in ('webp', 'avif') if _pil_can_save(f)}
+
+
+class DerivativeCache:
+    """Lazily built, resized variants of blob images.
+
+    Variants are generated on first request for a fixed set of widths and
+    formats and kept under `root/<digest>/<width>.<fmt>`. The directory is
+    bounded to `max_bytes`; least recently used files are evicted first
+    (hits touch the file's mtime so the order survives restarts and is
+    shared between worker processes).
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = None  # OrderedDict path -> size, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def path_for(self, digest, width, fmt):
+        return os.path.join(self.root, digest, f'{width}.{fmt}')
+
+    def _load_index(self):
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, p, st.st_size))
+        entries.sort()
+        self._index = collections.OrderedDict((p, size) for _, p, size in entries)
+        self._bytes = sum(self._index.values())
+
+    def get(self, digest, source, width, fmt):
+        """Return the path of the (width, fmt) variant of `source`, building it if needed."""
+        path = self.path_for(digest, width, fmt)
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if path in self._index and os.path.exists(path):
+                self.hits += 1
+                self._index.move_to_end(path)
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+            self.misses += 1
+            building = self._building.setdefault(path, threading.Lock())
+        # one thread builds a given variant; concurrent requests wait for it
+        with building:
+            if not os.path.exists(path):
+                self._build(source, path, width, fmt)
+        with self._lock:
+            self._building.pop(path, None)
+            size = os.path.getsize(path)
+            self._bytes += size - self._index.pop(path, 0)
+            self._index[path] = size
+            self._evict()
+        return path
+
+    def prime(self, digest, img, width, formats):
+        """Write (width, fmt) variants from an already decoded, upright `img`
+        (e.g. right after upload) so the first requests need no decode."""
+        for fmt in formats:
+            path = self.path_for(digest, width, fmt)
+            try:
+                self._render(img, path, width, fmt)
+            except Exception:
+                logging.exception('could not pre-render %s', path)
+                METRICS.swallowed('derivative')
+                continue
+            with self._lock:
+                if self._index is None:
+                    self._load_index()
+                size = os.path.getsize(path)
+                self._bytes += size - self._index.pop(path, 0)
+                self._index[path] = size
+                self._evict()
+
+    def _build(self, source, path, width, fmt):
+        # decode at reduced scale when the target is much smaller (only the width is bounded)
+        self._render(open_image(source, (width, float('inf'))), path, width, fmt)
+
+    def _render(self, img, path, width, fmt):
+        icc = img.info.get('icc_profile')
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        if fmt in ('jpg', 'avif') and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        elif img.mode == 'P':
+            img = img.convert('RGBA')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buf = io.BytesIO()
+        options = {'optimize': True} if fmt in ('jpg', 'png') else {}
+        if DERIVED_QUALITY.get(fmt):
+            options['quality'] = DERIVED_QUALITY[fmt]
+        if fmt == 'jpg':
+            options['progressive'] = True
+        if icc:
+            options['icc_profile'] = icc
+        img.save(buf, format={'jpg': 'JPEG'}.get(fmt, fmt.upper()), **options)
+        _atomic_write(path, buf.getvalue())
+
+    def _evict(self):
+        # evict down to 90% so we don't evict on every miss once full
+        if self._bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        while self._index and self._bytes > target:
+            p, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
+
+    def purge(self, digest):
+        """Drop every variant of `digest` (source changed or was deleted)."""
+        folder = os.path.join(self.root, digest)
+        with self._lock:
+            if self._index is not None:
+                for p in [p for p in self._index if os.path.dirname(p) == folder]:
+                    self._bytes -= self._index.pop(p)
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'bytes': self._bytes, 'files': len(self._index or ())}
+
+
+DERIVATIVES = DerivativeCache(DERIVED_FOLDER, DERIVED_CACHE_BYTES)
+BLOBS.on_release.append(DERIVATIVES.purge)
+
+
+def _drop_pdf_preview(digest):
+    try:
+        os.unlink(os.path.join(PDF_PREVIEW_FOLDER, digest + '.png'))
+    except FileNotFoundError:
+        pass
+
+
+BLOBS.on_release.append(_drop_pdf_preview)
+
+
+def negotiate_image_format(accept, source_ext):
+    """Pick the smallest format the browser accepts (Accept header)."""
+    accept = accept or ''
+    for fmt in ('avif', 'webp'):
+        if fmt in DERIVED_FORMATS and DERIVED_MIMETYPES[fmt] in accept:
+            return fmt
+    return 'png' if source_ext in ('png', 'gif') else 'jpg'
+
+
+def _blob_ref(url):
+    """(variant URL root, digest) of a blob URL, or (None, None)."""
+    m = BlobStore.URL_RE.search(url or '') if isinstance(url, str) else None
+    if not m:
+        return None, None
+    tenant = m.group('tenant') or m.group('img_tenant')
+    return (f'/img/t/{tenant}' if tenant else '/img'), m.group('digest')
+
+
+def _blob_digest(url):
+    return _blob_ref(url)[1]
+
+
+@app.template_filter('variant')
+def variant_filter(url, width=DERIVED_THUMB_WIDTH):
+    """URL of one resized variant (PDFs: of the first page) of a blob URL, or ''."""
+    root, digest = _blob_ref(url)
+    return f'{root}/{digest}/{width}.auto' if digest else ''
+
+
+@app.template_filter('srcset')
+def srcset_filter(url):
+    """srcset attribute value for a blob image URL ('' for anything else)."""
+    root, digest = _blob_ref(url)
+    if not digest:
+        return ''
+    return ', '.join(f'{root}/{digest}/{w}.auto {w}w' for w in DERIVED_WIDTHS)
+
+
+@app.route('/img/<digest>/<int:width>.<fmt>')
+@app.route('/img/t/<tenant>/<digest>/<int:width>.<fmt>')
+def image_variant(digest, width, fmt, tenant=None):
+    if not re.fullmatch(r'[0-9a-f]{64}', digest) or width not in DERIVED_WIDTHS:
+        abort(404)
+    # variants name the tenant whose upload namespace holds the original
+    blobs = BLOBS
+    if tenant is not None:
+        owner = TENANTS.get(tenant) if TENANT_MODE else None
+        if owner is None:
+            abort(404)
+        blobs = owner.blobs
+    source = blobs.find(digest)
+    if not source:
+        abort(404)
+    ext = source.rsplit('.', 1)[-1].lower()
+    if ext == 'pdf':
+        # first-page preview, normally rendered by the upload job already
+        try:
+            source = render_pdf_preview(source)
+        except Exception:
+            logging.exception('PDF preview failed for %s', digest)
+            METRICS.swallowed('pdf_preview')
+            source = None
+        if not source:
+            abort(404)
+        ext = 'png'
+    elif ext not in IMAGE_EXTS or ext == 'svg':
+        abort(404)
+    negotiated = fmt == 'auto'
+    if negotiated:
+        fmt = negotiate_image_format(request.headers.get('Accept'), ext)
+    elif fmt not in DERIVED_FORMATS:
+        abort(404)
+    try:
+        path = DERIVATIVES.get(digest, source, width, fmt)
+    except Exception:
+        logging.exception('failed to build %s/%s.%s', digest, width, fmt)
+        METRICS.swallowed('derivative')
+        abort(500)
+    resp = send_file(path, mimetype=DERIVED_MIMETYPES[fmt], conditional=True, max_age=86400)
+    if negotiated:
+        resp.vary.add('Accept')
+    return resp
+
+
+# Near-duplicate detection: uploads get a 64-bit pHash (DCT of a 32x32
+# grayscale copy) and dHash (gradient of a 9x8 copy), computed with NumPy
+# from the image the upload already decoded. Hashes are stored in
+# NEAR_DUPS_DB_PATH and mirrored in compact arrays per process, so finding
+# images within a Hamming distance is one vectorized pass. An upload that
+# is a near-duplicate of a stored image is not queued for enhancement.
+NEAR_DUPS_DB_PATH = os.environ.get('NEAR_DUPS_DB_PATH', os.path.join(os.path.dirname(__file__), 'phash.sqlite3'))
+# both hashes have to be this close (of 64 bits) for two images to count as near-duplicates
+PHASH_MAX_DISTANCE = int(os.environ.get('PHASH_MAX_DISTANCE', '10'))
+DHASH_MAX_DISTANCE = int(os.environ.get('DHASH_MAX_DISTANCE', '14'))
+NEAR_DUPS_LIMIT = 5
+
+
+@lru_cache(maxsize=1)
+def _dct_rows(n=32, keep=8):
+    # the first `keep` rows of the orthonormal DCT-II matrix of size n
+    k = np.arange(keep)[:, None]
+    x = np.arange(n)[None, :]
+    rows = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    rows[0] /= np.sqrt(2)
+    return rows
+
+
+def _pack_bits(bits):
+    return int(np.packbits(bits.astype(np.uint8)).view('>u8')[0])
+
+
+def perceptual_hashes(img):
+    """(pHash, dHash) of a PIL image as unsigned 64-bit ints, or None without NumPy."""
+    load_image_libs()
+    if not NUMPY_AVAILABLE:
+        return None
+    if img.mode not in ('L', 'RGB'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    # one resampling pass over the full image, the rest works on 64x64
+    small = img.resize((64, 64), Image.BILINEAR, reducing_gap=2.0).convert('L')
+    grid = np.asarray(small.resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    dct = _dct_rows()
+    low = (dct @ grid @ dct.T).ravel()
+    # compare the low frequencies with their median, leaving the DC term out of it
+    phash = _pack_bits(low > np.median(low[1:]))
+    grad = np.asarray(small.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    dhash = _pack_bits((grad[:, 1:] > grad[:, :-1]).ravel())
+    return phash, dhash
+
+
+def _popcounts(values):
+    count = getattr(np, 'bitwise_count', None)
+    if count is not None:
+        return count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+class NearDuplicateIndex(SQLiteBacked):
+    """Perceptual hashes of stored images with Hamming-distance lookup.
+
+    Rows live in SQLite (shared by worker processes); each process keeps
+    them in parallel arrays - pHash and dHash as array('Q'), the tenant as
+    an array('I') of small codes - which it extends from new rows before a
+    lookup and rebuilds only when rows were removed (counted in phash_meta). A lookup XORs the
+    query against every pHash at once and checks the dHash of the few
+    candidates, so it stays in the low milliseconds for 100k images.
+    """
+
+    row_factory = sqlite3.Row
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lookups = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS phash (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                   'tenant TEXT, url TEXT NOT NULL, path TEXT NOT NULL, digest TEXT NOT NULL, '
+                   'name TEXT, size INTEGER, phash INTEGER NOT NULL, dhash INTEGER NOT NULL, '
+                   'created REAL NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS phash_url ON phash(url)')
+        db.execute('CREATE INDEX IF NOT EXISTS phash_digest ON phash(digest)')
+        db.execute('CREATE TABLE IF NOT EXISTS phash_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        db.execute("INSERT OR IGNORE INTO phash_meta VALUES ('removed', 0)")
+
+    def _reset(self):
+        self._ids = array.array('q')
+        self._phash = array.array('Q')
+        self._dhash = array.array('Q')
+        self._tenants = array.array('I')
+        self._codes = {}
+        self._last_id = 0
+        self._removed = 0
+
+    def _code(self, tenant):
+        return self._codes.setdefault(tenant, len(self._codes))
+
+    def _refresh(self, db):
+        # SQLite stores signed 64-bit integers; hashes are kept as their two's complement
+        last, removed = db.execute("SELECT (SELECT COALESCE(MAX(id), 0) FROM phash), "
+                                   "(SELECT value FROM phash_meta WHERE key = 'removed')").fetchone()
+        if removed != self._removed:
+            # rows were deleted or replaced: rebuild
+            self.reloads += 1
+            self._reset()
+            self._removed = removed
+        elif last == self._last_id:
+            return
+        new = db.execute('SELECT id, tenant, phash, dhash FROM phash WHERE id > ? ORDER BY id',
+                         (self._last_id,)).fetchall()
+        for row in new:
+            self._ids.append(row['id'])
+            self._phash.append(row['phash'] & 0xFFFFFFFFFFFFFFFF)
+            self._dhash.append(row['dhash'] & 0xFFFFFFFFFFFFFFFF)
+            self._tenants.append(self._code(row['tenant']))
+        self._last_id = max(self._last_id, last)
+
+    @staticmethod
+    def _signed(value):
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    def add(self, url, path, digest, hashes, tenant=None, name=None, size=None):
+        """Record (or replace) the hashes of the image at `url`."""
+        phash, dhash = hashes
+        with self._db() as db:
+            db.execute('BEGIN IMMEDIATE')
+            self._remove(db, db.execute('SELECT id FROM phash WHERE url = ? AND tenant IS ?', (url, tenant)))
+            db.execute('INSERT INTO phash (tenant, url, path, digest, name, size, phash, dhash, created) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (tenant, url, path, digest, name, size, self._signed(phash), self._signed(dhash), time.time()))
+            db.execute('COMMIT')
+
+    @staticmethod
+    def _remove(db, rows):
+        ids = [(row['id'],) for row in rows]
+        if ids:
+            db.executemany('DELETE FROM phash WHERE id = ?', ids)
+            db.execute("UPDATE phash_meta SET value = value + ? WHERE key = 'removed'", (len(ids),))
+
+    def _matches(self, phash, dhash, tenant):
+        """[(row index, pHash distance, dHash distance)] of the tenant's near-duplicates."""
+        code = self._codes.get(tenant)
+        if code is None or not self._ids:
+            return []
+        hashes = np.frombuffer(self._phash, dtype=np.uint64)
+        near = _popcounts(hashes ^ np.uint64(phash)) <= PHASH_MAX_DISTANCE
+        near &= np.frombuffer(self._tenants, dtype=np.uint32) == code
+        found = []
+        for i in np.flatnonzero(near).tolist():
+            d_dist = (self._dhash[i] ^ dhash).bit_count()
+            if d_dist <= DHASH_MAX_DISTANCE:
+                found.append((i, (self._phash[i] ^ phash).bit_count(), d_dist))
+        return found
+
+    def lookup(self, hashes, tenant=None, exclude=None, limit=NEAR_DUPS_LIMIT):
+        """Stored images of `tenant` that look like `hashes`, closest first
+        (ignoring those with digest `exclude` and files that no longer exist)."""
+        if not NUMPY_AVAILABLE:
+            return []
+        phash, dhash = hashes
+        self.lookups += 1
+        with self._db() as db:
+            with self._lock:
+                self._refresh(db)
+                found = self._matches(phash, dhash, tenant)
+                ids = {self._ids[i]: dist for i, dist, _ in found}
+            if not ids:
+                return []
+            rows = db.execute(f"SELECT * FROM phash WHERE id IN ({','.join('?' * len(ids))})",
+                              list(ids)).fetchall()
+        results = [{'url': r['url'], 'name': r['name'], 'digest': r['digest'], 'distance': ids[r['id']]}
+                   for r in rows if r['digest'] != exclude and os.path.exists(r['path'])]
+        results.sort(key=lambda r: (r['distance'], r['url']))
+        return results[:limit]
+
+    def forget(self, digest, tenant=None):
+        """Drop the rows of a released blob whose file is gone."""
+        with self._db() as db:
+            rows = db.execute('SELECT id, path FROM phash WHERE digest = ? AND tenant IS ?',
+                              (digest, tenant)).fetchall()
+            self._remove(db, [r for r in rows if not os.path.exists(r['path'])])
+
+    def indexed(self, tenant=None):
+        """{url: digest} of the tenant's rows."""
+        with self._db() as db:
+            return dict(db.execute('SELECT url, digest FROM phash WHERE tenant IS ?', (tenant,)).fetchall())
+
+    def clusters(self, tenant=None, keep=lambda url: False):
+        """Groups of near-duplicate images of one tenant; each starts with the
+        image to keep (one `keep(url)` is true for, else the largest file)."""
+        load_image_libs()
+        with self._db() as db:
+            rows = db.execute('SELECT * FROM phash WHERE tenant IS ? ORDER BY id', (tenant,)).fetchall()
+        rows = [r for r in rows if os.path.exists(r['path'])]
+        if len(rows) < 2 or not NUMPY_AVAILABLE:
+            return []
+        p = np.array([r['phash'] for r in rows], dtype=np.int64).view(np.uint64)
+        d = np.array([r['dhash'] for r in rows], dtype=np.int64).view(np.uint64)
+        parent = list(range(len(rows)))
+
+        def root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i in range(len(rows) - 1):
+            near = ((_popcounts(p[i + 1:] ^ p[i]) <= PHASH_MAX_DISTANCE)
+                    & (_popcounts(d[i + 1:] ^ d[i]) <= DHASH_MAX_DISTANCE))
+            for j in (np.flatnonzero(near) + i + 1).tolist():
+                parent[root(j)] = root(i)
+        groups = collections.defaultdict(list)
+        for i, row in enumerate(rows):
+            groups[root(i)].append(row)
+        clusters = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda r: (not keep(r['url']), -(r['size'] or 0), r['id']))
+            clusters.append([{'url': r['url'], 'name': r['name'], 'digest': r['digest'], 'size': r['size'],
+                              'distance': (int(r['phash'] ^ members[0]['phash']) & 0xFFFFFFFFFFFFFFFF).bit_count()}
+                             for r in members])
+        return clusters
+
+    def stats(self):
+        with self._lock:
+            return {'images': len(self._ids), 'lookups': self.lookups, 'reloads': self.reloads}
+
+
+NEAR_DUPS = NearDuplicateIndex(NEAR_DUPS_DB_PATH)
+BLOBS.on_release.append(NEAR_DUPS.forget)
+
+
+def record_near_duplicates(tenant, url, path, digest, img, name=None, size=None):
+    """Index an uploaded image; returns the stored images it nearly duplicates."""
+    try:
+        hashes = perceptual_hashes(img)
+        if hashes is None:
+            return []
+        found = NEAR_DUPS.lookup(hashes, tenant.name, exclude=digest)
+        NEAR_DUPS.add(url, path, digest, hashes, tenant.name, name, size)
+        return found
+    except Exception:
+        logging.exception('perceptual hashing failed for %s', path)
+        METRICS.swallowed('phash')
+        return []
+
+
+def duplicate_report(tenant):
+    """Near-duplicate clusters of a tenant, with the bytes that deleting the
+    unreferenced copies (all but the first image) would free."""
+    referenced = set()
+
+    def walk(o):
+        # exact string values: '/a.jpg' is not referenced by '/a.jpg.bak'
+        if isinstance(o, dict):
+            for v in o.values():
+                walk(v)
+        elif isinstance(o, list):
+            for v in o:
+                walk(v)
+        elif isinstance(o, str):
+            referenced.add(o)
+
+    walk(tenant.store.get())
+    clusters = []
+    for members in NEAR_DUPS.clusters(tenant.name, keep=lambda url: url in referenced):
+        for m in members:
+            m['referenced'] = m['url'] in referenced
+        clusters.append({'members': members,
+                         'reclaimable': sum(m['size'] or 0 for m in members[1:] if not m['referenced'])})
+    clusters.sort(key=lambda c: -c['reclaimable'])
+    return {'clusters': clusters, 'reclaimable': sum(c['reclaimable'] for c in clusters)}
+
+
+SEARCH_DB_PATH = os.environ.get('SEARCH_DB_PATH', os.path.join(os.path.dirname(__file__), 'search.sqlite3'))
+SEARCH_COLLECTIONS = ('projects', 'events', 'certificates', 'snaps')
+# every other top-level key is indexed as one 'profile' document, except settings
+SEARCH_SKIP_KEYS = ('ui_mode',)
+SEARCH_FIELD_WEIGHTS = {'title': 3.0, 'name': 3.0, 'languages': 2.0, 'skills': 2.0}
+SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', '20'))
+SEARCH_LIMIT_MAX = 100
+# the last query word also matches up to this many longer words starting with it
+SEARCH_PREFIX_LIMIT = int(os.environ.get('SEARCH_PREFIX_LIMIT', '64'))
+SEARCH_PREFIX_BOOST = 0.6
+# recompute BM25 impacts once the average document length moves this much
+SEARCH_RENORMALIZE = 0.25
+# changes touching more entries than this re-sort rankings once at the end
+SEARCH_BULK = 256
+SEARCH_STOPWORDS = frozenset('a an and are as at be by for from in is it of on or the to with'.split())
+BM25_K1 = 1.2
+BM25_B = 0.75
+_SEARCH_TOKEN = re.compile(r"\w[\w+#]*(?:\.\w[\w+#]*)*")
+_SEARCH_SKIP_VALUE = re.compile(r'(?:https?:|data:|mailto:|/)')
+
+
+def search_terms(text, parts=True):
+    """Lower-cased words of `text` without stop words; with `parts`, dotted
+    names also yield their parts ('React.js' -> 'react.js', 'react', 'js')."""
+    terms = []
+    for token in _SEARCH_TOKEN.findall(text.lower()):
+        if token in SEARCH_STOPWORDS:
+            continue
+        terms.append(token)
+        if parts and '.' in token:
+            terms.extend(part for part in token.split('.') if part and part not in SEARCH_STOPWORDS)
+    return terms
+
+
+def _search_text(value):
+    # strings inside an entry, skipping URLs, upload paths and data URIs
+    if isinstance(value, str):
+        if value and not _SEARCH_SKIP_VALUE.match(value):
+            yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _search_text(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _search_text(v)
+
+
+def _search_sources(data):
+    """(collection, value) pairs the index is built from."""
+    for collection in SEARCH_COLLECTIONS:
+        yield collection, data.get(collection) or []
+    yield 'profile', {k: v for k, v in data.items() if k not in SEARCH_COLLECTIONS and k not in SEARCH_SKIP_KEYS}
+
+
+def _search_doc_id(collection, key, entry, taken):
+    """Id for one entry, unique within `taken` (which it is added to). Ids hash
+    the entry's content, so an unchanged entry keeps its id wherever it moves
+    and a suffix only tells identical copies apart."""
+    raw = json.dumps([key, entry], sort_keys=True, ensure_ascii=False, default=str)
+    base = f"{collection}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}"
+    doc_id, n = base, 1
+    while doc_id in taken:
+        n += 1
+        doc_id = f'{base}-{n}'
+    taken.add(doc_id)
+    return doc_id
+
+
+def analyze_entry(collection, key, entry):
+    """(result metadata, {term: (weighted frequency, fields)}, length)."""
+    if isinstance(entry, dict):
+        fields = entry.items()
+        title = entry.get('title') or entry.get('name') or key or ''
+        url = entry.get('url') or entry.get('github') or ''
+        snippet = entry.get('description') or ''
+    else:
+        fields = [(key or 'name', entry)]
+        title = key or str(entry)
+        url = ''
+        snippet = ', '.join(_search_text(entry)) if key else ''
+    terms, length = {}, 0
+    for field, value in fields:
+        weight = SEARCH_FIELD_WEIGHTS.get(field, 1.0)
+        for text in _search_text(value):
+            for term in search_terms(text):
+                freq, names = terms.get(term, (0.0, ()))
+                terms[term] = (freq + weight, names if field in names else names + (field,))
+                length += 1
+    meta = {'collection': collection, 'title': str(title), 'url': url if isinstance(url, str) else '',
+            'snippet': str(snippet)[:160]}
+    return meta, terms, length
+
+
+class SearchIndex(SQLiteBacked):
+    """Inverted index over the text of data.json, ranked with BM25.
+
+    Postings map term -> {doc id: (impact, weighted term frequency, fields)},
+    where impact is the BM25 term-frequency part, computed when the entry is
+    indexed (and again only if the average document length drifts by more
+    than SEARCH_RENORMALIZE). Each term also keeps its postings ordered by
+    impact, so a one-word query reads only the top of those lists, and a
+    sorted term list gives prefix matches by bisection.
+
+    sync() diffs the document against what is indexed: entries before the
+    first and after the last difference keep their ids, and only the ones in
+    between are hashed (and analyzed, if their content is new). Analyzed
+    entries are also kept in SQLite so a new worker starts from the stored
+    postings instead of re-tokenizing everything; each process still diffs
+    against its own copy of data.json, so a stale or half-written store is
+    corrected on the first sync.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.etag = None
+        self.generation = 0
+        self.docs = {}          # doc id -> result metadata (+ length)
+        self.postings = {}      # term -> {doc id: (impact, weighted tf, fields)}
+        self.terms = []         # sorted keys of postings
+        self.total_length = 0
+        self._avg_length = None  # the average the impacts were computed with
+        self._ranked = {}       # term -> [(-impact, doc id)], best first
+        self._unranked = None   # terms to re-sort after a bulk change
+        self._fields = {}       # interned field-name tuples
+        self._doc_terms = {}    # doc id -> terms, for removal
+        self._collections = {}  # collection -> set of doc ids
+        self._seen = {}         # collection -> (entries, doc ids) last synced
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._results = LRUCache(maxsize=1024)
+
+    def _create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, meta TEXT NOT NULL, '
+                   'terms TEXT NOT NULL, length INTEGER NOT NULL)')
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with self._db() as db:
+                rows = db.execute('SELECT id, meta, terms, length FROM docs').fetchall()
+        except sqlite3.Error:
+            logging.exception('failed to read search index %s', self.db_path)
+            METRICS.swallowed('search_load')
+            return
+        if rows:
+            self._avg_length = sum(row[3] for row in rows) / len(rows) or 1.0
+        for doc_id, meta, terms, length in rows:
+            terms = {t: (freq, tuple(fields)) for t, (freq, fields) in json.loads(terms).items()}
+            self._add(doc_id, json.loads(meta), terms, length)
+
+    def _impact(self, freq, length):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self._avg_length)
+        return freq * (BM25_K1 + 1) / (freq + norm)
+
+    def _add(self, doc_id, meta, terms, length):
+        meta['length'] = length
+        self.docs[doc_id] = meta
+        self._collections.setdefault(meta['collection'], set()).add(doc_id)
+        self._doc_terms[doc_id] = tuple(terms)
+        self.total_length += length
+        for term, (freq, fields) in terms.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+                self._ranked[term] = []
+            # building from scratch: impacts are computed once the average is known
+            impact = self._impact(freq, length) if self._avg_length else 0.0
+            docs[doc_id] = (impact, freq, self._fields.setdefault(fields, fields))
+            if self._unranked is None:
+                bisect.insort(self._ranked[term], (-impact, doc_id))
+            else:
+                self._unranked.add(term)
+
+    def _remove(self, doc_id):
+        meta = self.docs.pop(doc_id)
+        self._collections[meta['collection']].discard(doc_id)
+        self.total_length -= meta['length']
+        for term in self._doc_terms.pop(doc_id):
+            docs = self.postings[term]
+            impact = docs.pop(doc_id)[0]
+            if self._unranked is None:
+                ranked = self._ranked[term]
+                del ranked[bisect.bisect_left(ranked, (-impact, doc_id))]
+            else:
+                self._unranked.add(term)
+            if not docs:
+                del self.postings[term]
+                del self._ranked[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def _renormalize(self):
+        # documents got much longer or shorter on average: recompute impacts
+        self._avg_length = (self.total_length / len(self.docs) if self.docs else 0) or 1.0
+        for docs in self.postings.values():
+            for doc_id, (_, freq, fields) in docs.items():
+                docs[doc_id] = (self._impact(freq, self.docs[doc_id]['length']), freq, fields)
+        self._rerank(self.postings)
+
+    def _rerank(self, terms):
+        for term in terms:
+            if term in self.postings:
+                self._ranked[term] = sorted((-p[0], doc_id) for doc_id, p in self.postings[term].items())
+
+    def sync(self, data, etag=None):
+        """Bring the index in line with `data` (a fresh document, as returned
+        by load_data()); True if anything changed."""
+        with self._lock:
+            if etag is not None and etag == self.etag:
+                return False
+            if not self._loaded:
+                # one sort per term beats keeping thousands of lists ordered
+                self._unranked = set()
+                self._load()
+            removed, added = [], []
+            for collection, value in _search_sources(data):
+                keyed = collection == 'profile'
+                entries = list(value.items()) if keyed else value
+                old_entries, old_ids = self._seen.get(collection, ([], []))
+                if collection in self._seen and old_entries == entries:
+                    continue
+                # unchanged head and tail (a typical edit touches one entry)
+                head, limit = 0, min(len(entries), len(old_entries))
+                while head < limit and old_entries[head] == entries[head]:
+                    head += 1
+                tail = 0
+                while tail < limit - head and old_entries[-1 - tail] == entries[-1 - tail]:
+                    tail += 1
+                kept_tail = old_ids[len(old_ids) - tail:]
+                taken = set(old_ids[:head]) | set(kept_tail)
+                middle = []
+                for item in entries[head:len(entries) - tail]:
+                    key, entry = item if keyed else (None, item)
+                    middle.append((_search_doc_id(collection, key, entry, taken), key, entry))
+                ids = old_ids[:head] + [doc_id for doc_id, _, _ in middle] + kept_tail
+                if len(middle) > SEARCH_BULK and self._unranked is None:
+                    self._unranked = set()
+                current = self._collections.get(collection, set())
+                for doc_id in current - taken:
+                    self._remove(doc_id)
+                    removed.append(doc_id)
+                for doc_id, key, entry in middle:
+                    if doc_id not in current:
+                        meta, terms, length = analyze_entry(collection, key, entry)
+                        self._add(doc_id, meta, terms, length)
+                        added.append((doc_id, meta, terms, length))
+                self._seen[collection] = (entries, ids)
+            self.etag = etag
+            unranked, self._unranked = self._unranked, None
+            avg = self.total_length / len(self.docs) if self.docs else 0
+            if avg and (not self._avg_length or abs(avg - self._avg_length) > SEARCH_RENORMALIZE * self._avg_length):
+                self._renormalize()
+            elif unranked:
+                self._rerank(unranked)
+            if unranked is not None:
+                self.generation += 1
+            if removed or added:
+                self.generation += 1
+                self._persist(removed, added)
+            return bool(removed or added)
+
+    def _persist(self, removed, added):
+        rows = [(doc_id, json.dumps({k: v for k, v in meta.items() if k != 'length'}, ensure_ascii=False),
+                 json.dumps(terms, ensure_ascii=False), length) for doc_id, meta, terms, length in added]
+        try:
+            with self._db() as db:
+                db.execute('BEGIN IMMEDIATE')
+                db.executemany('DELETE FROM docs WHERE id = ?', [(doc_id,) for doc_id in removed])
+                db.executemany('INSERT OR REPLACE INTO docs (id, meta, terms, length) VALUES (?, ?, ?, ?)', rows)
+                db.execute('COMMIT')
+        except sqlite3.Error:
+            # the in-memory index is already correct; the next worker re-analyzes
+            logging.exception('failed to store search index changes')
+            METRICS.swallowed('search_persist')
+
+    def _expand(self, term, prefix):
+        """[(term, idf)] for `term` and, if `prefix`, the words it starts."""
+        expansions = [term] if term in self.postings else []
+        if prefix:
+            i = bisect.bisect_right(self.terms, term)
+            for t in itertools.islice(self.terms, i, i + SEARCH_PREFIX_LIMIT):
+                if not t.startswith(term):
+                    break
+                expansions.append(t)
+        n = len(self.docs)
+        weighted = []
+        for t in expansions:
+            df = len(self.postings[t])
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            weighted.append((t, idf if t == term else idf * SEARCH_PREFIX_BOOST))
+        return weighted
+
+    def _accepts(self, term, doc_id, collection, field):
+        if collection and not doc_id.startswith(collection + ':'):
+            return False
+        return not field or field in self.postings[term][doc_id][2]
+
+    def _top(self, term, prefix, limit, collection, field):
+        # merge the impact-ordered lists of the word and its expansions
+        lists = [((idf * neg_impact, doc_id, t) for neg_impact, doc_id in self._ranked[t])
+                 for t, idf in self._expand(term, prefix)]
+        best, seen = [], set()
+        for score, doc_id, t in heapq.merge(*lists):
+            if doc_id in seen or not self._accepts(t, doc_id, collection, field):
+                continue
+            seen.add(doc_id)
+            best.append((doc_id, -score))
+            if len(best) == limit:
+                break
+        return best
+
+    def _scores(self, term, prefix, collection, field, candidates=None):
+        """{doc id: score} for `term`, within `candidates` if given."""
+        expansions = self._expand(term, prefix)
+        if candidates is not None and len(candidates) * len(expansions) < sum(
+                len(self.postings[t]) for t, _ in expansions):
+            # fewer lookups than walking the postings
+            scores = {}
+            for doc_id in candidates:
+                best = 0.0
+                for t, idf in expansions:
+                    posting = self.postings[t].get(doc_id)
+                    if posting and (not field or field in posting[2]) and idf * posting[0] > best:
+                        best = idf * posting[0]
+                if best:
+                    scores[doc_id] = best
+            return scores
+        scores = {}
+        for t, idf in expansions:
+            for doc_id, (impact, _, fields) in self.postings[t].items():
+                if field and field not in fields:
+                    continue
+                if collection and not doc_id.startswith(collection + ':'):
+                    continue
+                score = idf * impact
+                if score > scores.get(doc_id, 0.0):
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query, collection=None, field=None, limit=SEARCH_LIMIT, prefix=True):
+        """Best `limit` documents containing every word of `query` (the last
+        word may be a prefix), as result dicts with a `score`."""
+        # documents index 'react.js' under its parts too, so the query needn't
+        terms = list(dict.fromkeys(search_terms(query, parts=False)))
+        if not terms:
+            return []
+        key = (self.generation, tuple(terms), collection, field, limit, prefix)
+        results = self._results.get(key)
+        if results is not None:
+            return results
+        with self._lock:
+            if len(terms) == 1:
+                best = self._top(terms[0], prefix, limit, collection, field)
+            else:
+                last = terms[-1]
+                # rarest word first keeps the intersection small
+                terms.sort(key=lambda t: len(self.postings.get(t, ())) if t != last or not prefix else len(self.docs))
+                matches = None
+                for term in terms:
+                    scores = self._scores(term, prefix and term == last, collection, field, matches)
+                    if matches is None:
+                        matches = scores
+                    else:
+                        matches = {doc_id: s + scores[doc_id] for doc_id, s in matches.items() if doc_id in scores}
+                    if not matches:
+                        break
+                best = heapq.nlargest(limit, matches.items(), key=lambda item: item[1])
+            results = [dict(self._public(doc_id), score=round(score, 4)) for doc_id, score in best]
+        self._results.set(key, results)
+        return results
+
+    def _public(self, doc_id):
+        meta = self.docs[doc_id]
+        return {'id': doc_id, 'collection': meta['collection'], 'title': meta['title'],
+                'url': meta['url'], 'snippet': meta['snippet']}
+
+    def stats(self):
+        return {'docs': len(self.docs), 'terms': len(self.terms), 'generation': self.generation}
+
+
+SEARCH = SearchIndex(SEARCH_DB_PATH)
+
+
+def search_index():
+    """The tenant's SearchIndex (SEARCH by default), synced with its current
+    data.json (including other workers' writes)."""
+    tenant = current_tenant()
+    data = tenant.store.get()
+    tenant.search.sync(data, tenant.store.etag)
+    return tenant.search
+
+
+def _update_search(before, after):
+    # index the change in the writing request rather than on the next search
+    SEARCH.sync(after, PROFILE_STORE.etag)
+
+
+PROFILE_STORE.listeners.append(_update_search)
+
+
+# Chatbot intents: (name, priority, keywords). All keywords are compiled into
+# one regex with word boundaries ("hi" no longer matches "this" or "his"), so
+# plurals are listed as keywords of their own; when several intents match, the
+# highest priority wins, then the one with most hits.
+BOT_INTENTS = [
+    ('email', 90, ['email', 'emails', 'mail', 'gmail', 'contact email']),
+    ('phone', 90, ['phone', 'phones', 'call', 'contact number', 'mobile']),
+    ('linkedin', 90, ['linkedin']),
+    ('skills', 70, ['skill', 'skills', 'tech', 'technology', 'technologies']),
+    ('projects', 70, ['project', 'projects', 'portfolio', 'portfolios']),
+    ('certificates', 70, ['certificate', 'certificates', 'certification', 'certifications']),
+    ('achievements', 70, ['hackathon', 'hackathons', 'award', 'awards', 'achievement', 'achievements']),
+    ('education', 60, ['education', 'college', 'colleges', 'degree', 'degrees', 'school', 'schools']),
+    ('location', 60, ['where', 'location', 'located', 'live', 'hyderabad', 'city']),
+    ('objective', 60, ['objective', 'objectives', 'goal', 'goals', 'seeking']),
+    ('snaps', 50, ['snap', 'snaps', 'photo', 'photos', 'image', 'images', 'gallery', 'galleries']),
+    ('greeting', 10, ['hello', 'hi', 'hey', 'greetings']),
+]
+
+
+class IntentMatcher:
+    """Single-pass keyword matcher over a table of intents."""
+
+    def __init__(self, intents):
+        self.intents = list(intents)
+        parts = []
+        for i, (_, _, keywords) in enumerate(self.intents):
+            # longest first so 'contact email' wins over 'email'
+            alts = sorted({r'\s+'.join(map(re.escape, k.split())) for k in keywords}, key=len, reverse=True)
+            parts.append(f"(?P<i{i}>{'|'.join(alts)})")
+        self.regex = re.compile(r"\b(?:" + '|'.join(parts) + r")\b")
+
+    def match(self, text):
+        """Return [(intent, score)] for every matched intent, best first."""
+        scores = collections.Counter()
+        for m in self.regex.finditer(text):
+            scores[int(m.lastgroup[1:])] += 1
+        ranked = sorted(scores, key=lambda i: (-self.intents[i][1], -scores[i], i))
+        return [(self.intents[i][0], scores[i]) for i in ranked]
+
+    def best(self, text):
+        ranked = self.match(text)
+        return ranked[0][0] if ranked else None
+
+
+BOT_MATCHER = IntentMatcher(BOT_INTENTS)
+BOT_ANSWERS = LRUCache(maxsize=2048)
+_BOT_FACTS = {'version': None, 'facts': None}
+_BOT_FACTS_LOCK = threading.Lock()
+
+
+def _compute_bot_facts(data, fallback=PROFILE):
+    """Strings the chatbot needs, derived once per data version."""
+    def field(key):
+        return data.get(key) or fallback.get(key)
+    certs = data.get('certificates', []) or []
+    snaps = data.get('snaps', []) or []
+    facts = {
+        'name': field('name'),
+        'email': field('email'),
+        'phone': field('phone'),
+        'linkedin': field('linkedin'),
+        'location': field('location'),
+        'objective': field('objective'),
+        'education': field('education'),
+        'skills': ", ".join(data.get('skills', [])),
+        'projects': ", ".join(p.get('title', str(p)) if isinstance(p, dict) else str(p)
+                              for p in data.get('projects', [])),
+        'certificates': ", ".join(str(c.get('name')) if isinstance(c, dict) else str(c) for c in certs),
+        'snaps': len(snaps),
+        'achievements': ", ".join(data.get('achievements', [])),
+    }
+    facts['summary'] = (f"Name: {facts['name']}\nLocation: {facts['location']}\nSkills: {facts['skills']}\n"
+                        f"Projects: {facts['projects']}\nContact: {facts['email']} | {facts['phone']}")
+    return facts
+
+
+def bot_facts():
+    tenant = current_tenant()
+    data = tenant.store.get()
+    version = tenant.store.version
+    facts = tenant.bot_facts
+    with tenant.bot_facts_lock:
+        if facts['version'] != version:
+            facts['facts'] = _compute_bot_facts(data, tenant.fallback)
+            facts['version'] = version
+        return facts['facts']
+
+
+def _warm_bot_facts(before, after):
+    # precompute on save rather than on the next chat message
+    with _BOT_FACTS_LOCK:
+        _BOT_FACTS['facts'] = _compute_bot_facts(after)
+        _BOT_FACTS['version'] = PROFILE_STORE.version
+
+
+PROFILE_STORE.listeners.append(_warm_bot_facts)
+
+BOT_REPLIES = {
+    'greeting': lambda f: f"Hi, I'm {f['name']} — ask me about skills, projects or contact details.",
+    'email': lambda f: f"Email: {f['email']}",
+    'phone': lambda f: f"Phone: {f['phone']}",
+    'linkedin': lambda f: f"LinkedIn: {f['linkedin']}",
+    'location': lambda f: f['location'],
+    'objective': lambda f: f['objective'],
+    'education': lambda f: f['education'],
+    'skills': lambda f: f['skills'],
+    'projects': lambda f: "Projects: " + f['projects'],
+    'certificates': lambda f: "Certificates: " + f['certificates'] if f['certificates'] else "No certificates listed yet.",
+    'snaps': lambda f: f"I have {f['snaps']} snaps. Visit the Snaps page to view them." if f['snaps'] else "No snaps available yet.",
+    'achievements': lambda f: f['achievements'],
+}
+
+
+def normalize_message(message):
+    return ' '.join(re.sub(r"[^\w\s+#.@-]", ' ', message.lower()).split())
+
+
+# "which projects use opencv", "any certificates about aws", "events with robotics"
+BOT_FIELD_QUESTION = re.compile(
+    r"\b(?P<kind>project|certificate|certification|event|snap|photo)s?\s+"
+    r"(?:(?:that|which|do|does|did|you|i|have|has|are|were)\s+)*"
+    r"(?:use[sd]?|using|with|about|mention(?:s|ed|ing)?|include[sd]?|including|involv(?:e|es|ed|ing)|"
+    r"built\s+(?:with|in|using)|on|in)\s+(?P<topic>.+)$")
+BOT_FIELD_COLLECTIONS = {'project': 'projects', 'certificate': 'certificates', 'certification': 'certificates',
+                         'event': 'events', 'snap': 'snaps', 'photo': 'snaps'}
+BOT_SEARCH_LIMIT = 8
+
+
+def answer_from_search(text):
+    """Reply for a question about what a collection contains, or None."""
+    m = BOT_FIELD_QUESTION.search(text)
+    if not m:
+        return None
+    collection = BOT_FIELD_COLLECTIONS[m.group('kind')]
+    topic = m.group('topic').strip(' .')
+    hits = search_index().search(topic, collection=collection, limit=BOT_SEARCH_LIMIT)
+    if not hits:
+        # e.g. "projects in your portfolio": let the keyword intents answer
+        return None
+    return f"{collection.capitalize()} matching '{topic}': " + ", ".join(h['title'] for h in hits)
+
+
+def answer_bot(message: str) -> str:
+    if not message:
+        return "Hi — ask me about skills, projects, education, achievements, or contact details."
+    facts = bot_facts()
+    tenant = current_tenant()
+    key = (tenant.store.version, normalize_message(message))
+    reply = tenant.bot_answers.get(key)
+    if reply is None:
+        # "which projects use X" before the keyword intents ('projects' would match)
+        reply = answer_from_search(key[1])
+        if reply is None:
+            intent = tenant.bot_matcher.best(key[1])
+            if intent:
+                reply = tenant.bot_replies[intent](facts)
+            else:
+                # fallback
+                reply = "I can share info about education, skills, projects, achievements, or contact details. Try: 'skills', 'projects', or 'email'."
+        tenant.bot_answers.set(key, reply)
+    return reply
+
+
+# Multi-tenant mode: one process serves many portfolios. Each tenant has a
+# directory TENANTS_DIR/<name>/ with its own data.json (and optionally a
+# tenant.json with admin credentials and extra chatbot intents), and an
+# upload namespace under static/uploads/tenants/<name>/. Loaded tenants -
+# parsed profile, rendered pages, search index, compiled intents - are kept
+# in an LRU bounded by count and by estimated memory, and are rebuilt when
+# tenant.json changes. The image queue, the SSE log and the outbox are
+# shared by all tenants; their rows carry the tenant's name.
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', '64'))
+TENANT_CACHE_BYTES = int(os.environ.get('TENANT_CACHE_MB', '256')) * 1024 * 1024
+TENANT_PAGE_CACHE_SIZE = int(os.environ.get('TENANT_PAGE_CACHE_SIZE', '16'))
+# rough size of a parsed document relative to its JSON, and of one search posting
+TENANT_DATA_OVERHEAD = 8
+TENANT_POSTING_BYTES = 150
+TENANT_NAME_RE = re.compile(r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?')
+# routes that stay available on an unknown tenant's host or path
+TENANT_SHARED_ENDPOINTS = ('static', 'image_variant', 'metrics')
+# a new tenant starts from an empty document with the default's shape
+TENANT_DEFAULT_DOC = {k: type(v)() for k, v in PROFILE.items()}
+
+_TENANT = contextvars.ContextVar('tenant', default=None)
+
+
+class DefaultTenant:
+    """The portfolio served when no tenant is selected (and the only one
+    outside multi-tenant mode): the module-level store and caches."""
+
+    name = None
+    admin_key = True
+    fallback = PROFILE
+
+    # read at call time so the globals can be swapped (tests, benchmarks)
+    store = property(lambda self: PROFILE_STORE)
+    pages = property(lambda self: PAGES)
+    blobs = property(lambda self: BLOBS)
+    search = property(lambda self: SEARCH)
+    bot_facts = property(lambda self: _BOT_FACTS)
+    bot_facts_lock = property(lambda self: _BOT_FACTS_LOCK)
+    bot_answers = property(lambda self: BOT_ANSWERS)
+    bot_matcher = property(lambda self: BOT_MATCHER)
+    bot_replies = property(lambda self: BOT_REPLIES)
+
+    def check_admin(self, username, password):
+        return username == 'Nani@2821' and password == 'Nani@2821'
+
+
+DEFAULT_TENANT = DefaultTenant()
+
+
+def current_tenant():
+    """The tenant of the running request (or of use_tenant()), else DEFAULT_TENANT."""
+    tenant = _TENANT.get()
+    if tenant is None and has_request_context():
+        tenant = g.get('tenant')
+    return tenant or DEFAULT_TENANT
+
+
+@contextlib.contextmanager
+def use_tenant(tenant):
+    """Run a block (e.g. a finished job's callback) as `tenant`; None is the default."""
+    token = _TENANT.set(tenant or DEFAULT_TENANT)
+    try:
+        yield tenant
+    finally:
+        _TENANT.reset(token)
+
+
+def _template_reply(text):
+    # str.format over the chatbot facts; unknown names render empty
+    return lambda facts: text.format_map(collections.defaultdict(str, facts))
+
+
+class Tenant:
+    """One portfolio of multi-tenant mode with its own store and caches."""
+
+    admin_key = property(lambda self: self.name)
+
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+        self.config_path = os.path.join(root, 'tenant.json')
+        self.config_stamp = _file_stamp(self.config_path)
+        self.config = self._read_config()
+        self.fallback = {}
+        self.store = ProfileStore(os.path.join(root, 'data.json'), TENANT_DEFAULT_DOC)
+        self.pages = PageCache(TENANT_PAGE_CACHE_SIZE)
+        uploads = os.path.join(TENANT_UPLOAD_FOLDER, name)
+        self.blobs = BlobStore(os.path.join(uploads, 'blobs'), os.path.join(uploads, 'thumbs'),
+                               url_root=f'/static/uploads/tenants/{name}', img_root=f'/img/t/{name}')
+        self.blobs.on_release += [DERIVATIVES.purge, _drop_pdf_preview, lambda digest: NEAR_DUPS.forget(digest, name)]
+        self.search = SearchIndex(os.path.join(root, 'search.sqlite3'))
+        self.bot_facts = {'version': None, 'facts': None}
+        self.bot_facts_lock = threading.Lock()
+        self.bot_answers = LRUCache(maxsize=256)
+        self.bot_matcher, self.bot_replies = self._compile_intents(self.config.get('intents') or [])
+        self.store.listeners += [self.pages.clear, self.blobs.collect, self._update_search, self._warm_bot_facts]
+        self._weight = (None, 0)
+
+    def _read_config(self):
+        try:
+            with open(self.config_path, encoding='utf-8') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.exception('unreadable tenant config %s', self.config_path)
+            METRICS.swallowed('tenant_config')
+            return {}
+        return config if isinstance(config, dict) else {}
+
+    def _compile_intents(self, custom):
+        """Matcher and replies: the built-in intents plus the tenant's own
+        ({name, priority, keywords, reply}); a custom intent with a built-in
+        name replaces it."""
+        intents = {name: (name, priority, keywords) for name, priority, keywords in BOT_INTENTS}
+        replies = dict(BOT_REPLIES)
+        for spec in custom:
+            try:
+                name, reply = str(spec['name']), str(spec['reply'])
+                keywords = [str(k).lower() for k in spec['keywords'] if str(k).strip()]
+                priority = int(spec.get('priority', 65))
+                _template_reply(reply)({})
+            except (KeyError, TypeError, ValueError, IndexError, AttributeError):
+                logging.warning('tenant %s: ignoring invalid intent %r', self.name, spec)
+                continue
+            if keywords:
+                intents[name] = (name, priority, keywords)
+                replies[name] = _template_reply(reply)
+        if not custom:
+            return BOT_MATCHER, replies
+        return IntentMatcher(intents.values()), replies
+
+    def _update_search(self, before, after):
+        self.search.sync(after, self.store.etag)
+
+    def _warm_bot_facts(self, before, after):
+        with self.bot_facts_lock:
+            self.bot_facts['facts'] = _compute_bot_facts(after, self.fallback)
+            self.bot_facts['version'] = self.store.version
+
+    def check_admin(self, username, password):
+        user, pw_hash = self.config.get('admin_user'), self.config.get('admin_password_hash')
+        if not (user and pw_hash):
+            # no credentials of its own: the operator's login manages it
+            return DEFAULT_TENANT.check_admin(username, password)
+        return username == user and check_password_hash(pw_hash, password or '')
+
+    def weight(self):
+        """Estimated bytes held: parsed document, rendered pages and search postings."""
+        state = (self.store.version, self.pages.renders, self.search.generation)
+        if self._weight[0] != state:
+            try:
+                data_bytes = os.path.getsize(self.store.path)
+            except OSError:
+                data_bytes = 0
+            postings = sum(len(p) for p in list(self.search.postings.values()))
+            self._weight = (state, data_bytes * TENANT_DATA_OVERHEAD + self.pages.size()
+                            + postings * TENANT_POSTING_BYTES)
+        return self._weight[1]
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class TenantRegistry:
+    """LRU of loaded tenants, bounded by `maxsize` and by `max_bytes` of
+    estimated memory (the most recently used tenant is always kept)."""
+
+    def __init__(self, root, maxsize=TENANT_CACHE_SIZE, max_bytes=TENANT_CACHE_BYTES):
+        self.root = root
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.loads = 0
+        self.evictions = 0
+        self._tenants = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """The tenant called `name`, loading it if needed; None if there is no such tenant."""
+        if not isinstance(name, str) or not TENANT_NAME_RE.fullmatch(name):
+            return None
+        root = os.path.join(self.root, name)
+        with self._lock:
+            tenant = self._tenants.get(name)
+            if tenant is not None and tenant.config_stamp == _file_stamp(tenant.config_path):
+                self._tenants.move_to_end(name)
+                return tenant
+            # new, or tenant.json changed (possibly in another worker)
+            self._tenants.pop(name, None)
+            if not os.path.isdir(root):
+                return None
+            tenant = Tenant(name, root)
+            self.loads += 1
+            self._tenants[name] = tenant
+            self._evict()
+            return tenant
+
+    def touch(self, tenant):
+        """Re-check the memory bound after `tenant` served a request."""
+        with self._lock:
+            if self._tenants.get(tenant.name) is tenant:
+                self._evict()
+
+    def invalidate(self, name=None):
+        """Drop one loaded tenant (or all); it is reloaded on its next request."""
+        with self._lock:
+            if name is None:
+                self._tenants.clear()
+            else:
+                self._tenants.pop(name, None)
+
+    def _evict(self):
+        while len(self._tenants) > self.maxsize:
+            self._tenants.popitem(last=False)
+            self.evictions += 1
+        total = sum(t.weight() for t in self._tenants.values())
+        while total > self.max_bytes and len(self._tenants) > 1:
+            _, tenant = self._tenants.popitem(last=False)
+            total -= tenant.weight()
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'loaded': len(self._tenants), 'maxsize': self.maxsize, 'loads': self.loads,
+                    'evictions': self.evictions, 'bytes': sum(t.weight() for t in self._tenants.values()),
+                    'max_bytes': self.max_bytes}
+
+
+TENANTS = TenantRegistry(TENANTS_DIR)
+
+
+class TenantPathMiddleware:
+    """In 'path' mode, serve TENANT_PATH_PREFIX/<name>/... as an app mounted at
+    that prefix: the prefix moves to SCRIPT_NAME, so url_for() and
+    request.script_root keep links inside the tenant."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        name, rest = split_tenant_path(environ.get('PATH_INFO') or '')
+        if name is not None:
+            environ['portfolio.tenant'] = name
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + TENANT_PATH_PREFIX + '/' + name
+            environ['PATH_INFO'] = rest
+        return self.wsgi_app(environ, start_response)
+
+
+app.wsgi_app = TenantPathMiddleware(app.wsgi_app)
+
+
+def split_tenant_path(path):
+    """(name, rest) of a TENANT_PATH_PREFIX/<name>/<rest> path in 'path' mode,
+    else (None, path)."""
+    prefix = TENANT_PATH_PREFIX + '/'
+    if TENANT_MODE != 'path' or not path.startswith(prefix):
+        return None, path
+    name, _, rest = path[len(prefix):].partition('/')
+    return name, '/' + rest
+
+
+def host_tenant_name(host):
+    """The tenant named by the subdomain of `host` in 'host' mode, else None."""
+    if TENANT_MODE != 'host' or not TENANT_DOMAIN:
+        return None
+    host = host.rsplit(':', 1)[0].lower()
+    return host[:-len(TENANT_DOMAIN) - 1] if host.endswith('.' + TENANT_DOMAIN) else None
+
+
+def tenant_for(path, host):
+    """(tenant, path within it) of a request outside Flask (the ASGI /stream),
+    by the rules of TenantPathMiddleware and _select_tenant: DEFAULT_TENANT
+    when none is named, None for an unknown one."""
+    name, path = split_tenant_path(path)
+    if name is None:
+        name = host_tenant_name(host)
+    if name is None:
+        return DEFAULT_TENANT, path
+    return TENANTS.get(name), path
+
+
+def _request_tenant_name():
+    if TENANT_MODE == 'path':
+        return request.environ.get('portfolio.tenant')
+    return host_tenant_name(request.host)
+
+
+@app.before_request
+def _select_tenant():
+    if not TENANT_MODE:
+        return None
+    name = _request_tenant_name()
+    if name is None:
+        return None
+    tenant = TENANTS.get(name)
+    if tenant is None:
+        if request.endpoint in TENANT_SHARED_ENDPOINTS:
+            return None
+        abort(404)
+    g.tenant = tenant
+    return None
+
+
+@app.teardown_request
+def _release_tenant(exc=None):
+    tenant = g.pop('tenant', None)
+    if tenant is not None:
+        TENANTS.touch(tenant)
+
+
+@app.cli.command('tenant-create')
+@click.argument('name')
+@click.option('--admin-user', help='Login of the tenant admin (default: the operator login).')
+@click.option('--admin-password', help='Password of the tenant admin.')
+def tenant_create(name, admin_user, admin_password):
+    """Create (or update the admin of) tenant NAME under TENANTS_DIR."""
+    if not TENANT_NAME_RE.fullmatch(name):
+        raise click.BadParameter('lowercase letters, digits and dashes only', param_hint='NAME')
+    if bool(admin_user) != bool(admin_password):
+        raise click.UsageError('--admin-user and --admin-password go together')
+    root = os.path.join(TENANTS_DIR, name)
+    os.makedirs(root, exist_ok=True)
+    config = Tenant(name, root).config
+    if admin_user:
+        config.update(admin_user=admin_user, admin_password_hash=generate_password_hash(admin_password))
+        _atomic_write(os.path.join(root, 'tenant.json'), json.dumps(config, indent=2).encode('utf-8'))
+    with use_tenant(TENANTS.get(name)):
+        load_data()  # writes the initial data.json
+    click.echo(f'tenant {name}: {root}')
+
+
+ASSET_DIRS = ('css', 'js')
+ASSET_BUILD_DIR = os.environ.get('ASSET_BUILD_DIR', os.path.join(app.static_folder, 'dist'))
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+
+class AssetManifest:
+    """Fingerprinted, precompressed copies of static/css and static/js.
+
+    build() writes `<dir>/<name>.<hash>.<ext>` plus `.gz` (and `.br` when the
+    brotli module is installed) into `build_dir`; existing outputs are kept,
+    so workers building at the same time, and pages still referencing an
+    older hash, are fine. Fingerprinted names are served from the normal
+    /static/ URL space (relative references inside CSS keep working) with a
+    year-long immutable Cache-Control and the smallest encoding the browser
+    accepts.
+    """
+
+    def __init__(self, static_folder, build_dir, dirs=ASSET_DIRS):
+        self.static_folder = static_folder
+        self.build_dir = build_dir
+        self.dirs = dirs
+        self.files = {}    # 'css/style.css' -> 'css/style.<hash>.css'
+        self.sources = {}  # reverse mapping
+
+    def _variant(self, path, suffix, raw, compress):
+        if os.path.exists(path + suffix):
+            return
+        packed = compress(raw)
+        if len(packed) < len(raw):
+            _atomic_write(path + suffix, packed)
+
+    def build(self):
+        files = {}
+        for sub in self.dirs:
+            folder = os.path.join(self.static_folder, sub)
+            if not os.path.isdir(folder):
+                continue
+            os.makedirs(os.path.join(self.build_dir, sub), exist_ok=True)
+            for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+                stem, ext = os.path.splitext(entry.name)
+                if not entry.is_file() or ext not in ('.css', '.js'):
+                    continue
+                with open(entry.path, 'rb') as f:
+                    raw = f.read()
+                name = f'{sub}/{stem}.{hashlib.sha256(raw).hexdigest()[:12]}{ext}'
+                target = os.path.join(self.build_dir, name)
+                if not os.path.exists(target):
+                    _atomic_write(target, raw)
+                self._variant(target, '.gz', raw, lambda b: gzip.compress(b, 9, mtime=0))
+                if BROTLI_AVAILABLE:
+                    self._variant(target, '.br', raw, lambda b: brotli.compress(b, quality=11))
+                files[f'{sub}/{entry.name}'] = name
+        _atomic_write(os.path.join(self.build_dir, 'manifest.json'),
+                      json.dumps(files, indent=2, sort_keys=True).encode('utf-8'))
+        self.files = files
+        self.sources = {v: k for k, v in files.items()}
+        return files
+
+    def clean(self):
+        """Delete built files that the current manifest no longer refers to."""
+        keep = set(self.sources) | {'manifest.json'}
+        removed = 0
+        for root, _, names in os.walk(self.build_dir):
+            for name in names:
+                rel = os.path.relpath(os.path.join(root, name), self.build_dir).replace(os.sep, '/')
+                if re.sub(r'\.(gz|br)$', '', rel) not in keep:
+                    os.unlink(os.path.join(root, name))
+                    removed += 1
+        return removed
+
+    def url(self, filename):
+        """Like url_for('static', filename=...) but fingerprinted when built."""
+        return url_for('static', filename=self.files.get(filename, filename))
+
+    def send(self, filename):
+        path = os.path.join(self.build_dir, filename)
+        encoding = None
+        for enc, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[enc] and os.path.exists(path + suffix):
+                path, encoding = path + suffix, enc
+                break
+        resp = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True, max_age=ASSET_MAX_AGE)
+        resp.cache_control.immutable = True
+        resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        return resp
+
+
+ASSETS = AssetManifest(app.static_folder, ASSET_BUILD_DIR)
+app.jinja_env.globals['asset_url'] = ASSETS.url
+
+
+def _read_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def send_upload(path):
+    """Serve a stored upload with a strong ETag and single byte ranges.
+
+    Whole files and ranges from byte 0 are handed to the server's
+    wsgi.file_wrapper with Content-Length set to the range length, so
+    servers that support it (gunicorn) send them with sendfile(); other
+    ranges are streamed in UPLOAD_CHUNK_SIZE reads.
+    Blobs that are never rewritten (anything but images) are addressed by
+    their content and cached as immutable.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        abort(404)
+    name, ext = os.path.splitext(os.path.basename(path))
+    blob_root = os.path.dirname(os.path.dirname(path))
+    in_blobs = blob_root == os.path.realpath(BLOBS.root) or (
+        os.path.basename(blob_root) == 'blobs'
+        and os.path.dirname(os.path.dirname(blob_root)) == os.path.realpath(TENANT_UPLOAD_FOLDER))
+    immutable = in_blobs and re.fullmatch(r'[0-9a-f]{64}', name) and ext[1:].lower() not in IMAGE_EXTS
+    etag = name if immutable else f'{st.st_mtime_ns:x}-{st.st_size:x}-{st.st_ino:x}'
+    resp = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream', direct_passthrough=True)
+    resp.set_etag(etag)
+    resp.last_modified = int(st.st_mtime)
+    resp.accept_ranges = 'bytes'
+    if immutable:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = ASSET_MAX_AGE
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = True
+    if not is_resource_modified(request.environ, etag=etag, last_modified=resp.last_modified):
+        resp.status_code = 304
+        return resp
+    start, end = 0, st.st_size
+    rng = request.range
+    if_range = request.if_range
+    # a stale If-Range means "send the whole (new) file"
+    if rng is not None and (if_range.etag or if_range.date):
+        if (if_range.etag or '') != etag and (if_range.date is None or if_range.date < resp.last_modified):
+            rng = None
+    if rng is not None and len(rng.ranges) == 1:
+        bounds = rng.range_for_length(st.st_size)
+        if bounds is None:
+            resp.status_code = 416
+            resp.content_range = ContentRange('bytes', None, None, st.st_size)
+            resp.content_length = 0
+            return resp
+        start, end = bounds
+        resp.status_code = 206
+        resp.content_range = ContentRange('bytes', start, end, st.st_size)
+    resp.content_length = end - start
+    if request.method == 'HEAD':
+        return resp
+    f = open(path, 'rb')
+    f.seek(start)
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    # gunicorn's sendfile() path always starts at byte 0 of the file, so only
+    # ranges starting there (including whole-file responses) are zero-copy
+    if wrapper is not None and start == 0:
+        resp.response = wrapper(f, UPLOAD_CHUNK_SIZE)
+    else:
+        resp.response = _read_range(f, end - start)
+    return resp
+
+
+def static_file(filename):
+    if filename in ASSETS.sources:
+        return ASSETS.send(filename)
+    if filename.startswith('uploads/'):
+        path = os.path.realpath(os.path.join(app.static_folder, filename))
+        if not path.startswith(os.path.realpath(UPLOAD_FOLDER) + os.sep):
+            abort(404)
+        return send_upload(path)
+    return app.send_static_file(filename)
+
+
+app.view_functions['static'] = static_file
+
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Delete fingerprinted files from earlier builds.')
+def build_assets(clean):
+    """Fingerprint and precompress static/css and static/js."""
+    files = ASSETS.build()
+    click.echo(f'built {len(files)} assets into {ASSETS.build_dir}')
+    if clean:
+        click.echo(f'removed {ASSETS.clean()} stale files')
+
+
+@app.context_processor
+def inject_ui_mode():
+    try:
+        data = load_data()
+        m = data.get('ui_mode') or ''
+        return {'UI_MODE': f"mode-{m}" if m else ''}
+    except Exception:
+        METRICS.swallowed('ui_mode')
+        return {'UI_MODE': ''}
+
+# simple auth decorator
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # in multi-tenant mode the session names the tenant it logged in to
+        if not session.get('admin') or session['admin'] != current_tenant().admin_key:
+            return redirect(url_for('admin_login'))
+        return f(*args, **kwargs)
+    return decorated
+
+
+@app.route('/admin')
+@admin_required
+def admin():
+    data = load_data()
+    return render_template('admin.html', data=data)
+
+
+@app.route('/admin/login', methods=['GET','POST'])
+def admin_login():
+    if request.method == 'GET':
+        return render_template('admin_login.html')
+    body = request.form or {}
+    username = body.get('username')
+    password = body.get('password')
+    tenant = current_tenant()
+    if tenant.check_admin(username, password):
+        session['admin'] = tenant.admin_key
+        return redirect(url_for('admin'))
+    return render_template('admin_login.html', error='Invalid credentials')
+
+
+@app.route('/admin/logout')
+def admin_logout():
+    session.pop('admin', None)
+    return redirect(url_for('index'))
+
+
+def normalize_profile(obj):
+    """Normalize an incoming payload to preserve lottie/description fields and ensure
+    arrays like certificates/snaps/events are objects with consistent shape."""
+    def normalize_items(arr):
+        if not arr or not isinstance(arr, list):
+            return []
+        out = []
+        for it in arr:
+            if isinstance(it, str):
+                out.append({'name': it})
+            elif isinstance(it, dict):
+                item = it.copy()
+                # preserve lottie if present and non-empty
+                l = it.get('lottie')
+                if isinstance(l, str) and l.strip():
+                    item['lottie'] = l
+                # preserve description if present and non-empty
+                d = it.get('description')
+                if isinstance(d, str) and d.strip():
+                    item['description'] = d
+                out.append(item)
+            else:
+                out.append(it)
+        return out
+
+    # normalize specific collections
+    try:
+        if 'certificates' in obj:
+            obj['certificates'] = normalize_items(obj.get('certificates'))
+        if 'snaps' in obj:
+            obj['snaps'] = normalize_items(obj.get('snaps'))
+        if 'events' in obj:
+            obj['events'] = normalize_items(obj.get('events'))
+        # projects should be arrays of dicts; convert strings to dicts if needed
+        if 'projects' in obj and isinstance(obj.get('projects'), list):
+            proj = []
+            for p in obj.get('projects'):
+                if isinstance(p, str):
+                    proj.append({"title": p, "description": "", "languages": "", "github": "", "images": [], "lottie": ""})
+                elif isinstance(p, dict):
+                    proj.append(p)
+            obj['projects'] = proj
+        if 'skills' in obj and isinstance(obj.get('skills'), list):
+            skl = []
+            for s in obj.get('skills'):
+                if isinstance(s, str):
+                    skl.append(s)
+                elif isinstance(s, dict):
+                    skl.append(s.get('name', str(s)))
+            obj['skills'] = [x for x in skl if x]
+    except Exception:
+        METRICS.swallowed('normalize_profile')
+    return obj
+
+
+def _data_saved(obj):
+    # Notify connected clients about UI mode change so public pages can update live
+    try:
+        ui = obj.get('ui_mode')
+        if ui:
+            send_sse('ui_mode', {'mode': ui})
+    except Exception:
+        METRICS.swallowed('event_publish')
+
+
+@app.route('/api/data', methods=['GET','POST','PUT','PATCH','DELETE'])
+@admin_required
+def api_data():
+    store = current_tenant().store
+    if request.method == 'GET':
+        data = store.get()
+        if etag_matches(request.headers.get('If-None-Match'), store.etag):
+            return Response(status=304, headers={'ETag': store.etag})
+        resp = jsonify(data)
+        resp.headers['ETag'] = store.etag
+        return resp
+    if_match = request.headers.get('If-Match')
+    if request.method in ('POST','PUT'):
+        obj = normalize_profile(request.get_json() or {})
+        try:
+            saved = store.update(lambda _: obj, if_match=if_match, op='replace')
+        except PreconditionFailed as e:
+            return jsonify({'ok': False, 'error': 'Data changed on the server', 'etag': str(e)}), 412
+        _data_saved(saved)
+        resp = jsonify({'ok': True})
+        resp.headers['ETag'] = store.etag
+        return resp
+    if request.method == 'PATCH':
+        # RFC 6902 JSON Patch or RFC 7396 merge patch, selected by Content-Type
+        ctype = (request.mimetype or '').lower()
+        body = request.get_json(force=True, silent=True)
+        if body is None:
+            return jsonify({'ok': False, 'error': 'Invalid JSON body'}), 400
+        json_patch = ctype == 'application/json-patch+json' or (ctype != 'application/merge-patch+json' and isinstance(body, list))
+        op = 'patch' if json_patch else 'merge'
+
+        def mutate(doc):
+            doc = apply_json_patch(doc, body) if json_patch else apply_merge_patch(doc, body)
+            if not isinstance(doc, dict):
+                raise PatchError('patched document must be a JSON object')
+            return normalize_profile(doc)
+
+        try:
+            saved = store.update(mutate, if_match=if_match, op=op, change=body)
+        except PreconditionFailed as e:
+            return jsonify({'ok': False, 'error': 'Data changed on the server', 'etag': str(e)}), 412
+        except PatchError as e:
+            return jsonify({'ok': False, 'error': str(e)}), 422
+        _data_saved(saved)
+        resp = jsonify({'ok': True, 'etag': store.etag})
+        resp.headers['ETag'] = store.etag
+        return resp
+    if request.method == 'DELETE':
+        kind = request.form.get('kind', 'cert')
+        store.save(store.default)
+        return jsonify({'ok': True})
+
+
+@app.route('/api/store-stats')
+@admin_required
+def api_store_stats():
+    # hit/miss/reload counters of the in-process data.json cache
+    tenant = current_tenant()
+    return jsonify(dict(tenant.store.stats(), llm=LLM.stats(), pages=tenant.pages.stats(), search=tenant.search.stats(),
+                        tenants=TENANTS.stats(), near_duplicates=NEAR_DUPS.stats(), startup=startup_report()))
+
+
+def _attach_upload(doc, kind, entry, project_index=None):
+    """Record an uploaded file in the profile document according to its kind."""
+    if kind == 'profile':
+        doc['profile'] = {'picture': entry['url'], 'picture_thumb': entry.get('thumb') or entry['url']}
+    elif kind == 'resume':
+        doc['resume'] = {'name': entry['name'], 'url': entry['url']}
+        if entry.get('thumb'):
+            doc['resume']['preview'] = entry['thumb']
+    elif kind == 'project':
+        projects = doc.get('projects') or []
+        if not projects:
+            raise ValueError('No project to attach the image to')
+        try:
+            project = projects[int(project_index)] if project_index not in (None, '') else projects[-1]
+        except (ValueError, IndexError):
+            raise ValueError('Unknown project')
+        project.setdefault('images', []).append(entry)
+    else:
+        key = {'cert': 'certificates', 'snap': 'snaps', 'event': 'events'}.get(kind)
+        if not key:
+            raise ValueError(f'Unknown upload kind: {kind}')
+        doc.setdefault(key, []).append(entry)
+    return doc
+
+
+@app.route('/api/upload', methods=['POST'])
+@admin_required
+def api_upload():
+    f = request.files.get('file')
+    kind = request.form.get('kind', 'cert')
+    if not f or not f.filename:
+        return jsonify({'ok': False, 'error': 'No file'}), 400
+    if not allowed(f.filename):
+        return jsonify({'ok': False, 'error': 'File type not allowed'}), 400
+    name = secure_filename(f.filename) or 'upload'
+    ext = f.filename.rsplit('.', 1)[1].lower()
+    is_image = ext in IMAGE_EXTS and ext != 'svg'
+    # images get the OpenCV pass, PDFs a first-page preview
+    processed = is_image or ext == 'pdf'
+    if processed and PROCESS_QUEUE.full():
+        return jsonify({'ok': False, 'error': 'busy', 'queued': PROCESS_QUEUE.depth()}), 503, {'Retry-After': '30'}
+    tenant = current_tenant()
+    blobs = tenant.blobs
+    digest, size, tmp = blobs.ingest(f.stream)
+    entry = {'name': name, 'url': blobs.url_for(digest, ext)}
+    if processed:
+        entry['thumb'] = blobs.thumb_url_for(digest, ext)
+    created = []
+
+    def mutate(doc):
+        # commit under the data lock so a concurrent save cannot free the blob
+        # between dedup and the new reference being recorded
+        # a duplicate upload reuses the placeholder of the stored copy
+        doc = _attach_upload(doc, kind, dict(entry, **(known_media_meta(doc, digest) or {})),
+                             request.form.get('project'))
+        path, new = blobs.commit(tmp, digest, ext)
+        created.append(new)
+        return doc
+
+    try:
+        tenant.store.update(mutate, op='upload')
+    except ValueError as e:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    path = blobs.path_for(digest, ext)
+    job = None
+    near = []
+    if processed and created[0]:
+        # identical content already went through enhancement; only new blobs need it
+        if is_image:
+            keep_original(path)
+        img = enhance_image(path) if is_image else None
+        if img is not None:
+            # placeholder until the background job refines it
+            record_media_meta(digest, media_meta(img=img))
+            # the thumbnail comes from the same decoded image; AVIF is left to the first request
+            DERIVATIVES.prime(digest, img, DERIVED_THUMB_WIDTH,
+                              {'webp', negotiate_image_format('', ext)} & DERIVED_FORMATS)
+            near = record_near_duplicates(tenant, entry['url'], path, digest, img, name, size)
+        if near and request.form.get('force') != '1':
+            # a near-duplicate is not enhanced unless asked for (force=1, or POST /api/jobs later)
+            logging.info('upload %s looks like %s, not queued', path, near[0]['url'])
+        else:
+            try:
+                job = PROCESS_QUEUE.put({'path': path, 'kind': kind, 'name': name, 'digest': digest,
+                                         'url': entry['url'], 'thumb': entry['thumb'], 'tenant': tenant.name})
+            except queue.Full:
+                logging.warning('image queue full, skipping advanced processing of %s', path)
+    return jsonify({'ok': True, 'name': name, 'url': entry['url'], 'thumb': entry.get('thumb'),
+                    'hash': digest, 'size': size, 'deduplicated': not created[0],
+                    'near_duplicates': near, 'job': job['id'] if job else None})
+
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@admin_required
+def api_jobs():
+    tenant = current_tenant()
+    if request.method == 'GET':
+        # the queue is shared; each tenant's admin sees its own jobs
+        match = {'tenant': tenant.name} if TENANT_MODE else None
+        return jsonify({'workers': PROCESS_QUEUE.workers, 'queued': PROCESS_QUEUE.depth(),
+                        'jobs': PROCESS_QUEUE.jobs(match=match)})
+    # (re)process an existing upload, e.g. an admin preview ahead of bulk work
+    body = request.get_json() or {}
+    digest = _blob_digest(body.get('url'))
+    path = tenant.blobs.find(digest) if digest else None
+    if not path:
+        return jsonify({'ok': False, 'error': 'Unknown upload'}), 404
+    priority = PRIORITIES.get(body.get('priority', 'preview'), PRIORITY_PREVIEW)
+    try:
+        job = PROCESS_QUEUE.put({'path': path, 'kind': body.get('kind'), 'name': body.get('name'),
+                                 'digest': digest, 'url': body.get('url'), 'tenant': tenant.name,
+                                 'thumb': tenant.blobs.thumb_url_for(digest, path.rsplit('.', 1)[-1])}, priority)
+    except queue.Full:
+        return jsonify({'ok': False, 'error': 'busy'}), 503, {'Retry-After': '30'}
+    return jsonify({'ok': True, 'job': dict(job)})
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET', 'DELETE'])
+@admin_required
+def api_job(job_id):
+    job = PROCESS_QUEUE.get(job_id)
+    if job is None or job.get('tenant') != current_tenant().name:
+        return jsonify({'ok': False, 'error': 'Unknown job'}), 404
+    if request.method == 'DELETE':
+        return jsonify({'ok': PROCESS_QUEUE.cancel(job_id)})
+    return jsonify(dict(job))
+
+
+@app.route('/api/duplicates')
+@admin_required
+def api_duplicates():
+    # near-duplicate clusters of the indexed uploads, biggest savings first
+    return jsonify(dict(duplicate_report(current_tenant()), ok=True))
+
+
+@app.cli.command('near-duplicates')
+@click.option('--tenant', 'tenant_name', help='Report on this tenant instead of the default portfolio.')
+@click.option('--index/--no-index', default=True, help='Hash uploads that are not indexed yet first.')
+def near_duplicates(tenant_name, index):
+    """Index uploaded images by perceptual hash and list near-duplicate clusters."""
+    tenant = TENANTS.get(tenant_name) if tenant_name else DEFAULT_TENANT
+    if tenant is None:
+        raise click.BadParameter(f'no tenant {tenant_name!r}', param_hint='--tenant')
+    if index:
+        known = NEAR_DUPS.indexed(tenant.name)
+        added = 0
+        for url, path in _image_uploads(tenant):
+            if url in known:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                img = open_image(path, max_size=(256, 256))
+            except Exception as e:
+                click.echo(f'skipping {url}: {e}', err=True)
+                continue
+            hashes = perceptual_hashes(img)
+            if hashes is None:
+                raise click.ClickException('NumPy is required for perceptual hashing')
+            NEAR_DUPS.add(url, path, _blob_digest(url) or digest, hashes, tenant.name,
+                          os.path.basename(path), os.path.getsize(path))
+            added += 1
+        click.echo(f'indexed {added} new images')
+    report = duplicate_report(tenant)
+    for cluster in report['clusters']:
+        click.echo(f"{len(cluster['members'])} images, {cluster['reclaimable'] / 1e6:.2f} MB reclaimable:")
+        for m in cluster['members']:
+            click.echo(f"  {m['distance']:2d}  {m['size'] or 0:>10}  {'' if m['referenced'] else '(unused) '}{m['url']}")
+    click.echo(f"{len(report['clusters'])} clusters, {report['reclaimable'] / 1e6:.2f} MB reclaimable")
+
+
+def _image_uploads(tenant):
+    """(url, path) of the tenant's stored images: blobs, plus loose legacy files
+    directly in static/uploads for the default portfolio."""
+    blobs = tenant.blobs
+    if os.path.isdir(blobs.root):
+        for entry in sorted(os.scandir(blobs.root), key=lambda e: e.name):
+            if entry.is_dir():
+                for f in sorted(os.scandir(entry.path), key=lambda e: e.name):
+                    digest, _, ext = f.name.partition('.')
+                    if ext.lower() in IMAGE_EXTS and ext.lower() != 'svg':
+                        yield blobs.url_for(digest, ext), f.path
+    if tenant.name is None and os.path.isdir(UPLOAD_FOLDER):
+        for f in sorted(os.scandir(UPLOAD_FOLDER), key=lambda e: e.name):
+            ext = f.name.rsplit('.', 1)[-1].lower()
+            if f.is_file() and ext in IMAGE_EXTS and ext != 'svg':
+                yield '/static/uploads/' + f.name, f.path
+
+
+@app.cli.command('dedupe-uploads')
+@click.option('--prune', is_flag=True, help='Delete legacy files in static/uploads that are no longer referenced.')
+def dedupe_uploads(prune):
+    """Move files referenced by data.json into the content-addressed blob store."""
+    legacy_re = re.compile(r'^/static/uploads/(?:thumbs/)?([^/]+)$')
+    moved = {}
+
+    def migrate(value):
+        m = legacy_re.match(value) if isinstance(value, str) else None
+        if not m or BlobStore.URL_RE.search(value):
+            return value
+        thumb = value.startswith('/static/uploads/thumbs/')
+        original = os.path.join(UPLOAD_FOLDER, m.group(1))
+        if not os.path.exists(original):
+            return value
+        if original not in moved:
+            ext = original.rsplit('.', 1)[-1].lower()
+            with open(original, 'rb') as fh:
+                digest, _, tmp = BLOBS.ingest(fh)
+            path, _ = BLOBS.commit(tmp, digest, ext)
+            kept = original_path(original)
+            if kept and os.path.exists(kept):
+                keep_original(path, source=kept)
+            moved[original] = (digest, ext)
+        digest, ext = moved[original]
+        if thumb and ext in IMAGE_EXTS and ext != 'svg':
+            return BLOBS.thumb_url_for(digest, ext)
+        return BLOBS.url_for(digest, ext)
+
+    def walk(o):
+        if isinstance(o, dict):
+            return {k: walk(v) for k, v in o.items()}
+        if isinstance(o, list):
+            return [walk(v) for v in o]
+        return migrate(o)
+
+    PROFILE_STORE.update(walk, op='dedupe-uploads')
+    click.echo(f'migrated {len(moved)} files into {len(set(moved.values()))} blobs')
+    if prune:
+        referenced = json.dumps(load_data(), ensure_ascii=False)
+        freed = 0
+        for folder, prefix in ((UPLOAD_FOLDER, '/static/uploads/'), (THUMB_FOLDER, '/static/uploads/thumbs/')):
+            for entry in os.scandir(folder):
+                if entry.is_file() and prefix + entry.name not in referenced:
+                    freed += entry.stat().st_size
+                    os.unlink(entry.path)
+                    drop_original(entry.path)
+        click.echo(f'pruned {freed / 1e6:.1f} MB of unreferenced legacy files')
+
+
+REPROCESS_DB_PATH = os.environ.get('REPROCESS_DB_PATH', os.path.join(os.path.dirname(__file__), 'reprocess.sqlite3'))
+# bump when the processing code changes in a way the settings below do not capture
+REPROCESS_VERSION = 2
+REPROCESS_REPORT_INTERVAL = float(os.environ.get('REPROCESS_REPORT_INTERVAL', '10'))
+# generated output under static/uploads, not uploads of their own
+REPROCESS_SKIP_DIRS = {'derived', 'previews', 'thumbs'}
+_REPROCESS_BLOB_RE = re.compile(r'^(?:tenants/(?P<tenant>[a-z0-9-]+)/)?blobs/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})\.[^/]+$')
+
+
+def _upload_kind(path):
+    ext = path.rsplit('.', 1)[-1].lower() if '.' in os.path.basename(path) else ''
+    if ext == 'pdf':
+        return 'pdf'
+    return 'image' if ext in IMAGE_EXTS and ext != 'svg' else None
+
+
+def reprocess_settings(kind):
+    """Fingerprint of what decides the output of reprocessing a `kind`
+    ('image' or 'pdf') upload; files done under another one are redone."""
+    load_image_libs()
+    if kind == 'pdf':
+        parts = (PDF_PREVIEW_WIDTH, PDFIUM_AVAILABLE)
+    else:
+        parts = (ENHANCE_MAX_SIZE, THUMB_SIZE, ENHANCE_ANALYSIS_SIZE, ENHANCE_TILE, CV2_AVAILABLE and NUMPY_AVAILABLE,
+                 TESSERACT_AVAILABLE and _ocr_settings())
+    return hashlib.sha256(repr((REPROCESS_VERSION, kind) + parts).encode()).hexdigest()[:16]
+
+
+def _reprocess_stamp(path):
+    st = os.stat(path)
+    return f'{st.st_mtime_ns}:{st.st_size}'
+
+
+class ReprocessCheckpoint(SQLiteBacked):
+    """Progress of `flask reprocess-uploads`: per file, the settings it was
+    last processed with and its size/mtime afterwards. A file is up to date
+    while both still match, so an interrupted run resumes where it stopped
+    and a settings change (or a new upload at the same path) redoes it."""
+
+    row_factory = sqlite3.Row
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS reprocessed (path TEXT PRIMARY KEY, settings TEXT NOT NULL, '
+                   'stamp TEXT, seconds REAL, finished REAL NOT NULL, error TEXT)')
+
+    def up_to_date(self, paths, settings):
+        """The subset of `paths` already processed under `settings` ({kind: fingerprint})."""
+        with self._db() as db:
+            rows = {r['path']: r for r in db.execute('SELECT path, settings, stamp FROM reprocessed '
+                                                     'WHERE error IS NULL').fetchall()}
+        done = set()
+        for path in paths:
+            row = rows.get(path)
+            if row is None or row['settings'] != settings[_upload_kind(path)]:
+                continue
+            try:
+                if row['stamp'] == _reprocess_stamp(path):
+                    done.add(path)
+            except OSError:
+                pass
+        return done
+
+    def record(self, result, settings):
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO reprocessed VALUES (?, ?, ?, ?, ?, ?)',
+                       (result['path'], settings, result['stamp'], result['seconds'], time.time(),
+                        result['error']))
+
+    def stats(self):
+        with self._db() as db:
+            row = db.execute('SELECT COUNT(*), COUNT(error), COALESCE(SUM(seconds), 0) FROM reprocessed').fetchone()
+        return {'files': row[0], 'failed': row[1], 'seconds': round(row[2], 1)}
+
+
+def _reprocess_file(path, scratch=None, thumb=None):
+    # images are redone from their original, on a copy that replaces the file at the end
+    ext = os.path.splitext(path)[1]
+    if _upload_kind(path) == 'pdf':
+        if scratch:
+            target = os.path.join(scratch, uuid.uuid4().hex + ext)
+            shutil.copyfile(path, target)
+            preview = render_pdf_preview(target, dest=target + '.png', force=True)
+        else:
+            preview = render_pdf_preview(path, force=True)
+        if preview is None:
+            raise RuntimeError('pypdfium2 is not installed')
+        return
+    if scratch:
+        source = original_path(path)
+        source = source if source and os.path.exists(source) else path
+        target = os.path.join(scratch, uuid.uuid4().hex + ext)
+        thumb = thumb and os.path.join(scratch, 'thumb-' + os.path.basename(target))
+    else:
+        # files stored before originals were kept become their own original here
+        source = keep_original(path) or path
+        target = os.path.join(os.path.dirname(path), f'.reprocess-{uuid.uuid4().hex}{ext}')
+    shutil.copyfile(source, target)
+    try:
+        if enhance_image(target) is None:
+            raise ValueError('not a readable image')
+        advanced_enhance(target)
+        if not scratch:
+            os.replace(target, path)
+            target = path
+    finally:
+        if not scratch and target != path:
+            os.unlink(target)
+    if thumb:
+        make_thumbnail(target, thumb)
+
+
+def reprocess_upload(path, scratch=None, thumb=None, meta=False):
+    """Run a stored upload through processing again: enhance_image and
+    advanced_enhance for images (and the legacy thumbnail at `thumb`), a
+    fresh first-page preview for PDFs.
+
+    Images start from the original kept at upload (keep_original()), so
+    repeated runs do not compound; a file stored before originals were kept
+    is taken as its own original on its first run. The stored file is
+    replaced at the end, under the job lease on `path`, so an image job never
+    works on it at the same time. With a `scratch` directory a copy is
+    processed there and the stored files are left alone (dry runs).
+
+    Returns {path, bytes, seconds, stamp, busy, error, meta}; `busy` means an
+    image job held the file and nothing was done, `meta` is the new
+    media_meta() when asked for. Errors are reported, not raised.
+    """
+    started = time.perf_counter()
+    result = {'path': path, 'bytes': 0, 'stamp': None, 'busy': False, 'error': None, 'meta': None}
+    try:
+        result['bytes'] = os.path.getsize(path)
+        if scratch:
+            _reprocess_file(path, scratch, thumb)
+        else:
+            with PROCESS_QUEUE.lease(path, 'reprocess') as held:
+                result['busy'] = not held
+                if held:
+                    _reprocess_file(path, thumb=thumb)
+                    if meta:
+                        result['meta'] = media_meta(path)
+                    result['stamp'] = _reprocess_stamp(path)
+    except Exception as e:
+        logging.exception('reprocessing %s failed', path)
+        METRICS.swallowed('reprocess')
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        # pool workers are long-lived: hand their stage timings over per file
+        METRICS.flush()
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def _reprocess_task(task):
+    return reprocess_upload(*task)
+
+
+@contextlib.contextmanager
+def _reprocess_map(workers):
+    """imap_unordered over a pool of `workers` processes (in this process for one)."""
+    if workers <= 1:
+        yield map
+        return
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    with ctx.Pool(workers, initializer=load_image_libs) as pool:
+        yield pool.imap_unordered
+
+
+def _reprocess_candidates(root):
+    """Sorted paths of the images and PDFs stored below `root`."""
+    found = []
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in REPROCESS_SKIP_DIRS)
+        found += [os.path.join(dirpath, f) for f in sorted(files) if not f.startswith('.') and _upload_kind(f)]
+    return found
+
+
+def _reprocess_tasks(paths, scratch=None):
+    """reprocess_upload() arguments for `paths`: loose legacy images get their
+    thumbnail redone, blobs a new placeholder."""
+    tasks = []
+    for path in paths:
+        thumb = os.path.join(THUMB_FOLDER, os.path.basename(path))
+        legacy = os.path.dirname(path) == UPLOAD_FOLDER and os.path.exists(thumb)
+        tasks.append((path, scratch, thumb if legacy else None, _upload_owner(path)[1] is not None))
+    return tasks
+
+
+def _upload_owner(path):
+    """(tenant name, blob digest) of a stored upload; the digest is None for
+    loose legacy files."""
+    m = _REPROCESS_BLOB_RE.match(os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/'))
+    return (m.group('tenant'), m.group('digest')) if m else (None, None)
+
+
+def _flush_reprocess_metas(metas, previews):
+    # one data.json write per tenant for everything finished since the last flush
+    if previews:
+        with use_tenant(DEFAULT_TENANT):
+            record_pdf_previews(previews)
+        previews.clear()
+    for name, batch in metas.items():
+        tenant = TENANTS.get(name) if name else DEFAULT_TENANT
+        if tenant is None:
+            logging.warning('tenant %s is gone, not recording placeholders', name)
+            continue
+        with use_tenant(tenant):
+            record_media_metas(batch)
+    metas.clear()
+
+
+def _duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f'{seconds}s'
+    return f'{seconds // 3600}h{seconds // 60 % 60:02d}m' if seconds >= 3600 else f'{seconds // 60}m{seconds % 60:02d}s'
+
+
+def _estimate_reprocess(pending, sample, workers):
+    """Process copies of `sample` files spread over `pending` in a scratch
+    directory and extrapolate (by seconds per byte of each kind) to all of them."""
+    picked = [pending[i * len(pending) // sample] for i in range(min(sample, len(pending)))]
+    per_kind = collections.defaultdict(lambda: [0.0, 0])
+    started = time.monotonic()
+    with tempfile.TemporaryDirectory(prefix='reprocess-') as scratch:
+        with _reprocess_map(workers) as run:
+            for result in run(_reprocess_task, _reprocess_tasks(picked, scratch)):
+                if result['error']:
+                    click.echo(f"failed: {result['path']}: {result['error']}", err=True)
+                    continue
+                totals = per_kind[_upload_kind(result['path'])]
+                totals[0] += result['seconds']
+                totals[1] += result['bytes']
+    elapsed = time.monotonic() - started
+    if not per_kind:
+        raise click.ClickException('no sample file could be processed')
+    overall = sum(t[0] for t in per_kind.values()) / max(1, sum(t[1] for t in per_kind.values()))
+    cpu = 0.0
+    for path in pending:
+        seconds, size = per_kind.get(_upload_kind(path), (0.0, 0))
+        cpu += os.path.getsize(path) * (seconds / size if size else overall)
+    rates = ', '.join(f'{kind}s {t[0] / max(t[1], 1) * 1e6:.2f} s/MB' for kind, t in sorted(per_kind.items()))
+    click.echo(f'sampled {len(picked)} files in {elapsed:.1f}s ({rates})')
+    click.echo(f'estimated {_duration(cpu / workers)} for {len(pending)} files with --workers {workers} '
+               f'({_duration(cpu)} of processing)')
+
+
+@app.cli.command('reprocess-uploads')
+@click.option('--tenant', 'tenant_name', help="Only this tenant's uploads (default: every stored upload).")
+@click.option('--workers', type=int, default=lambda: os.cpu_count() or 1, show_default='all cores',
+              help='Processes to run in parallel.')
+@click.option('--force', is_flag=True, help='Also redo files that are up to date for the current settings.')
+@click.option('--dry-run', is_flag=True, help='Time a sample on scratch copies and estimate the whole run.')
+@click.option('--sample', type=int, default=20, show_default=True, help='Files timed by --dry-run.')
+def reprocess_uploads(tenant_name, workers, force, dry_run, sample):
+    """Re-run enhancement, legacy thumbnails and PDF previews on stored uploads.
+
+    Files are processed in place on all cores; loose PDFs from before the
+    blob store get their preview linked in data.json. Every finished file is
+    checkpointed with the settings used, so an interrupted run resumes and
+    only files processed under other settings are redone.
+    """
+    root = UPLOAD_FOLDER
+    if tenant_name:
+        root = os.path.join(TENANT_UPLOAD_FOLDER, tenant_name)
+        if not TENANT_NAME_RE.fullmatch(tenant_name) or not os.path.isdir(root):
+            raise click.BadParameter(f'no uploads for tenant {tenant_name!r}', param_hint='--tenant')
+    workers = max(1, workers)
+    checkpoint = ReprocessCheckpoint(REPROCESS_DB_PATH)
+    settings = {kind: reprocess_settings(kind) for kind in ('image', 'pdf')}
+    paths = _reprocess_candidates(root)
+    done = set() if force else checkpoint.up_to_date(paths, settings)
+    pending = [p for p in paths if p not in done]
+    click.echo(f'{len(paths)} uploads: {len(done)} up to date, {len(pending)} to process')
+    if not pending:
+        return
+    if dry_run:
+        _estimate_reprocess(pending, max(1, sample), workers)
+        return
+    tasks = _reprocess_tasks(pending)
+    metas = collections.defaultdict(dict)
+    previews = {}
+    processed = failed = busy = size = 0
+    started = last_report = last_flush = time.monotonic()
+    try:
+        with _reprocess_map(workers) as run:
+            for result in run(_reprocess_task, tasks):
+                path = result['path']
+                if result['busy']:
+                    # an image job has it right now; left pending for the next run
+                    busy += 1
+                    click.echo(f'skipped (image job running): {path}', err=True)
+                    continue
+                checkpoint.record(result, settings[_upload_kind(path)])
+                if result['error']:
+                    failed += 1
+                    click.echo(f"failed: {path}: {result['error']}", err=True)
+                else:
+                    processed += 1
+                    size += result['bytes']
+                    tenant, digest = _upload_owner(path)
+                    if digest:
+                        # resized variants are rebuilt from the new file on request
+                        DERIVATIVES.purge(digest)
+                        if result['meta']:
+                            metas[tenant][digest] = result['meta']
+                    elif _upload_kind(path) == 'pdf' and os.path.dirname(path) == UPLOAD_FOLDER:
+                        previews['/static/uploads/' + os.path.basename(path)] = \
+                            '/static/uploads/previews/' + os.path.basename(pdf_preview_path(path))
+                now = time.monotonic()
+                if now - last_flush >= 2:
+                    _flush_reprocess_metas(metas, previews)
+                    last_flush = now
+                if now - last_report >= REPROCESS_REPORT_INTERVAL:
+                    last_report = now
+                    finished, elapsed = processed + failed, now - started
+                    click.echo(f'{finished}/{len(tasks)} files, {finished / elapsed:.2f} files/s, '
+                               f'{size / 1e6 / elapsed:.1f} MB/s, '
+                               f'~{_duration((len(tasks) - finished) * elapsed / finished)} left')
+    finally:
+        _flush_reprocess_metas(metas, previews)
+    elapsed = max(time.monotonic() - started, 1e-9)
+    click.echo(f'processed {processed} files ({size / 1e6:.1f} MB) in {_duration(elapsed)} with --workers {workers}: '
+               f'{processed / elapsed:.2f} files/s, {size / 1e6 / elapsed:.1f} MB/s; {failed} failed, {busy} busy')
+    if failed:
+        raise click.exceptions.Exit(1)
+
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') != '0'
+SMTP_USER = os.environ.get('SMTP_USER')
+OUTBOX_DB_PATH = os.environ.get('OUTBOX_DB_PATH', os.path.join(os.path.dirname(__file__), 'outbox.sqlite3'))
+
+
+class Outbox(SQLiteBacked):
+    """Persistent queue of outgoing contact-form mail.
+
+    /contact only inserts a row and answers; a sender thread in each process
+    claims ready messages in batches under a lease and delivers them over a
+    single SMTP connection that stays logged in between batches (it is
+    closed after `keepalive` idle seconds and re-opened on demand). Messages
+    that fail with a temporary error are retried with exponential backoff up
+    to `max_attempts` times; 5xx answers and refused recipients fail them
+    right away. Every message has a random token so its delivery status can
+    be looked up without exposing the others.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token TEXT NOT NULL UNIQUE,
+            sender TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            created REAL NOT NULL,
+            sent REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS outbox_ready ON outbox(status, run_after);
+    '''
+
+    row_factory = sqlite3.Row
+
+    def __init__(self, db_path, host, port=587, username=None, password=None, starttls=True,
+                 batch=20, max_attempts=5, backoff=30.0, keepalive=30.0, timeout=20.0,
+                 poll_interval=5.0, keep_sent=1000):
+        self.db_path = db_path
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.keep_sent = keep_sent
+        self.lease_time = timeout * batch + 30
+        self.connections = 0
+        self._smtp = None
+        self._smtp_used = 0.0
+        self._owner = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._last_sweep = 0.0
+
+    def _create(self, db):
+        db.executescript(self.SCHEMA)
+        # the tenant whose contact form queued the message (NULL: the default portfolio)
+        _add_column(db, 'outbox', 'tenant', 'TEXT')
+
+    @staticmethod
+    def _status(row):
+        if row is None:
+            return None
+        return {k: row[k] for k in ('id', 'token', 'recipient', 'status', 'attempts', 'created', 'sent', 'error',
+                                    'tenant')}
+
+    @property
+    def configured(self):
+        return bool(self.password)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._owner = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+            self._smtp = None
+            self.sweep()
+            self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._close()
+
+    def put(self, msg, tenant=None):
+        """Queue an email.message.Message; returns its status dict."""
+        now = time.time()
+        with self._db() as db:
+            msg_id = db.execute(
+                "INSERT INTO outbox (token, sender, recipient, message, status, run_after, created, tenant) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (uuid.uuid4().hex, msg['From'], msg['To'], msg.as_string(), now, now, tenant)).lastrowid
+            row = db.execute('SELECT * FROM outbox WHERE id = ?', (msg_id,)).fetchone()
+        with self._cond:
+            self._cond.notify()
+        return self._status(row)
+
+    def get(self, msg_id=None, token=None):
+        with self._db() as db:
+            if token is not None:
+                row = db.execute('SELECT * FROM outbox WHERE token = ?', (token,)).fetchone()
+            else:
+                row = db.execute('SELECT * FROM outbox WHERE id = ?', (msg_id,)).fetchone()
+        return self._status(row)
+
+    def messages(self, limit=200, tenant=None):
+        with self._db() as db:
+            rows = db.execute('SELECT * FROM outbox WHERE tenant IS ? ORDER BY id DESC LIMIT ?',
+                              (tenant, limit)).fetchall()
+        return [self._status(r) for r in rows]
+
+    def stats(self):
+        with self._db() as db:
+            counts = dict(db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        return {'counts': counts, 'connections': self.connections, 'connected': self._smtp is not None}
+
+    def sweep(self):
+        """Re-queue messages whose sender died mid-batch and prune old sent ones."""
+        now = time.time()
+        self._last_sweep = now
+        with self._db() as db:
+            cur = db.execute("UPDATE outbox SET status = 'queued', lease_owner = NULL, lease_expires = NULL "
+                             "WHERE status = 'sending' AND lease_expires < ?", (now,))
+            db.execute("DELETE FROM outbox WHERE status = 'sent' AND id NOT IN "
+                       "(SELECT id FROM outbox WHERE status = 'sent' ORDER BY id DESC LIMIT ?)", (self.keep_sent,))
+            return cur.rowcount
+
+    def _claim(self, db):
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute("SELECT * FROM outbox WHERE status = 'queued' AND run_after <= ? "
+                              "ORDER BY id LIMIT ?", (now, self.batch)).fetchall()
+            if rows:
+                ids = [r['id'] for r in rows]
+                db.execute(f"UPDATE outbox SET status = 'sending', lease_owner = ?, lease_expires = ?, "
+                           f"attempts = attempts + 1 WHERE id IN ({','.join('?' * len(ids))})",
+                           [self._owner, now + self.lease_time] + ids)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _connection(self, sender):
+        if self._smtp is not None and time.monotonic() - self._smtp_used > 1.0:
+            # make sure an idle connection was not dropped by the server
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self._close()
+            except (smtplib.SMTPException, OSError):
+                self._close()
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.starttls:
+                    smtp.starttls()
+                if self.password:
+                    smtp.login(self.username or sender, self.password)
+            except BaseException:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    def _close(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+    def _deliver(self, db, rows):
+        for row in rows:
+            error, permanent = None, False
+            try:
+                with METRICS.timer('upstream_request_seconds', service='smtp'):
+                    smtp = self._connection(row['sender'])
+                    smtp.sendmail(row['sender'], [row['recipient']], row['message'])
+                self._smtp_used = time.monotonic()
+            except smtplib.SMTPRecipientsRefused as e:
+                error = str(e)
+                permanent = all(code >= 500 for code, _ in e.recipients.values())
+            except smtplib.SMTPAuthenticationError as e:
+                # credentials may be fixed before the next attempt
+                error = f'{e.smtp_code} {e.smtp_error!r}'
+                self._close()
+            except smtplib.SMTPResponseException as e:
+                error, permanent = f'{e.smtp_code} {e.smtp_error!r}', e.smtp_code >= 500
+                if not permanent:
+                    self._close()
+            except (smtplib.SMTPException, OSError) as e:
+                error = str(e) or type(e).__name__
+                self._close()
+            now = time.time()
+            if error is None:
+                db.execute("UPDATE outbox SET status = 'sent', sent = ?, error = NULL, lease_owner = NULL "
+                           "WHERE id = ?", (now, row['id']))
+            elif not permanent and row['attempts'] + 1 < self.max_attempts:
+                db.execute("UPDATE outbox SET status = 'queued', run_after = ?, error = ?, lease_owner = NULL, "
+                           "lease_expires = NULL WHERE id = ?",
+                           (now + self.backoff * 2 ** row['attempts'], error, row['id']))
+            else:
+                db.execute("UPDATE outbox SET status = 'failed', error = ?, lease_owner = NULL WHERE id = ?",
+                           (error, row['id']))
+            if error is not None:
+                logging.warning('contact mail %s not delivered: %s', row['id'], error)
+
+    def _next_due(self, db):
+        due = db.execute("SELECT MIN(run_after) FROM outbox WHERE status = 'queued'").fetchone()[0]
+        return self.poll_interval if due is None else min(self.poll_interval, max(0.0, due - time.time()))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            try:
+                with self._db() as db:
+                    if time.time() - self._last_sweep > 60:
+                        self.sweep()
+                    rows = self._claim(db)
+                    if rows:
+                        self._deliver(db, rows)
+                        continue
+                    wait = self._next_due(db)
+            except Exception:
+                logging.exception('outbox sender failed')
+                METRICS.swallowed('outbox')
+                wait = self.poll_interval
+            if self._smtp is not None and time.monotonic() - self._smtp_used > self.keepalive:
+                self._close()
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(min(wait, self.keepalive) if self._smtp is not None else wait)
+
+
+OUTBOX = Outbox(OUTBOX_DB_PATH, SMTP_HOST, SMTP_PORT, username=SMTP_USER,
+                password=os.environ.get('EMAIL_PASSWORD'), starttls=SMTP_STARTTLS)
+
+
+def _plain_address(value):
+    """True for a bare `local@domain` address (no display name, list or comments)."""
+    realname, addr = parseaddr(value)
+    local, _, domain = addr.rpartition('@')
+    return not realname and addr == value and bool(local) and '.' in domain \
+        and not any(c.isspace() or c in '<>,;"()' for c in addr)
+
+
+@app.route('/contact', methods=['POST'])
+def contact():
+    data = request.form or {}
+    name = data.get('from_name', '').strip()
+    user_email = data.get('from_email', '').strip()
+    message_text = data.get('message', '').strip()
+    if not all([name, user_email, message_text]):
+        return jsonify({'ok': False, 'error': 'Missing required fields'}), 400
+    # both end up in headers (Reply-To, Subject): no line breaks, one plain address
+    if any(c in name + user_email for c in '\r\n') or not _plain_address(user_email):
+        return jsonify({'ok': False, 'error': 'Invalid email address'}), 400
+    # Profile email
+    tenant = current_tenant()
+    to_email = tenant.store.get().get('email') or tenant.fallback.get('email')
+    if not to_email:
+        return jsonify({'ok': False, 'error': 'No contact address configured'}), 500
+    from_email = OUTBOX.username or to_email  # Use same for sender
+    subject = f"New Contact Form Message from {name}"
+    body = f"Name: {name}\nEmail: {user_email}\nMessage:\n{message_text}"
+    if not OUTBOX.configured:
+        return jsonify({'ok': False, 'error': 'Email configuration missing'}), 500
+
+    msg = MIMEMultipart()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Reply-To'] = user_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+
+    try:
+        queued = OUTBOX.put(msg, tenant.name)
+    except Exception as e:
+        logging.exception('could not queue contact mail: %s', e)
+        METRICS.swallowed('contact')
+        return jsonify({'ok': False, 'error': 'Failed to send email'}), 500
+    return jsonify({'ok': True, 'message': 'Message queued for delivery', 'status': queued['status'],
+                    'status_url': url_for('contact_status', token=queued['token'])}), 202
+
+
+@app.route('/contact/status/<token>')
+def contact_status(token):
+    status = OUTBOX.get(token=token)
+    if status is None:
+        return jsonify({'ok': False, 'error': 'not found'}), 404
+    return jsonify({'ok': True, 'status': status['status'], 'attempts': status['attempts'],
+                    'sent': status['sent']})
+
+
+@app.route('/api/outbox')
+@admin_required
+def api_outbox():
+    return jsonify({'ok': True, 'stats': OUTBOX.stats(), 'messages': OUTBOX.messages(tenant=current_tenant().name)})
+
+
+@app.route('/api/outbox/<int:msg_id>')
+@admin_required
+def api_outbox_message(msg_id):
+    status = OUTBOX.get(msg_id)
+    if status is None or status['tenant'] != current_tenant().name:
+        return jsonify({'ok': False, 'error': 'not found'}), 404
+    return jsonify({'ok': True, 'message': status})
+
+
+@app.route('/events')
+@cached_page
+def events(data, lang):
+    events = data.get('events', [])
+    return render_template('events.html', events=events)
+
+
+@app.route('/certifications')
+@cached_page
+def certifications(data, lang):
+    certs = data.get('certificates', [])
+    return render_template('certifications.html', certs=certs)
+
+
+@app.route('/snaps')
+@cached_page
+def snaps(data, lang):
+    snaps = data.get('snaps', [])
+    return render_template('snaps.html', snaps=snaps)
+
+
+@app.route('/gallery')
+def gallery():
+    return render_template('gallery.html')
+
+
+ITEMS_PAGE_SIZE = int(os.environ.get('ITEMS_PAGE_SIZE', '24'))
+ITEMS_PAGE_MAX = int(os.environ.get('ITEMS_PAGE_MAX', '100'))
+ITEM_FIELDS = ('name', 'description', 'url', 'thumb', 'width', 'height', 'lqip')
+
+
+def _collection_entries(data, collection):
+    if collection == 'gallery':
+        # project screenshots, flattened in project order
+        for project in data.get('projects') or []:
+            if isinstance(project, dict):
+                for image in project.get('images') or []:
+                    if isinstance(image, dict):
+                        yield dict(image, project=project.get('title'))
+        return
+    for entry in data.get(collection) or []:
+        yield entry if isinstance(entry, dict) else {'name': str(entry)}
+
+
+def build_item_index(data, collection):
+    """Public JSON view of one collection: (items, position of each item id).
+
+    Ids are derived from the entry (not its position) so cursors survive
+    inserts in front of them.
+    """
+    items, positions = [], {}
+    for entry in _collection_entries(data, collection):
+        item = {k: entry[k] for k in ITEM_FIELDS + ('project',) if entry.get(k) not in (None, '')}
+        base = hashlib.sha1(f"{entry.get('url')}|{entry.get('name')}".encode('utf-8')).hexdigest()[:12]
+        item_id, n = base, 1
+        while item_id in positions:
+            # the same file listed twice
+            n += 1
+            item_id = f'{base}-{n}'
+        item['id'] = item_id
+        srcset = srcset_filter(item.get('url'))
+        if srcset:
+            item['srcset'] = srcset
+        positions[item['id']] = len(items)
+        items.append(item)
+    return items, positions
+
+
+ITEM_COLLECTIONS = ('snaps', 'certificates', 'events', 'gallery')
+_ITEM_INDEX = LRUCache(maxsize=len(ITEM_COLLECTIONS) * 2)
+
+
+def item_index(collection):
+    data = load_data()
+    tenant = current_tenant()
+    key = (tenant.name, tenant.store.version, collection)
+    index = _ITEM_INDEX.get(key)
+    if index is None:
+        index = build_item_index(data, collection)
+        _ITEM_INDEX.set(key, index)
+    return index
+
+
+def encode_cursor(item_id, pos):
+    raw = json.dumps([item_id, pos], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(item id, position) from an opaque cursor; ValueError if malformed."""
+    try:
+        item_id, pos = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(item_id, str) or not isinstance(pos, int) or pos < 0:
+        raise ValueError('invalid cursor')
+    return item_id, pos
+
+
+@app.route('/api/items/<collection>')
+def api_items(collection):
+    """Cursor-paginated public listing with dimensions and LQIP placeholders.
+
+    `cursor` names the last item already shown; the next page starts right
+    after it, or at its old position if it has since been removed.
+    """
+    if collection not in ITEM_COLLECTIONS:
+        return jsonify({'ok': False, 'error': 'Unknown collection'}), 404
+    try:
+        limit = min(max(int(request.args.get('limit', ITEMS_PAGE_SIZE)), 1), ITEMS_PAGE_MAX)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid limit'}), 400
+    cursor = request.args.get('cursor')
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    items, positions = item_index(collection)
+    start = 0
+    if after:
+        item_id, pos = after
+        # a removed item leaves its successors shifted down by one, onto `pos`
+        start = positions[item_id] + 1 if item_id in positions else pos
+    page = items[start:start + limit]
+    more = start + len(page) < len(items)
+    body = {'ok': True, 'items': page, 'total': len(items),
+            'next': encode_cursor(page[-1]['id'], start + len(page) - 1) if page and more else None}
+    resp = jsonify(body)
+    resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest()[:20])
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
+
+
+@app.route('/api/search')
+def api_search():
+    """Ranked full-text search; every word must match, the last one as a prefix.
+
+    `type` limits results to one collection (or 'profile'), `field` to entries
+    where the words occur in that field (e.g. `languages`).
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'ok': False, 'error': 'missing q'}), 400
+    collection = request.args.get('type') or None
+    if collection and collection not in SEARCH_COLLECTIONS + ('profile',):
+        return jsonify({'ok': False, 'error': 'Unknown type'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_LIMIT)), 1), SEARCH_LIMIT_MAX)
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid limit'}), 400
+    index = search_index()
+    started = time.perf_counter()
+    results = index.search(query, collection=collection, field=request.args.get('field') or None, limit=limit)
+    took = time.perf_counter() - started
+    resp = jsonify({'ok': True, 'query': query, 'results': results, 'took_ms': round(took * 1000, 3)})
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+@app.route('/resume')
+@cached_page
+def resume(data, lang):
+    resume = data.get('resume', {})
+    return render_template('resume.html', resume=resume)
+
+
+@app.route('/projects')
+@cached_page
+def projects(data, lang):
+    projects = data.get('projects', [])
+    return render_template('projects.html', profile=data, projects=projects)
+
+@app.errorhandler(404)
+def page_not_found(e):
+    # render a friendly 404 page that matches the site style
+    return render_template('404.html'), 404
+
+
+@app.route('/')
+@cached_page
+def index(data, lang):
+    return render_template('index.html', profile=data, lang=lang)
+
+
+@app.route('/welcome')
+def welcome():
+    return render_template('welcome.html')
+    
 @app.route('/set-lang', methods=['POST'])
 def set_lang():
     data = request.get_json() or {}
@@ -613,41 +5304,341 @@ def api_user_info():
 def chat():
     data = request.get_json() or {}
     message = data.get('message', '')
-    # use persisted profile data for answers
-    profile = load_data()
     reply = answer_bot(message)
     return jsonify({"reply": reply})
 
 
+LLM_API_URL = os.environ.get('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta2/models/text-bison-001:generate')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '10'))
+LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', '3600'))
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream that has been failing."""
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` seconds a
+    single trial call is let through and closes it again on success."""
+
+    def __init__(self, threshold=3, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """An allowed call ended without a verdict (e.g. the client went
+        away): let the next trial through."""
+        with self._lock:
+            self._trial = False
+
+
+class LLMClient:
+    """Upstream client for /chat-llm.
+
+    Uses one keep-alive requests.Session, caches replies per (profile data
+    version, normalized question) with a TTL, collapses concurrent identical
+    questions into a single upstream call and stops calling the upstream
+    while the circuit breaker is open. Replies can be consumed as they
+    arrive when the upstream answers with text/event-stream.
+    """
+
+    def __init__(self, url, api_key=None, timeout=10.0, cache_ttl=3600.0, pool_size=10):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.cache = LRUCache(maxsize=1024, ttl=cache_ttl)
+        self.breaker = CircuitBreaker()
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.api_key)
+
+    def _body(self, message, facts):
+        # include short profile summary as context
+        prompt_text = f"You are a concise assistant that answers questions about the following profile:\n{facts['summary']}\nUser: {message}\nAnswer in one or two short sentences."
+        return {"prompt": {"text": prompt_text}, "maxOutputTokens": 256}
+
+    @staticmethod
+    def _text(jr):
+        # attempt to extract the generated text
+        cands = jr.get('candidates') if isinstance(jr, dict) else None
+        if not isinstance(cands, list) or not cands:
+            return ''
+        content = cands[0].get('content', '')
+        if isinstance(content, dict):
+            return ''.join(p.get('text', '') for p in content.get('parts', []))
+        return content or ''
+
+    def _call(self, message, facts):
+        """Yield reply text chunks from the upstream."""
+        self.upstream_calls += 1
+        headers = {'X-Goog-Api-Key': self.api_key, 'Content-Type': 'application/json',
+                   'Accept': 'text/event-stream, application/json'}
+        with METRICS.timer('upstream_request_seconds', service='llm'), \
+                self.session.post(self.url, headers=headers, json=self._body(message, facts),
+                                  timeout=self.timeout, stream=True) as r:
+            r.raise_for_status()
+            if 'text/event-stream' in r.headers.get('Content-Type', ''):
+                for line in r.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:'):
+                        text = self._text(json.loads(line[5:]))
+                        if text:
+                            yield text
+            else:
+                yield self._text(r.json())
+
+    def stream(self, message):
+        """Yield the reply in chunks (a cached or coalesced reply is one chunk)."""
+        facts = bot_facts()
+        tenant = current_tenant()
+        key = (tenant.name, tenant.store.version, normalize_message(message))
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {'done': threading.Event(), 'reply': None, 'error': None}
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not flight['done'].wait(self.timeout * 2):
+                raise TimeoutError('upstream reply timed out')
+            if flight['error'] is not None:
+                raise flight['error']
+            yield flight['reply']
+            return
+        parts = []
+        try:
+            if not self.breaker.allow():
+                raise CircuitOpen('LLM upstream unavailable')
+            try:
+                for chunk in self._call(message, facts):
+                    parts.append(chunk)
+                    yield chunk
+            except Exception:
+                self.breaker.failure()
+                raise
+            except BaseException:
+                # GeneratorExit on disconnect: no verdict, but the half-open trial must not stay taken
+                self.breaker.release()
+                raise
+            self.breaker.success()
+            flight['reply'] = ''.join(parts).strip()
+            if flight['reply']:
+                self.cache.set(key, flight['reply'])
+        except BaseException as e:
+            flight['error'] = e if isinstance(e, Exception) else RuntimeError('request aborted')
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight['done'].set()
+
+    def ask(self, message):
+        return ''.join(self.stream(message)).strip()
+
+    def stats(self):
+        return {'breaker': self.breaker.state, 'upstream_calls': self.upstream_calls,
+                'coalesced': self.coalesced, 'cache': self.cache.stats()}
+
+
+LLM = LLMClient(LLM_API_URL, os.environ.get('GEMINI_API_KEY'), timeout=LLM_TIMEOUT, cache_ttl=LLM_CACHE_TTL)
+
+
 @app.route('/chat-llm', methods=['POST'])
 def chat_llm():
     data = request.get_json() or {}
     message = data.get('message', '')
     # Prefer Gemini/Google Generative if GEMINI_API_KEY present
-    gemini_key = os.environ.get('GEMINI_API_KEY')
-    if gemini_key:
-        try:
-            # call Google Generative API (simple text generation)
-            url = 'https://generativelanguage.googleapis.com/v1beta2/models/text-bison-001:generate'
-            headers = {'X-Goog-Api-Key': gemini_key, 'Content-Type': 'application/json'}
-            # include short profile summary as context
-            profile = load_data()
-            projects = profile.get('projects', [])
-            titles = [p.get('title', str(p)) for p in projects]
-            summary = f"Name: {profile.get('name')}\nLocation: {profile.get('location')}\nSkills: {', '.join(profile.get('skills',[]))}\nProjects: {', '.join(titles)}\nContact: {profile.get('email')} | {profile.get('phone')}"
-            prompt_text = f"You are a concise assistant that answers questions about the following profile:\n{summary}\nUser: {message}\nAnswer in one or two short sentences."
-            body = {"prompt": {"text": prompt_text}, "maxOutputTokens": 256}
-            r = requests.post(url, headers=headers, json=body, timeout=10)
-            if r.ok:
-                jr = r.json()
-                # attempt to extract the generated text
-                text = jr.get('candidates',[{}])[0].get('content','') if isinstance(jr.get('candidates'), list) else ''
-                if text:
-                    return jsonify({'reply': text.strip()})
+    if not message or not LLM.enabled:
+        return jsonify({'reply': answer_bot(message)})
+    chunks = LLM.stream(message)
+    try:
+        # surface upstream failures before committing to a response
+        first = next(chunks, '')
+    except Exception as e:
+        logging.warning('LLM error: %s', e)
+        METRICS.swallowed('llm')
+        return jsonify({'reply': answer_bot(message)})
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        try:
+            text = (first + ''.join(chunks)).strip()
+        except Exception as e:
+            logging.warning('LLM error: %s', e)
+            METRICS.swallowed('llm')
+            text = ''
+        # fallback to rule-based
+        return jsonify({'reply': text or answer_bot(message)})
+
+    def gen():
+        parts = [first]
+        if first:
+            yield format_sse({'event': 'delta', 'data': {'text': first}})
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield format_sse({'event': 'delta', 'data': {'text': chunk}})
         except Exception as e:
-            print('Gemini error', e)
-    # fallback to rule-based
-    return chat()
+            logging.warning('LLM stream error: %s', e)
+            METRICS.swallowed('llm')
+        reply = ''.join(parts).strip()
+        yield format_sse({'event': 'done', 'data': {'reply': reply or answer_bot(message)}})
+    return Response(stream_with_context(gen()), mimetype='text/event-stream')
+
+METRICS.collectors.append(lambda: [('sse_clients', {}, len(EVENTS.clients)),
+                                     ('image_jobs_running', {}, PROCESS_QUEUE.running_count())])
+METRICS.shared_collectors.append(lambda: [('image_jobs_queued', {}, PROCESS_QUEUE.depth()),
+                                          ('outbox_queued', {}, OUTBOX.stats()['counts'].get('queued', 0))])
+
+if METRICS.enabled:
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(resp):
+        started = g.pop('request_started', None)
+        if started is not None:
+            METRICS.observe('http_request_duration_seconds', time.perf_counter() - started,
+                            endpoint=request.endpoint or 'unmatched', method=request.method,
+                            status=str(resp.status_code))
+        return resp
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint (totals of every worker process)."""
+    if not METRICS.enabled:
+        abort(404)
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Process lifecycle. Importing this module starts no threads and creates no
+# files or directories (SQLiteBacked stores open their databases on first
+# use), so a preloading gunicorn master can import it before forking.
+# Each serving process runs start_services() once (gunicorn.conf.py calls it
+# after fork, otherwise the first request does) and stop_services() on exit.
+# must stay below gunicorn's graceful_timeout (checked in gunicorn.conf.py)
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', '25'))
+# ImageJobEngine.stop() may take this much past its timeout to kill and requeue jobs
+SHUTDOWN_GRACE = 5.0
+STARTUP = {'pid': None, 'import_seconds': None, 'seconds': None, 'steps': {}}
+_LIFECYCLE_LOCK = threading.Lock()
+
+
+def _make_upload_dirs():
+    for folder in (UPLOAD_FOLDER, THUMB_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+
+
+def start_services():
+    """Create upload directories, build static assets and start the image
+    job dispatcher and mail sender for this process. Idempotent."""
+    if STARTUP['pid'] == os.getpid():
+        return
+    with _LIFECYCLE_LOCK:
+        if STARTUP['pid'] == os.getpid():
+            return
+        started = time.perf_counter()
+        steps = {}
+        for name, step in (('upload_dirs', _make_upload_dirs), ('assets', ASSETS.build),
+                           ('image_jobs', PROCESS_QUEUE.start), ('outbox', OUTBOX.start),
+                           ('metrics', METRICS.start)):
+            t = time.perf_counter()
+            try:
+                step()
+            except Exception:
+                # e.g. a read-only build dir: serve the plain static files
+                logging.exception('start-up step %s failed', name)
+                METRICS.swallowed('startup')
+            steps[name] = round(time.perf_counter() - t, 4)
+        STARTUP.update(pid=os.getpid(), steps=steps, seconds=round(time.perf_counter() - started, 4))
+        atexit.unregister(stop_services)
+        atexit.register(stop_services)
+        logging.info('started pid %s: import %.3fs, services %.3fs (%s)', os.getpid(), STARTUP['import_seconds'],
+                     STARTUP['seconds'], ', '.join(f'{k} {v:.3f}s' for k, v in steps.items()))
+
+
+def stop_services(timeout=SHUTDOWN_TIMEOUT):
+    """Stop taking new work and drain what is running (up to `timeout`
+    seconds in all; unfinished image jobs go back to the shared queue)."""
+    if STARTUP['pid'] != os.getpid():
+        return
+    deadline = time.monotonic() + timeout
+    with _LIFECYCLE_LOCK:
+        STARTUP['pid'] = None
+        # image jobs and mail drain at the same time, against one deadline
+        outbox = threading.Thread(target=OUTBOX.stop, args=(timeout,), name='outbox-stop', daemon=True)
+        outbox.start()
+        PROCESS_QUEUE.stop(max(0.0, timeout - SHUTDOWN_GRACE))
+        outbox.join(max(0.0, deadline - time.monotonic()))
+        METRICS.stop()
+
+
+def startup_report():
+    return dict(STARTUP, image_libs=dict(_IMAGE_LIBS))
+
+
+@app.before_request
+def _ensure_services():
+    start_services()
+
+
+@app.cli.command('startup-report')
+def startup_report_command():
+    """Start the services once and print how long each step took."""
+    start_services()
+    click.echo(json.dumps(startup_report(), indent=2))
+    stop_services()
+
+
+STARTUP['import_seconds'] = round(time.perf_counter() - _IMPORT_STARTED, 4)
 
 if __name__ == '__main__':
     app.run(debug=True)
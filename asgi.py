@@ -0,0 +1,172 @@
+"""ASGI entry point: serves /stream (also a tenant's) from asyncio, everything else through Flask.
+
+Under a sync WSGI server every open /stream connection holds a worker (or
+thread) for as long as the browser tab stays open. Here an idle SSE
+connection is just a coroutine waiting on a queue, while all other routes
+keep running unchanged in the Flask app, each request on a thread from a
+pool of WSGI_THREADS per worker (like gunicorn's --threads), so a slow
+/chat-llm call or large download does not hold up other pages.
+
+Run with:
+    uvicorn asgi:app
+    gunicorn -w 2 -k uvicorn.workers.UvicornWorker asgi:app
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import (app as flask_app, EVENTS, SSEClient, SSE_HEARTBEAT, format_sse, start_services, stop_services,
+                 tenant_for)
+
+# threads per worker for the Flask routes
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', '8'))
+# threads are started on demand, so importing this module starts none
+WSGI_EXECUTOR = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    # asgiref's default is thread-sensitive: every request of the process on one shared thread
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False,
+                                 executor=WSGI_EXECUTOR)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that runs requests concurrently on WSGI_EXECUTOR."""
+
+    async def __call__(self, scope, receive, send):
+        # vars(): the constructor arguments WsgiToAsgi keeps differ between asgiref versions
+        await ThreadedWsgiToAsgiInstance(**vars(self))(scope, receive, send)
+
+
+class AsyncSSEClient(SSEClient):
+    """SSEClient whose buffer is an asyncio.Queue fed from the event poller thread."""
+
+    def __init__(self, loop, **kwargs):
+        super().__init__(**kwargs)
+        self.loop = loop
+        self.queue = asyncio.Queue(self.queue.maxsize)
+
+    def offer(self, msg):
+        try:
+            self.loop.call_soon_threadsafe(self._offer, msg)
+        except RuntimeError:
+            # event loop already closed
+            self.closed = True
+
+    def _offer(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.overflow == 'drop':
+            self.queue.get_nowait()
+            self.queue.put_nowait(msg)
+            self.dropped += 1
+        else:
+            self.closed = True
+
+
+def _last_event_id(scope):
+    headers = dict(scope.get('headers') or [])
+    value = headers.get(b'last-event-id', b'').decode('latin-1')
+    if not value:
+        value = (parse_qs(scope.get('query_string', b'').decode('latin-1')).get('lastEventId') or [''])[0]
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def _host(scope):
+    headers = dict(scope.get('headers') or [])
+    host = headers.get(b'host', b'').decode('latin-1')
+    if not host and scope.get('server'):
+        host = scope['server'][0]
+    return host
+
+
+async def not_found(send):
+    await send({'type': 'http.response.start', 'status': 404,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': b'Not Found'})
+
+
+async def stream(scope, receive, send, heartbeat=SSE_HEARTBEAT, tenant=None):
+    client, backlog = EVENTS.subscribe(_last_event_id(scope),
+                                       AsyncSSEClient(asyncio.get_running_loop(), tenant=tenant))
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    async def write(chunk):
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await write(format_sse({'event': 'connected', 'data': {'time': time.time()}}))
+        for msg in backlog:
+            await write(format_sse(msg))
+        while not client.closed and not disconnected.is_set():
+            getter = asyncio.ensure_future(client.queue.get())
+            gone = asyncio.ensure_future(disconnected.wait())
+            done, _ = await asyncio.wait({getter, gone}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+            gone.cancel()
+            if getter in done:
+                await write(format_sse(getter.result()))
+            else:
+                getter.cancel()
+                if not disconnected.is_set():
+                    await write(': ping\n\n')
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        watcher.cancel()
+        EVENTS.unsubscribe(client)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_services()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # draining blocks for up to SHUTDOWN_TIMEOUT; keep the loop responsive
+            await asyncio.get_running_loop().run_in_executor(None, stop_services)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+wsgi = ThreadedWsgiToAsgi(flask_app)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        # the same tenant the Flask /stream route would pick (path prefix or host)
+        tenant, path = tenant_for(scope['path'], _host(scope))
+        if path == '/stream':
+            if tenant is None:
+                await not_found(send)
+            else:
+                await stream(scope, receive, send, tenant=tenant.name)
+            return
+    await wsgi(scope, receive, send)
@@ -0,0 +1,28 @@
+"""Shared reporting for the pytest benchmark suites in this directory.
+
+Run them explicitly (they are not part of tests/):
+
+    python -m pytest benchmarks -q -s
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+RESULTS = {}
+
+
+def record(table, row):
+    RESULTS.setdefault(table, []).append(row)
+
+
+def pytest_terminal_summary(terminalreporter):
+    for table, rows in RESULTS.items():
+        columns = list(rows[0])
+        widths = [max(len(str(c)), *(len(str(r.get(c, ''))) for r in rows)) for c in columns]
+        terminalreporter.section(table)
+        terminalreporter.write_line('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+        for r in rows:
+            terminalreporter.write_line('  '.join(str(r.get(c, '')).ljust(w) for c, w in zip(columns, widths)))
@@ -0,0 +1,450 @@
+"""Route latency, throughput and memory across data.json sizes.
+
+Drives the public pages, /chat, /chat-llm (against a local stub upstream),
+/api/data GET/PUT, /contact (against a local SMTP sink) and /stream
+fan-out, first in-process through the Flask test client and then over
+HTTP against a local gunicorn server, with synthetic data.json files of
+increasing size. Everything runs offline.
+
+    python benchmarks/routes.py --sizes 10 100 1000 10000 --json before.json
+    python benchmarks/routes.py --json after.json --compare before.json
+
+Rows are keyed by (driver, size, scenario) so two JSON files can be
+diffed between commits. The server driver needs gunicorn; /contact needs
+aiosmtpd (pip install -r benchmarks/requirements.txt) and is skipped
+without it.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN = {'username': 'Nani@2821', 'password': 'Nani@2821'}
+PAGES = ('/', '/projects', '/events', '/resume')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_data(n):
+    """A profile document with `n` projects, snaps, events and certificates."""
+    def items(kind):
+        return [{'name': f'{kind}-{i}.jpg', 'url': f'/static/uploads/{kind}-{i}.jpg',
+                 'thumb': f'/static/uploads/thumbs/{kind}-{i}.jpg', 'description': f'{kind} number {i}'}
+                for i in range(n)]
+    return {
+        'name': 'Bench Mark', 'email': 'owner@example.com', 'phone': '+1 555 0100', 'location': 'Localhost',
+        'linkedin': 'https://example.com/in/bench', 'objective': 'Measure everything.', 'education': 'B.Sc.',
+        'skills': [f'skill-{i}' for i in range(min(n, 50))], 'achievements': ['Ran the benchmarks'],
+        'projects': [{'title': f'Project {i}', 'description': f'Synthetic project number {i} ' * 3,
+                      'languages': 'Python, HTML', 'github': f'https://example.com/p/{i}', 'images': [],
+                      'lottie': ''} for i in range(n)],
+        'snaps': items('snap'), 'events': items('event'), 'certificates': items('cert'),
+        'resume': {'name': 'resume.pdf', 'url': '/static/uploads/resume.pdf'}, 'ui_mode': 'glam',
+    }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, elapsed, errors):
+    ms = sorted(x * 1000 for x in latencies)
+    return {'requests': len(ms), 'errors': errors,
+            'p50_ms': round(percentile(ms, 50), 3) if ms else None,
+            'p95_ms': round(percentile(ms, 95), 3) if ms else None,
+            'p99_ms': round(percentile(ms, 99), 3) if ms else None,
+            'rps': round(len(ms) / elapsed, 1) if elapsed else None}
+
+
+class LLMStub(BaseHTTPRequestHandler):
+    """Answers like the generative API, after `delay` seconds."""
+    delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.delay)
+        body = json.dumps({'candidates': [{'content': 'A stub reply about the profile.'}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_llm_stub(delay):
+    LLMStub.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), LLMStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SMTPSink:
+    def __init__(self):
+        self.count = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.count += 1
+        return '250 OK'
+
+
+def start_smtp_sink():
+    try:
+        from aiosmtpd.controller import Controller
+        from aiosmtpd.smtp import AuthResult
+    except ImportError:
+        return None, None
+    logging.getLogger('mail.log').setLevel(logging.ERROR)
+    sink = SMTPSink()
+    port = free_port()
+    controller = Controller(sink, hostname='127.0.0.1', port=port, auth_require_tls=False,
+                            authenticator=lambda *a: AuthResult(success=True))
+    controller.start()
+    controller.sink = sink
+    return controller, port
+
+
+class InProcessDriver:
+    """Flask test client; swaps the profile store for each data size."""
+    name = 'client'
+
+    def __init__(self, app_module):
+        self.portfolio = app_module
+
+    def load(self, data_path):
+        p = self.portfolio
+        p.PROFILE_STORE = p.ProfileStore(data_path, p.PROFILE)
+        p.PROFILE_STORE.listeners.append(p.PAGES.clear)
+        p.PAGES.clear()
+
+    def session(self, admin=False):
+        client = self.portfolio.app.test_client()
+        if admin:
+            client.post('/admin/login', data=ADMIN)
+
+        def request(method, path, **kwargs):
+            r = client.open(path, method=method, **kwargs)
+            return r.status_code, len(r.get_data())
+        return request
+
+    def open_stream(self):
+        r = self.portfolio.app.test_client().get('/stream', buffered=False)
+        return (chunk.decode() for chunk in r.response), r.close
+
+    def memory(self):
+        with open('/proc/self/status') as f:
+            return {'rss_mb': round(_rss_kb(f.read()) / 1024, 1)}
+
+
+def _rss_kb(status):
+    for line in status.splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+    return 0
+
+
+class ServerDriver:
+    """gunicorn on a local port; restarted for each data size."""
+    name = 'server'
+
+    def __init__(self, env, workers, worker_class, threads):
+        self.env = env
+        self.workers = workers
+        self.worker_class = worker_class
+        self.threads = threads
+        self.proc = None
+        self.port = None
+
+    def load(self, data_path):
+        self.stop()
+        self.port = free_port()
+        cmd = ['gunicorn', '-w', str(self.workers), '-k', self.worker_class, '--threads', str(self.threads),
+               '-b', f'127.0.0.1:{self.port}', 'app:app']
+        env = dict(os.environ, **self.env, DATA_PATH=data_path)
+        self.proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        import requests
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                requests.get(f'http://127.0.0.1:{self.port}/welcome', timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        raise RuntimeError('server did not start')
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc = None
+
+    def session(self, admin=False):
+        import requests
+        s = requests.Session()
+        base = f'http://127.0.0.1:{self.port}'
+        if admin:
+            s.post(base + '/admin/login', data=ADMIN, allow_redirects=False)
+
+        def request(method, path, **kwargs):
+            r = s.request(method, base + path, **kwargs)
+            return r.status_code, len(r.content)
+        return request
+
+    def open_stream(self):
+        import requests
+        r = requests.get(f'http://127.0.0.1:{self.port}/stream', stream=True, timeout=30)
+        return r.iter_content(chunk_size=None, decode_unicode=True), r.close
+
+    def memory(self):
+        # master plus workers
+        pids = [self.proc.pid]
+        try:
+            with open(f'/proc/{self.proc.pid}/task/{self.proc.pid}/children') as f:
+                pids += [int(p) for p in f.read().split()]
+        except OSError:
+            pass
+        total = 0
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    total += _rss_kb(f.read())
+            except OSError:
+                pass
+        return {'rss_mb': round(total / 1024, 1)}
+
+
+def run_requests(driver, method, path, count, concurrency, admin=False, **kwargs):
+    """Issue `count` requests from `concurrency` threads; returns a summary row."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    per_thread = [count // concurrency + (1 if i < count % concurrency else 0) for i in range(concurrency)]
+    sessions = [driver.session(admin) for _ in range(concurrency)]
+    # the first request renders pages into the page cache; it is reported
+    # separately as first_ms, later requests measure the steady state
+    start = time.perf_counter()
+    sessions[0](method, path, **kwargs)
+    first = time.perf_counter() - start
+    for request in sessions[1:]:
+        request(method, path, **kwargs)
+
+    def worker(request, n):
+        local, failed = [], 0
+        for _ in range(n):
+            start = time.perf_counter()
+            status, _ = request(method, path, **kwargs)
+            local.append(time.perf_counter() - start)
+            failed += status >= 400
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(s, n)) for s, n in zip(sessions, per_thread)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    row = summarize(latencies, time.perf_counter() - start, errors[0])
+    row['first_ms'] = round(first * 1000, 3)
+    return row
+
+
+def run_stream_fanout(driver, subscribers, rounds):
+    """Open `subscribers` /stream connections, publish `rounds` events (by
+    saving ui_mode through /api/data) and time delivery to every client."""
+    received = []
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1, timeout=30)
+    sent = {}
+
+    def reader():
+        # a stream is opened, read and closed in one thread (the in-process
+        # response holds a request context)
+        chunks, close = driver.open_stream()
+        buf, connected = '', False
+        try:
+            for chunk in chunks:
+                buf += chunk
+                if not connected and 'event: connected' in buf:
+                    connected = True
+                    ready.wait()
+                while '\n\n' in buf:
+                    frame, buf = buf.split('\n\n', 1)
+                    if 'event: ui_mode' in frame:
+                        mode = json.loads(frame.split('data: ', 1)[1])['mode']
+                        with lock:
+                            received.append(time.perf_counter() - sent[mode])
+                        if mode == f'bench-{rounds - 1}':
+                            return
+        finally:
+            close()
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(subscribers)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    request = driver.session(admin=True)
+    status, _ = request('GET', '/api/data')
+    start = time.perf_counter()
+    for i in range(rounds):
+        mode = f'bench-{i}'
+        sent[mode] = time.perf_counter()
+        request('PATCH', '/api/data', json={'ui_mode': mode}, headers={'Content-Type': 'application/merge-patch+json'})
+        time.sleep(0.05)
+    for t in threads:
+        t.join(10)
+    elapsed = time.perf_counter() - start
+    row = summarize(received, elapsed, subscribers * rounds - len(received))
+    row['rps'] = round(len(received) / elapsed, 1)
+    return row
+
+
+def scenarios(args, llm_enabled, smtp):
+    for path in PAGES:
+        yield f'GET {path}', dict(method='GET', path=path)
+    yield 'POST /chat', dict(method='POST', path='/chat', json={'message': 'Which projects have you built?'})
+    if llm_enabled:
+        # a different question each time would only measure the stub; repeats hit the reply cache
+        yield 'POST /chat-llm', dict(method='POST', path='/chat-llm', json={'message': 'Tell me about your projects'})
+    yield 'GET /api/data', dict(method='GET', path='/api/data', admin=True)
+    if smtp:
+        yield 'POST /contact', dict(method='POST', path='/contact',
+                                    data={'from_name': 'Bench', 'from_email': 'bench@example.com',
+                                          'message': 'Hello from the benchmark'})
+
+
+def bench_size(driver, size, args, data_path, llm_enabled, smtp):
+    rows = []
+    with open(data_path, 'w', encoding='utf-8') as f:
+        json.dump(make_data(size), f)
+    driver.load(data_path)
+    for name, spec in scenarios(args, llm_enabled, smtp):
+        spec = dict(spec)
+        method, path = spec.pop('method'), spec.pop('path')
+        row = run_requests(driver, method, path, args.requests, args.concurrency, **spec)
+        if driver.name == 'client':
+            # separate, untimed pass: tracing allocations slows requests down severalfold
+            tracemalloc.start()
+            run_requests(driver, method, path, args.concurrency, args.concurrency, **spec)
+            row['py_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+            tracemalloc.stop()
+        rows.append(dict({'driver': driver.name, 'size': size, 'scenario': name}, **row, **driver.memory()))
+    # PUT writes the whole document back: fewer rounds for large files
+    with open(data_path, encoding='utf-8') as f:
+        doc = json.load(f)
+    row = run_requests(driver, 'PUT', '/api/data', max(5, args.requests // 10), 1, admin=True, json=doc)
+    rows.append(dict({'driver': driver.name, 'size': size, 'scenario': 'PUT /api/data'}, **row, **driver.memory()))
+    row = run_stream_fanout(driver, args.subscribers, args.rounds)
+    rows.append(dict({'driver': driver.name, 'size': size, 'scenario': f'/stream x{args.subscribers}'},
+                     **row, **driver.memory()))
+    return rows
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path) as f:
+        base = {(r['driver'], r['size'], r['scenario']): r for r in json.load(f)['results']}
+    print(f"\n{'driver':7} {'size':>6} {'scenario':22} {'first ms':>24} {'p50 ms':>24} {'p95 ms':>24}")
+    for r in rows:
+        b = base.get((r['driver'], r['size'], r['scenario']))
+        if not b:
+            continue
+        cells = []
+        for key in ('first_ms', 'p50_ms', 'p95_ms'):
+            old, new = b.get(key), r.get(key)
+            change = f'{(new - old) / old * 100:+.0f}%' if old and new is not None else ''
+            cells.append(f'{old} -> {new} {change}'.rjust(24))
+        print(f"{r['driver']:7} {r['size']:>6} {r['scenario']:22} {' '.join(cells)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000])
+    parser.add_argument('--drivers', nargs='+', default=['client', 'server'], choices=['client', 'server'])
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers for the server driver')
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--subscribers', type=int, default=20, help='/stream connections for the fan-out test')
+    parser.add_argument('--rounds', type=int, default=10, help='events published in the fan-out test')
+    parser.add_argument('--llm-delay', type=float, default=0.05, help='seconds the stub upstream takes')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        llm = start_llm_stub(args.llm_delay)
+        smtp, smtp_port = start_smtp_sink()
+        env = {
+            'EVENTS_DB_PATH': os.path.join(tmp, 'events.sqlite3'), 'JOBS_DB_PATH': os.path.join(tmp, 'jobs.sqlite3'),
+            'OUTBOX_DB_PATH': os.path.join(tmp, 'outbox.sqlite3'), 'OCR_CACHE_PATH': os.path.join(tmp, 'ocr.sqlite3'),
+            'GEMINI_API_KEY': 'bench', 'GEMINI_API_URL': f'http://127.0.0.1:{llm.server_port}/generate',
+            'SMTP_HOST': '127.0.0.1', 'SMTP_PORT': str(smtp_port or 1), 'SMTP_STARTTLS': '0',
+            'EMAIL_PASSWORD': 'bench', 'IMAGE_WORKERS': '1',
+        }
+        data_path = os.path.join(tmp, 'data.json')
+        try:
+            for name in args.drivers:
+                if name == 'client':
+                    os.environ.update(env, DATA_PATH=data_path)
+                    import app
+                    driver = InProcessDriver(app)
+                else:
+                    # every open /stream holds a thread: room for all of them in one worker
+                    driver = ServerDriver(env, args.workers, args.worker_class,
+                                          threads=args.subscribers + args.concurrency + 2)
+                try:
+                    for size in args.sizes:
+                        for row in bench_size(driver, size, args, data_path, True, smtp is not None):
+                            rows.append(row)
+                            print(json.dumps(row), flush=True)
+                finally:
+                    if name == 'server':
+                        driver.stop()
+                    else:
+                        app.stop_services(timeout=5)
+            delivered = smtp.sink.count if smtp else None
+        finally:
+            llm.shutdown()
+            if smtp:
+                smtp.stop()
+    meta = {'python': sys.version.split()[0], 'requests': args.requests, 'concurrency': args.concurrency,
+            'workers': args.workers, 'worker_class': args.worker_class, 'mails_delivered': delivered}
+    try:
+        meta['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                        text=True).stdout.strip() or None
+    except OSError:
+        meta['commit'] = None
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'results': rows}, f, indent=2)
+    if args.compare:
+        compare(rows, args.compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Concurrent /stream capacity: sync WSGI workers vs the ASGI entry point.
+
+Starts the app under each server, opens N idle SSE connections and then
+times an ordinary page request (/) while they are held open. With sync
+workers every open stream pins a worker, so past `workers` connections new
+streams are not accepted and the page request times out.
+
+It then times the same page while --slow /chat-llm requests (against a
+local stub upstream that takes --slow-delay seconds) are in flight: a
+server that runs Flask requests on one thread per worker serves the page
+only after them.
+
+    python benchmarks/sse_capacity.py --connections 1 2 8 64 512 --json out.json
+
+Needs gunicorn and uvicorn (pip install gunicorn uvicorn asgiref).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from routes import start_llm_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = {
+    'wsgi': ['gunicorn', '-w', '{workers}', '-b', '127.0.0.1:{port}', 'app:app'],
+    'asgi': ['gunicorn', '-w', '{workers}', '-k', 'uvicorn.workers.UvicornWorker',
+             '-b', '127.0.0.1:{port}', 'asgi:app'],
+}
+
+
+def start_server(mode, port, workers, tmp, llm_port):
+    cmd = [a.format(port=port, workers=workers) for a in SERVERS[mode]]
+    env = dict(os.environ, EVENTS_DB_PATH=os.path.join(tmp, 'events.sqlite3'),
+               JOBS_DB_PATH=os.path.join(tmp, 'jobs.sqlite3'),
+               GEMINI_API_KEY='bench', GEMINI_API_URL=f'http://127.0.0.1:{llm_port}/generate')
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/welcome', timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def open_stream(port, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    writer.write(b'GET /stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n')
+    await writer.drain()
+    buf = b''
+    while b'event: connected' not in buf:
+        chunk = await asyncio.wait_for(reader.read(4096), timeout)
+        if not chunk:
+            raise ConnectionError('stream closed')
+        buf += chunk
+    return writer
+
+
+async def timed_get(port, path, timeout):
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status = (await asyncio.wait_for(reader.readline(), timeout)).split()[1].decode()
+    await asyncio.wait_for(reader.read(), timeout)
+    writer.close()
+    return status, (time.perf_counter() - start) * 1000
+
+
+async def slow_post(port, n, timeout):
+    # a different question each time: the reply cache and request coalescing would answer repeats at once
+    body = json.dumps({'message': f'bench question {n} {time.time()}'}).encode()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    writer.write(b'POST /chat-llm HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+                 b'Content-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+    await writer.drain()
+    await asyncio.wait_for(reader.read(), timeout)
+    writer.close()
+
+
+async def measure_slow(port, n, delay, timeout):
+    slow = [asyncio.ensure_future(slow_post(port, i, timeout)) for i in range(n)]
+    # let them reach the upstream call before timing the page
+    await asyncio.sleep(min(delay / 4, 0.5))
+    try:
+        status, ms = await timed_get(port, '/', timeout)
+        page = {'status': status, 'ms': round(ms, 1)}
+    except (asyncio.TimeoutError, OSError) as e:
+        page = {'status': None, 'error': type(e).__name__}
+    await asyncio.gather(*slow, return_exceptions=True)
+    return {'slow_requests': n, 'slow_delay_s': delay, 'page': page}
+
+
+async def measure(port, n, timeout):
+    opened = await asyncio.gather(*(open_stream(port, timeout) for _ in range(n)), return_exceptions=True)
+    writers = [w for w in opened if not isinstance(w, BaseException)]
+    try:
+        status, ms = await timed_get(port, '/', timeout)
+        page = {'status': status, 'ms': round(ms, 1)}
+    except (asyncio.TimeoutError, OSError) as e:
+        page = {'status': None, 'error': type(e).__name__}
+    for w in writers:
+        w.close()
+    await asyncio.sleep(0.5)
+    return {'connections': n, 'established': len(writers), 'page': page}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['wsgi', 'asgi'], choices=sorted(SERVERS))
+    parser.add_argument('--connections', nargs='+', type=int, default=[1, 2, 8, 64, 512])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--slow', type=int, default=4, help='/chat-llm requests in flight while timing the page')
+    parser.add_argument('--slow-delay', type=float, default=2.0, help='seconds the stub upstream takes')
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    slow = {}
+    llm = start_llm_stub(args.slow_delay)
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            proc = start_server(mode, args.port, args.workers, tmp, llm.server_port)
+            try:
+                results[mode] = [asyncio.run(measure(args.port, n, args.timeout)) for n in args.connections]
+                if args.slow:
+                    slow[mode] = asyncio.run(measure_slow(args.port, args.slow, args.slow_delay,
+                                                          args.timeout + args.slow_delay))
+            finally:
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    # sync workers stuck in a stream ignore graceful shutdown
+                    proc.kill()
+                    proc.wait()
+    for mode, rows in results.items():
+        for r in rows:
+            page = f"{r['page']['ms']} ms" if r['page']['status'] else r['page']['error']
+            print(f"{mode:5} streams={r['connections']:5} established={r['established']:5} page /: {page}")
+    for mode, r in slow.items():
+        page = f"{r['page']['ms']} ms" if r['page']['status'] else r['page']['error']
+        print(f"{mode:5} slow /chat-llm={r['slow_requests']} x {r['slow_delay_s']:g}s page /: {page}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'workers': args.workers, 'results': results, 'slow': slow}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Per-stage timings and peak memory of advanced_enhance().
+
+Every sample image in static/uploads (plus a synthetic 12 MP phone photo)
+is copied to a temp dir and processed in a forked child, so the peak RSS
+reported is that of the pipeline alone:
+
+    python -m pytest benchmarks/test_enhance_pipeline.py -q -s
+    BENCH_IMAGES=5 python -m pytest benchmarks/test_enhance_pipeline.py -s   # first 5 samples only
+"""
+import glob
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+
+import pytest
+
+from conftest import ROOT, record
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import app  # noqa: E402
+
+SAMPLES = sorted(p for p in glob.glob(os.path.join(ROOT, 'static', 'uploads', '*'))
+                 if os.path.splitext(p)[1].lower() in ('.jpg', '.jpeg', '.png'))
+if os.environ.get('BENCH_IMAGES'):
+    SAMPLES = SAMPLES[:int(os.environ['BENCH_IMAGES'])]
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reset_peak_rss():
+    # Linux >= 4.0: restart the high-water mark from the current RSS
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _child(path, conn):
+    _reset_peak_rss()
+    base = _peak_rss_mb()
+    timings = {}
+    start = time.perf_counter()
+    app.advanced_enhance(path, timings=timings)
+    conn.send({'total': time.perf_counter() - start, 'stages': timings,
+               'peak_mb': _peak_rss_mb(), 'base_mb': base})
+    conn.close()
+
+
+def _run(path):
+    ctx = multiprocessing.get_context('fork')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(path, child))
+    proc.start()
+    child.close()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+@pytest.fixture(scope='module')
+def phone_photo(tmp_path_factory):
+    # 4000x3000 with sensor-like noise and some text
+    rng = np.random.default_rng(0)
+    img = np.full((3000, 4000, 3), 200, np.uint8)
+    cv2.putText(img, 'CERTIFICATE OF COMPLETION', (300, 1500), cv2.FONT_HERSHEY_SIMPLEX, 6, (30, 30, 30), 12)
+    img = cv2.add(img, rng.integers(0, 25, img.shape, dtype=np.uint8))
+    path = str(tmp_path_factory.mktemp('photo') / 'phone.jpg')
+    cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return path
+
+
+def _bench(source, tmp_path, label):
+    path = str(tmp_path / os.path.basename(source))
+    shutil.copyfile(source, path)
+    with app.Image.open(path) as im:
+        size = '%dx%d' % im.size
+    r = _run(path)
+    out = cv2.imread(path)
+    assert out is not None
+    assert max(out.shape[:2]) <= 2000
+    row = {'image': label, 'input': size, 'output': '%dx%d' % (out.shape[1], out.shape[0]),
+           'total_s': '%.2f' % r['total']}
+    row.update({k + '_s': '%.3f' % r['stages'].get(k, 0.0)
+                for k in ('decode', 'analyse', 'ocr', 'transform', 'denoise', 'encode')})
+    row.update(peak_mb='%.0f' % r['peak_mb'], delta_mb='%.0f' % (r['peak_mb'] - r['base_mb']))
+    record('advanced_enhance', row)
+    return r
+
+
+def test_phone_photo(phone_photo, tmp_path):
+    _bench(phone_photo, tmp_path, 'synthetic 12 MP photo')
+
+
+@pytest.mark.parametrize('source', SAMPLES, ids=[os.path.basename(p) for p in SAMPLES])
+def test_sample(source, tmp_path):
+    _bench(source, tmp_path, os.path.basename(source)[:40])
@@ -0,0 +1,27 @@
+"""gunicorn settings (read automatically from the working directory).
+
+The app module starts no threads when imported, so it can be loaded once
+in the master with GUNICORN_PRELOAD=1 and shared copy-on-write by the
+workers. Each worker starts its background services right after the fork
+and drains them when it exits.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+# leave room for stop_services() to drain running jobs
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+# stop_services() budget (read like app.SHUTDOWN_TIMEOUT, without importing the app)
+shutdown_timeout = float(os.environ.get('SHUTDOWN_TIMEOUT', '25'))
+if shutdown_timeout >= graceful_timeout:
+    raise ValueError(f'SHUTDOWN_TIMEOUT ({shutdown_timeout:g}s) must be below the graceful timeout '
+                     f'({graceful_timeout}s), or workers are killed while draining')
+
+
+def post_fork(server, worker):
+    from app import start_services
+    start_services()
+
+
+def worker_exit(server, worker):
+    from app import stop_services
+    stop_services()
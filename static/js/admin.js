@@ -1,3 +1,5 @@
+// app routes are under the tenant's path prefix in multi-tenant path mode
+var APP_ROOT = document.documentElement.dataset.root || '';
 const loadBtn = document.getElementById('load');
 const saveBtn = document.getElementById('save');
 const resetBtn = document.getElementById('reset');
@@ -41,6 +43,53 @@ function debounce(fn, wait){
   }
 }
 
+// last document confirmed by the server and its ETag; edits are sent as a
+// JSON Patch against this baseline instead of PUTting the whole document
+let baseline = {};
+let etag = null;
+
+function clone(obj){ return JSON.parse(JSON.stringify(obj || {})); }
+
+function escapePointer(key){ return String(key).replace(/~/g,'~0').replace(/\//g,'~1'); }
+
+// minimal RFC 6902 diff: recurse into objects and arrays (appends/truncations
+// at the end become add/remove ops), replace everything else
+function jsonDiff(a, b, path = '', ops = []){
+  if(a === b) return ops;
+  const bothObjects = a && b && typeof a === 'object' && typeof b === 'object' && Array.isArray(a) === Array.isArray(b);
+  if(!bothObjects){
+    if(JSON.stringify(a) !== JSON.stringify(b)) ops.push({op: 'replace', path, value: b});
+    return ops;
+  }
+  if(Array.isArray(a)){
+    const common = Math.min(a.length, b.length);
+    const changed = [];
+    for(let i = 0; i < common; i++) jsonDiff(a[i], b[i], path + '/' + i, changed);
+    // reorders/removals in the middle touch every element: one replace is smaller
+    if(changed.length > common / 2 + 1){ ops.push({op: 'replace', path, value: b}); return ops; }
+    ops.push(...changed);
+    for(let i = common; i < b.length; i++) ops.push({op: 'add', path: path + '/-', value: b[i]});
+    for(let i = a.length - 1; i >= common; i--) ops.push({op: 'remove', path: path + '/' + i});
+    return ops;
+  }
+  Object.keys(a).forEach(k=>{ if(!(k in b)) ops.push({op: 'remove', path: path + '/' + escapePointer(k)}); });
+  Object.keys(b).forEach(k=>{
+    const p = path + '/' + escapePointer(k);
+    if(!(k in a)) ops.push({op: 'add', path: p, value: b[k]});
+    else jsonDiff(a[k], b[k], p, ops);
+  });
+  return ops;
+}
+
+// fetch the server copy and reset the patch baseline
+async function fetchData(){
+  const res = await fetch(APP_ROOT + '/api/data');
+  current = await res.json();
+  baseline = clone(current);
+  etag = res.headers.get('ETag');
+  return current;
+}
+
 // central save helper used for manual save or autosave
 async function saveData(showToastOnSuccess = true){
   try{
@@ -49,8 +98,21 @@ async function saveData(showToastOnSuccess = true){
     current.email = document.getElementById('email').value;
     current.phone = document.getElementById('phone').value;
     current.location = document.getElementById('location').value;
-    const res = await fetch('/api/data',{method:'PUT',headers:{'Content-Type':'application/json'},body:JSON.stringify(current)});
-    if(!res.ok) throw new Error('Save failed');
+    const ops = jsonDiff(baseline, current);
+    if(ops.length){
+      const headers = {'Content-Type':'application/json-patch+json'};
+      if(etag) headers['If-Match'] = etag;
+      const res = await fetch(APP_ROOT + '/api/data',{method:'PATCH',headers,body:JSON.stringify(ops)});
+      if(res.status === 412){
+        // someone else saved in the meantime: reload their version
+        await fetchData(); render();
+        showToast('Data changed elsewhere — reloaded, please re-apply your edit', 'error');
+        return false;
+      }
+      if(!res.ok) throw new Error('Save failed');
+      etag = res.headers.get('ETag') || etag;
+      baseline = clone(current);
+    }
     if(showToastOnSuccess) showToast('Details updated', 'success');
     // update admin status indicator if present
     try{ const st = document.getElementById('admin-status'); if(st){ st.textContent = 'Saved'; st.style.color = ''; setTimeout(()=>{ st.textContent = '\u00A0'; }, 2400); } }catch(e){}
@@ -165,8 +227,7 @@ async function render(){
 }
 
 loadBtn.addEventListener('click', async ()=>{
-  const res = await fetch('/api/data');
-  current = await res.json();
+  await fetchData();
   render();
 })
 
@@ -178,10 +239,9 @@ saveBtn.addEventListener('click', async ()=>{
 
 resetBtn.addEventListener('click', async ()=>{
   if(!confirm('Reset data to default?')) return;
-  await fetch('/api/data',{method:'DELETE'});
+  await fetch(APP_ROOT + '/api/data',{method:'DELETE'});
   showToast('Reset done', 'success');
-  const res = await fetch('/api/data');
-  current = await res.json();
+  await fetchData();
   render();
 })
 
@@ -228,23 +288,35 @@ document.getElementById('add-snap').addEventListener('click', ()=>{
     current.snaps.push({name: v, description: desc}); document.getElementById('snap-input').value=''; render(); autosave();
   })();
 })
+// an upload that looks like a stored image is not enhanced unless the admin asks for it
+async function offerEnhance(j, kind){
+  const near = j.near_duplicates || [];
+  if(!near.length) return;
+  const names = near.map(d=> d.name || d.url.split('/').pop()).join(', ');
+  if(!confirm(`This looks like a near-duplicate of ${names}. Enhance it anyway?`)) return;
+  await fetch(APP_ROOT + '/api/jobs',{method:'POST',headers:{'Content-Type':'application/json'},
+    body:JSON.stringify({url: j.url, kind, name: j.name, priority: 'upload'})});
+  loadJobs();
+}
+
 // file upload handlers
 document.getElementById('upload-cert').addEventListener('click', async ()=>{
   const f = document.getElementById('cert-file').files[0];
   if(!f) return showToast('Choose a file', 'error');
   const fd = new FormData(); fd.append('file', f); fd.append('kind','cert');
   let res;
-  try{ res = await fetch('/api/upload',{method:'POST',body:fd}); }catch(e){ showToast('Network error', 'error'); return }
-  if(res.status === 401){ showToast('Unauthorized — please login', 'error'); window.location.href = '/admin/login'; return }
+  try{ res = await fetch(APP_ROOT + '/api/upload',{method:'POST',body:fd}); }catch(e){ showToast('Network error', 'error'); return }
+  if(res.status === 401){ showToast('Unauthorized — please login', 'error'); window.location.href = APP_ROOT + '/admin/login'; return }
   let j;
   try{ j = await res.json(); }catch(e){ showToast('Server error', 'error'); return }
   if(j.ok){
+    await offerEnhance(j, 'cert');
     // ask for description via modal and persist it
     const desc = await showDescriptionModal('Description for this certificate (optional)');
     // refresh server-side data (server already appended the new entry)
-    const r = await fetch('/api/data'); current = await r.json();
+    await fetchData();
     const cert = (current.certificates||[]).find(c=> c.url === j.url || c.name === j.url || c.name === j.name);
-    if(cert && desc){ cert.description = desc; await fetch('/api/data',{method:'PUT',headers:{'Content-Type':'application/json'},body:JSON.stringify(current)}); }
+    if(cert && desc){ cert.description = desc; await saveData(false); }
     showToast('Uploaded', 'success');
     render();
     autosave();
@@ -256,15 +328,16 @@ document.getElementById('upload-snap').addEventListener('click', async ()=>{
   if(!f) return showToast('Choose a file', 'error');
   const fd = new FormData(); fd.append('file', f); fd.append('kind','snap');
   let res;
-  try{ res = await fetch('/api/upload',{method:'POST',body:fd}); }catch(e){ showToast('Network error', 'error'); return }
-  if(res.status === 401){ showToast('Unauthorized — please login', 'error'); window.location.href = '/admin/login'; return }
+  try{ res = await fetch(APP_ROOT + '/api/upload',{method:'POST',body:fd}); }catch(e){ showToast('Network error', 'error'); return }
+  if(res.status === 401){ showToast('Unauthorized — please login', 'error'); window.location.href = APP_ROOT + '/admin/login'; return }
   let j;
   try{ j = await res.json(); }catch(e){ showToast('Server error', 'error'); return }
   if(j.ok){
+    await offerEnhance(j, 'snap');
     const desc = await showDescriptionModal('Description for this snap (optional)');
-    const r = await fetch('/api/data'); current = await r.json();
+    await fetchData();
     const snap = (current.snaps||[]).find(s=> s.url === j.url || s.name === j.name);
-    if(snap && desc){ snap.description = desc; await fetch('/api/data',{method:'PUT',headers:{'Content-Type':'application/json'},body:JSON.stringify(current)}); }
+    if(snap && desc){ snap.description = desc; await saveData(false); }
     showToast('Uploaded', 'success');
     render();
     autosave();
@@ -296,14 +369,14 @@ document.getElementById('upload-profile').addEventListener('click', async ()=>{
   if(!f) return showToast('Choose a file', 'error');
   const fd = new FormData(); fd.append('file', f); fd.append('kind','profile');
   let res;
-  try{ res = await fetch('/api/upload',{method:'POST',body:fd}); }catch(e){ showToast('Network error', 'error'); return }
-  if(res.status === 401){ showToast('Unauthorized — please login', 'error'); window.location.href = '/admin/login'; return }
+  try{ res = await fetch(APP_ROOT + '/api/upload',{method:'POST',body:fd}); }catch(e){ showToast('Network error', 'error'); return }
+  if(res.status === 401){ showToast('Unauthorized — please login', 'error'); window.location.href = APP_ROOT + '/admin/login'; return }
   let j;
   try{ j = await res.json(); }catch(e){ showToast('Server error', 'error'); return }
   if(j.ok){
     showToast('Uploaded', 'success');
     // refresh server copy and update preview
-    const r = await fetch('/api/data'); current = await r.json();
+    await fetchData();
     document.getElementById('profile-preview').src = current.profile && current.profile.picture_thumb ? current.profile.picture_thumb : (j.thumb || j.url);
     render();
     autosave();
@@ -325,13 +398,14 @@ if(uploadEventBtn){
     const f = document.getElementById('event-file').files[0];
     if(!f) return showToast('Choose a file', 'error');
     const fd = new FormData(); fd.append('file', f); fd.append('kind','event');
-    const res = await fetch('/api/upload',{method:'POST',body:fd});
+    const res = await fetch(APP_ROOT + '/api/upload',{method:'POST',body:fd});
     const j = await res.json();
     if(j.ok){
+      await offerEnhance(j, 'event');
       const desc = await showDescriptionModal('Description for this event (optional)');
-      const r = await fetch('/api/data'); current = await r.json();
+      await fetchData();
       const ev = (current.events||[]).find(e=> e.url === j.url || e.name === j.name);
-      if(ev && desc){ ev.description = desc; await fetch('/api/data',{method:'PUT',headers:{'Content-Type':'application/json'},body:JSON.stringify(current)}); }
+      if(ev && desc){ ev.description = desc; await saveData(false); }
       showToast('Event uploaded', 'success'); render(); autosave();
     }else showToast('Upload error', 'error')
   })
@@ -343,12 +417,13 @@ document.getElementById('upload-project').addEventListener('click', async ()=>{
   if(!files.length) return showToast('Choose files', 'error');
   for(const f of files){
     const fd = new FormData(); fd.append('file', f); fd.append('kind','project');
-    const res = await fetch('/api/upload',{method:'POST',body:fd});
+    const res = await fetch(APP_ROOT + '/api/upload',{method:'POST',body:fd});
     const j = await res.json();
     if(!j.ok){ showToast('Upload error', 'error'); return; }
+    await offerEnhance(j, 'project');
   }
   // refresh data
-  const r = await fetch('/api/data'); current = await r.json();
+  await fetchData();
   showToast('Project images uploaded', 'success'); render(); autosave();
 })
 
@@ -359,11 +434,11 @@ if(uploadResumeBtn){
     const f = document.getElementById('resume-file').files[0];
     if(!f) return showToast('Choose a resume file', 'error');
     const fd = new FormData(); fd.append('file', f); fd.append('kind','resume');
-    const res = await fetch('/api/upload',{method:'POST',body:fd});
+    const res = await fetch(APP_ROOT + '/api/upload',{method:'POST',body:fd});
     const j = await res.json();
     if(j.ok){
       // refresh data
-      const r = await fetch('/api/data'); current = await r.json();
+      await fetchData();
       showToast('Resume uploaded', 'success'); render(); autosave();
     }else showToast('Upload error', 'error')
   })
@@ -399,6 +474,55 @@ function showDescriptionModal(title){
   });
 }
 
+// background image jobs (queued/running/done/failed), newest finished last
+async function loadJobs(){
+  const list = document.getElementById('jobs-list');
+  if(!list) return;
+  let j;
+  try{ const res = await fetch(APP_ROOT + '/api/jobs'); if(!res.ok) return; j = await res.json(); }catch(e){ return }
+  document.getElementById('jobs-summary').textContent = `${j.queued} queued · ${j.workers} worker(s) per process`;
+  list.innerHTML = '';
+  (j.jobs || []).slice(0, 20).forEach(job=>{
+    const div = document.createElement('div');
+    div.className = 'list-item';
+    const label = document.createElement('div');
+    label.style.flex = '1';
+    label.textContent = `#${job.id} ${job.name || job.path.split('/').pop()} — ${job.status}` +
+      (job.attempts > 1 ? ` (attempt ${job.attempts})` : '') + (job.error ? ` · ${job.error}` : '');
+    div.appendChild(label);
+    if(job.status === 'queued' || job.status === 'running'){
+      const cancel = document.createElement('button');
+      cancel.className = 'btn small ghost'; cancel.textContent = 'Cancel';
+      cancel.addEventListener('click', async ()=>{ await fetch(APP_ROOT + '/api/jobs/' + job.id, {method:'DELETE'}); loadJobs(); });
+      div.appendChild(cancel);
+    }
+    list.appendChild(div);
+  });
+}
+// clusters of near-duplicate uploads; unused copies can be deleted
+async function loadDuplicates(){
+  const list = document.getElementById('dupes-list');
+  if(!list) return;
+  let j;
+  try{ const res = await fetch(APP_ROOT + '/api/duplicates'); if(!res.ok) return; j = await res.json(); }catch(e){ return }
+  document.getElementById('dupes-summary').textContent =
+    `${j.clusters.length} cluster(s) · ${(j.reclaimable / 1e6).toFixed(1)} MB in unused copies`;
+  list.innerHTML = '';
+  j.clusters.forEach(cluster=>{
+    const div = document.createElement('div');
+    div.className = 'list-item';
+    div.textContent = cluster.members.map(m=> (m.name || m.url.split('/').pop()) + (m.referenced ? '' : ' (unused)')).join(', ');
+    list.appendChild(div);
+  });
+}
+const refreshDupesBtn = document.getElementById('refresh-dupes');
+refreshDupesBtn && refreshDupesBtn.addEventListener('click', loadDuplicates);
+
+const refreshJobsBtn = document.getElementById('refresh-jobs');
+refreshJobsBtn && refreshJobsBtn.addEventListener('click', loadJobs);
+loadJobs();
+setInterval(loadJobs, 5000);
+
 // auto-load on open
 loadBtn.click();
 
@@ -416,7 +540,7 @@ if(savedMode) { applyMode(savedMode); setActiveModeButton(savedMode); }
 // apply saved mode from server-side current if available after load
 async function applySavedServerMode(){
   try{
-    const res = await fetch('/api/data');
+    const res = await fetch(APP_ROOT + '/api/data');
     if(res.ok){
       const d = await res.json();
       if(d && d.ui_mode){
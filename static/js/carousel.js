@@ -1,3 +1,5 @@
+// app routes are under the tenant's path prefix in multi-tenant path mode
+var APP_ROOT = document.documentElement.dataset.root || '';
 // Simple carousel for certs/snaps/events. Elements expected:
 // .cert-carousel with .cert-post children, controls with ids like cert-next, cert-prev and details container id cert-details
 function wireCarousel(prefix){
@@ -65,7 +67,7 @@ document.addEventListener('DOMContentLoaded', ()=>{
   // live update via Server-Sent Events
   try{
     if(typeof(EventSource) !== 'undefined'){
-      const es = new EventSource('/stream');
+      const es = new EventSource(APP_ROOT + '/stream');
       es.addEventListener('processed', async (ev)=>{
         try{
           const data = JSON.parse(ev.data);
@@ -1,3 +1,5 @@
+// app routes are under the tenant's path prefix in multi-tenant path mode
+var APP_ROOT = document.documentElement.dataset.root || '';
 const chatBody = document.getElementById('chat-body')
 const chatInput = document.getElementById('chat-input')
 const chatSend = document.getElementById('chat-send')
@@ -10,6 +12,32 @@ function appendMessage(text, who='bot'){
   chatBody.scrollTop = chatBody.scrollHeight
 }
 
+// read `delta` frames into the loader as they arrive; resolves with the `done` payload
+async function readReplyStream(res, loader){
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buf = '', text = '', done = null
+  while(!done){
+    const chunk = await reader.read()
+    if(chunk.done) break
+    buf += decoder.decode(chunk.value, {stream:true})
+    let idx
+    while((idx = buf.indexOf('\n\n')) >= 0){
+      const frame = buf.slice(0, idx); buf = buf.slice(idx+2)
+      let event = 'message', payload = ''
+      frame.split('\n').forEach(line=>{
+        if(line.startsWith('event:')) event = line.slice(6).trim()
+        else if(line.startsWith('data:')) payload += line.slice(5).trim()
+      })
+      if(!payload) continue
+      const msg = JSON.parse(payload)
+      if(event === 'delta'){ text += msg.text; loader.textContent = text; chatBody.scrollTop = chatBody.scrollHeight }
+      else if(event === 'done') done = msg
+    }
+  }
+  return done || {reply: text}
+}
+
 async function sendMessage(){
   const text = chatInput.value.trim()
   if(!text) return
@@ -20,10 +48,13 @@ async function sendMessage(){
   try{
     // try LLM endpoint first
     let data;
-    const res1 = await fetch('/chat-llm',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:text})})
-    if(res1.ok){ data = await res1.json() }
+    const res1 = await fetch(APP_ROOT + '/chat-llm',{method:'POST',headers:{'Content-Type':'application/json','Accept':'text/event-stream, application/json'},body:JSON.stringify({message:text})})
+    if(res1.ok){
+      if((res1.headers.get('Content-Type')||'').includes('text/event-stream')) data = await readReplyStream(res1, loader)
+      else data = await res1.json()
+    }
     if(!data || !data.reply){
-      const res2 = await fetch('/chat',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:text})})
+      const res2 = await fetch(APP_ROOT + '/chat',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:text})})
       data = await res2.json()
     }
     loader.remove()
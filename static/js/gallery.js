@@ -0,0 +1,63 @@
+// Gallery: pages through /api/items/gallery as the end of the grid scrolls
+// into view. Each image reserves its box from width/height and shows the
+// blurred LQIP until the real file has loaded.
+(function(){
+  var grid = document.getElementById('gallery');
+  var sentinel = document.getElementById('gallery-more');
+  if (!grid || !sentinel) return;
+  var next = '';
+  var loading = false;
+  var done = false;
+
+  function figure(item){
+    var fig = document.createElement('figure');
+    var img = document.createElement('img');
+    img.src = item.thumb || item.url;
+    if (item.srcset){ img.srcset = item.srcset; img.sizes = '(max-width: 720px) 50vw, 240px'; }
+    if (item.width && item.height){ img.width = item.width; img.height = item.height; }
+    if (item.lqip){
+      img.style.backgroundImage = 'url(' + item.lqip + ')';
+      img.style.backgroundSize = 'cover';
+      img.addEventListener('load', function(){ img.style.backgroundImage = ''; }, { once: true });
+    }
+    img.alt = item.name || '';
+    img.loading = 'lazy';
+    img.decoding = 'async';
+    fig.appendChild(img);
+    var caption = document.createElement('figcaption');
+    caption.textContent = item.project ? item.project + ' — ' + (item.name || '') : (item.name || '');
+    fig.appendChild(caption);
+    return fig;
+  }
+
+  function loadPage(){
+    if (loading || done) return;
+    loading = true;
+    var url = grid.dataset.src + (next ? '?cursor=' + encodeURIComponent(next) : '');
+    fetch(url, { headers: { 'Accept': 'application/json' } })
+      .then(function(r){ return r.json(); })
+      .then(function(body){
+        (body.items || []).forEach(function(item){ grid.appendChild(figure(item)); });
+        next = body.next;
+        done = !next;
+        if (!grid.children.length) document.getElementById('gallery-empty').hidden = false;
+        if (done && observer) observer.disconnect();
+      })
+      .catch(function(){ done = true; })
+      .then(function(){
+        loading = false;
+        // the observer only fires on changes; keep filling a tall viewport
+        if (!done && sentinel.getBoundingClientRect().top < window.innerHeight + 600) loadPage();
+      });
+  }
+
+  var observer = null;
+  if ('IntersectionObserver' in window){
+    observer = new IntersectionObserver(function(entries){
+      if (entries.some(function(e){ return e.isIntersecting; })) loadPage();
+    }, { rootMargin: '600px 0px' });
+    observer.observe(sentinel);
+  } else {
+    loadPage();
+  }
+})();
@@ -1,3 +1,5 @@
+// app routes are under the tenant's path prefix in multi-tenant path mode
+var APP_ROOT = document.documentElement.dataset.root || '';
 i // Enhanced UI enhancements: reveal animations, smooth scroll, performance optimizations
 document.addEventListener('DOMContentLoaded', function(){
   // Preload critical images
@@ -140,7 +142,7 @@ document.addEventListener('DOMContentLoaded', function(){
   document.addEventListener('keydown', (e)=>{ if(e.key==='Escape') closeDp() })
   // Listen for server-sent events (ui_mode changes) to update theme live
   try{
-    const es = new EventSource('/stream');
+    const es = new EventSource(APP_ROOT + '/stream');
     es.addEventListener('ui_mode', (ev)=>{
       try{
         const data = JSON.parse(ev.data || '{}');
@@ -170,7 +172,7 @@ document.addEventListener('DOMContentLoaded', function(){
 
         const formData = new FormData(form);
         try {
-          const response = await fetch('/contact', {
+          const response = await fetch(APP_ROOT + '/contact', {
             method: 'POST',
             body: formData
           });
@@ -199,7 +201,7 @@ document.addEventListener('DOMContentLoaded', function(){
     if(!modal || !form) return;
 
     // Check if user info is set
-    fetch('/api/user-info')
+    fetch(APP_ROOT + '/api/user-info')
       .then(res => res.json())
       .then(data => {
         if(!data || !data.name){
@@ -220,7 +222,7 @@ document.addEventListener('DOMContentLoaded', function(){
         details: formData.get('details')
       };
       try {
-        const response = await fetch('/set-user-info', {
+        const response = await fetch(APP_ROOT + '/set-user-info', {
           method: 'POST',
           headers: {'Content-Type': 'application/json'},
           body: JSON.stringify(obj)
@@ -1,3 +1,5 @@
+// app routes are under the tenant's path prefix in multi-tenant path mode
+var APP_ROOT = document.documentElement.dataset.root || '';
 // Simple Reels implementation: full-screen vertical cards that autoplay and respond to swipe up/down
 document.addEventListener('DOMContentLoaded', ()=>{
   const openBtn = document.getElementById('open-reels');
@@ -50,7 +52,7 @@ document.addEventListener('DOMContentLoaded', ()=>{
   // SSE live updates: append new events when processed
   try{
     if(typeof(EventSource) !== 'undefined'){
-      const es = new EventSource('/stream');
+      const es = new EventSource(APP_ROOT + '/stream');
       es.addEventListener('processed', (ev)=>{
         try{
           const obj = JSON.parse(ev.data);
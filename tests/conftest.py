@@ -0,0 +1,12 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# keep the databases of the module-level services, and kept originals, out of the checkout
+_DB_DIR = tempfile.mkdtemp(prefix='portfolio-tests-')
+atexit.register(shutil.rmtree, _DB_DIR, True)
+for _name in ('EVENTS_DB_PATH', 'JOBS_DB_PATH', 'METRICS_DB_PATH', 'NEAR_DUPS_DB_PATH', 'OCR_CACHE_PATH',
+              'OUTBOX_DB_PATH', 'REPROCESS_DB_PATH', 'SEARCH_DB_PATH'):
+    os.environ.setdefault(_name, os.path.join(_DB_DIR, _name.lower().replace('_path', '') + '.sqlite3'))
+os.environ.setdefault('ORIGINALS_FOLDER', os.path.join(_DB_DIR, 'originals'))
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('asgiref')
+
+import app as portfolio
+import asgi
+from tests.test_tenants import make_tenant
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+async def _call(scope, events=(), until=None):
+    sent = []
+    inbox = asyncio.Queue()
+    for e in events:
+        inbox.put_nowait(e)
+
+    async def receive():
+        return await inbox.get()
+
+    async def send(message):
+        sent.append(message)
+        body = b''.join(m.get('body', b'') for m in sent)
+        if until and until in body:
+            inbox.put_nowait({'type': 'http.disconnect'})
+
+    await asgi.app(scope, receive, send)
+    return sent
+
+
+def _scope(path, headers=()):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'headers': list(headers), 'http_version': '1.1', 'scheme': 'http',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'root_path': ''}
+
+
+def test_flask_routes_pass_through():
+    sent = _run(_call(_scope('/welcome'), [{'type': 'http.request', 'body': b'', 'more_body': False}]))
+    assert sent[0]['status'] == 200
+
+
+def test_flask_requests_run_concurrently(monkeypatch):
+    def slow(environ, start_response):
+        time.sleep(0.3)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+    monkeypatch.setattr(asgi, 'wsgi', asgi.ThreadedWsgiToAsgi(slow))
+    request = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def four():
+        return await asyncio.gather(*(_call(_scope('/slow'), request) for _ in range(4)))
+    started = time.monotonic()
+    responses = _run(four())
+    # one shared thread would take 4 x 0.3 s
+    assert time.monotonic() - started < 0.9
+    assert [sent[0]['status'] for sent in responses] == [200] * 4
+
+
+def test_stream_replays_and_ends_on_disconnect(tmp_path, monkeypatch):
+    bus = portfolio.EventBus(str(tmp_path / 'events.sqlite3'))
+    monkeypatch.setattr(asgi, 'EVENTS', bus)
+    first = bus.publish('ui_mode', {'mode': 'glam'})
+    bus.publish('processed', {'name': 'a.jpg'})
+    bus.poll_once()
+
+    sent = _run(_call(_scope('/stream', [(b'last-event-id', str(first).encode())]), until=b'a.jpg'))
+    assert sent[0]['status'] == 200
+    body = b''.join(m.get('body', b'') for m in sent).decode()
+    assert body.startswith('event: connected')
+    assert 'event: processed' in body and 'glam' not in body
+    assert not bus.clients
+
+
+def _body(sent):
+    return b''.join(m.get('body', b'') for m in sent).decode()
+
+
+def test_stream_per_tenant(tmp_path, monkeypatch):
+    root = tmp_path / 'tenants'
+    make_tenant(root, 'alice', {'name': 'Alice'})
+    make_tenant(root, 'bob', {'name': 'Bob'})
+    monkeypatch.setattr(portfolio, 'TENANT_UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(portfolio, 'TENANTS', portfolio.TenantRegistry(str(root)))
+    monkeypatch.setattr(portfolio, 'TENANT_MODE', 'path')
+    bus = portfolio.EventBus(str(tmp_path / 'events.sqlite3'))
+    monkeypatch.setattr(asgi, 'EVENTS', bus)
+    for tenant in ('alice', 'bob', None):
+        bus.publish('processed', {'name': f'{tenant}.jpg'}, tenant=tenant)
+    bus.poll_once()
+    since_start = [(b'last-event-id', b'0')]
+
+    body = _body(_run(_call(_scope('/t/alice/stream', since_start), until=b'alice.jpg')))
+    assert 'alice.jpg' in body and 'bob.jpg' not in body and 'None.jpg' not in body
+    assert _run(_call(_scope('/t/nobody/stream')))[0]['status'] == 404
+
+    monkeypatch.setattr(portfolio, 'TENANT_MODE', 'host')
+    monkeypatch.setattr(portfolio, 'TENANT_DOMAIN', 'example.com')
+    body = _body(_run(_call(_scope('/stream', since_start + [(b'host', b'bob.example.com')]), until=b'bob.jpg')))
+    assert 'bob.jpg' in body and 'alice.jpg' not in body and 'None.jpg' not in body
+    body = _body(_run(_call(_scope('/stream', since_start + [(b'host', b'example.com')]), until=b'None.jpg')))
+    assert 'alice.jpg' not in body and 'bob.jpg' not in body
+    assert not bus.clients
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def assets(tmp_path, monkeypatch):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'site.css').write_text('body { color: red; }\n' * 50)
+    manifest = portfolio.AssetManifest(str(static), str(tmp_path / 'dist'))
+    manifest.build()
+    monkeypatch.setattr(portfolio, 'ASSETS', manifest)
+    return manifest
+
+
+def test_build_fingerprints_and_precompresses(assets, tmp_path):
+    name = assets.files['css/site.css']
+    assert name.startswith('css/site.') and name.endswith('.css') and len(name) == len('css/site..css') + 12
+    built = tmp_path / 'dist' / name
+    assert gzip.decompress((tmp_path / 'dist' / (name + '.gz')).read_bytes()) == built.read_bytes()
+
+    (tmp_path / 'static' / 'css' / 'site.css').write_text('body { color: blue; }\n')
+    assets.build()
+    assert assets.files['css/site.css'] != name
+    assert built.exists()
+    assets.clean()
+    assert not built.exists()
+
+
+def test_fingerprinted_urls_are_immutable_and_negotiated(assets):
+    with portfolio.app.test_request_context():
+        url = assets.url('css/site.css')
+        assert assets.url('css/other.css') == '/static/css/other.css'
+    c = portfolio.app.test_client()
+    r = c.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert r.status_code == 200
+    assert 'immutable' in r.headers['Cache-Control']
+    assert r.headers['Content-Encoding'] == ('br' if portfolio.BROTLI_AVAILABLE else 'gzip')
+    assert r.mimetype == 'text/css'
+    assert 'Accept-Encoding' in r.headers['Vary']
+    plain = c.get(url)
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data.startswith(b'body { color: red; }')
+
+
+def test_templates_use_fingerprinted_urls():
+    html = portfolio.app.test_client().get('/welcome').get_data(as_text=True)
+    assert '/static/' + portfolio.ASSETS.files['css/style.css'] in html
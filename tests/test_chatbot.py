@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'skills': ['Python', 'SQL'],
+                                'projects': [{'title': 'Traffic'}]}), encoding='utf-8')
+    s = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+    s.listeners.append(portfolio._warm_bot_facts)
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', s)
+    portfolio.BOT_ANSWERS.clear()
+    return s
+
+
+def test_word_boundaries_and_priority():
+    m = portfolio.BOT_MATCHER
+    assert m.best('this is which one') is None
+    assert m.best('hi') == 'greeting'
+    assert m.best('hi, what are your skills') == 'skills'
+    assert m.best('any certifications') == 'certificates'
+    assert m.match('projects and project portfolio')[0] == ('projects', 3)
+
+
+def test_plural_forms_do_not_widen_other_keywords():
+    m = portfolio.BOT_MATCHER
+    assert m.match('tell me about his projects') == [('projects', 1)]
+    assert m.best('is this yours') is None
+    assert m.best('his') is None and m.best('hiss') is None
+    assert m.best('any photos or awards') == 'achievements'
+
+
+def test_answers_follow_data_version(store):
+    assert portfolio.answer_bot('Skills?') == 'Python, SQL'
+    assert portfolio.answer_bot('skills') == 'Python, SQL'
+    assert portfolio.BOT_ANSWERS.stats()['hits'] == 1
+
+    store.save({'name': 'A', 'skills': ['Go'], 'projects': []})
+    assert portfolio.answer_bot('skills') == 'Go'
+    assert portfolio.answer_bot('hello').startswith("Hi, I'm A")
+
+
+def test_chat_endpoint(store):
+    r = portfolio.app.test_client().post('/chat', json={'message': 'your projects'})
+    assert r.get_json() == {'reply': 'Projects: Traffic'}
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'skills': ['Python'], 'projects': []}), encoding='utf-8')
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', portfolio.ProfileStore(str(path), portfolio.PROFILE))
+    c = portfolio.app.test_client()
+    with c.session_transaction() as s:
+        s['admin'] = True
+    return c
+
+
+def test_json_patch_with_if_match(client):
+    r = client.get('/api/data')
+    etag = r.headers['ETag']
+    ops = [{'op': 'add', 'path': '/skills/-', 'value': 'Go'}, {'op': 'replace', 'path': '/name', 'value': 'B'}]
+    r = client.patch('/api/data', data=json.dumps(ops), headers={'If-Match': etag},
+                     content_type='application/json-patch+json')
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+    data = client.get('/api/data').get_json()
+    assert data['skills'] == ['Python', 'Go'] and data['name'] == 'B'
+
+    # the old ETag is now stale
+    r = client.patch('/api/data', data=json.dumps(ops), headers={'If-Match': etag},
+                     content_type='application/json-patch+json')
+    assert r.status_code == 412
+
+
+def test_merge_patch_and_journal(client):
+    r = client.patch('/api/data', data=json.dumps({'location': 'Hyderabad', 'skills': None}),
+                     content_type='application/merge-patch+json')
+    assert r.status_code == 200
+    data = client.get('/api/data').get_json()
+    assert data['location'] == 'Hyderabad' and 'skills' not in data
+    entries = portfolio.PROFILE_STORE.read_journal()
+    assert entries[-1]['op'] == 'merge'
+    assert entries[-1]['change'] == {'location': 'Hyderabad', 'skills': None}
+
+
+def test_invalid_patch_is_rejected(client):
+    r = client.patch('/api/data', data=json.dumps([{'op': 'remove', 'path': '/missing'}]),
+                     content_type='application/json-patch+json')
+    assert r.status_code == 422
+    assert client.get('/api/data').get_json()['name'] == 'A'
+
+
+def test_get_not_modified(client):
+    etag = client.get('/api/data').headers['ETag']
+    assert client.get('/api/data', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_journal_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(portfolio, 'JOURNAL_MAX_ENTRIES', 5)
+    monkeypatch.setattr(portfolio, 'JOURNAL_KEEP_ENTRIES', 2)
+    store = portfolio.ProfileStore(str(tmp_path / 'data.json'), {'n': 0})
+    for i in range(1, 8):
+        store.save({'n': i})
+    seqs = [e['seq'] for e in store.read_journal()]
+    assert len(seqs) <= 5 and seqs[-1] == 7
+    assert store.get()['n'] == 7
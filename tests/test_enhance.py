@@ -0,0 +1,90 @@
+import pytest
+
+import app as portfolio
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture(autouse=True)
+def image_libs():
+    # the helpers below use the lazily imported modules directly
+    portfolio.load_image_libs()
+
+
+def test_tiled_denoise_matches_whole_image():
+    rng = np.random.default_rng(1)
+    img = rng.integers(80, 160, (150, 170, 3), dtype=np.uint8)
+    whole = cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
+    assert np.array_equal(portfolio._denoise_tiled(img, tile=64), whole)
+
+
+def test_final_transform_crops_and_fits_in_one_pass():
+    img = np.zeros((1000, 800, 3), np.uint8)
+    out = portfolio._final_transform(img, 0.0, (100, 100, 700, 900), (300, 300))
+    assert out.shape == (300, 225, 3)
+    out = portfolio._final_transform(img, 5.0, None, (400, 400))
+    assert out.shape == (400, 320, 3)
+
+
+def test_large_jpeg_is_decoded_reduced(tmp_path):
+    path = str(tmp_path / 'big.jpg')
+    cv2.imwrite(path, np.full((3000, 4000, 3), 128, np.uint8))
+    im = portfolio._decode_for_enhance(np.fromfile(path, dtype=np.uint8), (1000, 1000), headroom=1)
+    assert im.shape == (750, 1000, 3)
+    timings = {}
+    portfolio.advanced_enhance(path, max_size=(1000, 1000), timings=timings)
+    assert cv2.imread(path).shape == (750, 1000, 3)
+    assert set(timings) >= {'decode', 'analyse', 'transform', 'denoise', 'encode'}
+
+
+class FakeTesseract:
+    class Output:
+        DICT = 'dict'
+
+    def __init__(self):
+        self.calls = []
+
+    def get_tesseract_version(self):
+        return '5.3.0'
+
+    def image_to_data(self, image, config='', output_type=None):
+        self.calls.append(image.size)
+        return {'level': [1, 5, 5, 5], 'conf': ['-1', '91.5', '12', ''],
+                'left': [0, 300, 10, 900], 'top': [0, 200, 10, 600],
+                'width': [1200, 400, 50, 50], 'height': [800, 100, 50, 50]}
+
+
+def test_ocr_crop_is_cached_by_content(tmp_path, monkeypatch):
+    fake = FakeTesseract()
+    monkeypatch.setattr(portfolio, 'pytesseract', fake)
+    monkeypatch.setattr(portfolio, 'TESSERACT_AVAILABLE', True)
+    monkeypatch.setattr(portfolio, 'OCR_CACHE', portfolio.OCRCache(str(tmp_path / 'ocr.sqlite3')))
+    portfolio._ocr_settings.cache_clear()
+    original = tmp_path / 'original.png'
+    cv2.imwrite(str(original), np.full((800, 1200, 3), 255, np.uint8))
+
+    first = tmp_path / 'a.png'
+    first.write_bytes(original.read_bytes())
+    portfolio.advanced_enhance(str(first))
+    assert len(fake.calls) == 1
+    # cropped to the confident word plus padding
+    shape = cv2.imread(str(first)).shape
+    assert 440 <= shape[1] <= 450 and 110 <= shape[0] <= 115
+
+    again = tmp_path / 'b.png'
+    again.write_bytes(original.read_bytes())
+    portfolio.advanced_enhance(str(again))
+    assert again.read_bytes() == first.read_bytes()
+
+    # reprocessing the output neither runs tesseract nor crops again
+    portfolio.advanced_enhance(str(first))
+    assert cv2.imread(str(first)).shape == shape
+    assert len(fake.calls) == 1
+    portfolio._ocr_settings.cache_clear()
+
+
+def test_confident_boxes_vectorized():
+    data = {'conf': [-1, '95', ' 40.0 ', 'nan', 29], 'left': ['0', 5, 1, 2, 3], 'top': [0, 6, 1, 2, 3],
+            'width': [10, 2, 0, 4, 4], 'height': [10, 3, 4, 4, 4]}
+    assert portfolio._confident_boxes(data).tolist() == [[5, 6, 7, 9]]
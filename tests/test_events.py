@@ -0,0 +1,60 @@
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def buses(tmp_path):
+    # two buses on one log stand in for two gunicorn worker processes
+    path = str(tmp_path / 'events.sqlite3')
+    return portfolio.EventBus(path, replay=3), portfolio.EventBus(path, replay=3)
+
+
+def test_events_fan_out_across_processes(buses):
+    a, b = buses
+    client, backlog = b.subscribe()
+    assert backlog == []
+    first = a.publish('processed', {'name': 'x.jpg'})
+    second = a.publish('ui_mode', {'mode': 'glam'})
+    assert second > first
+    b.poll_once()
+    got = [client.queue.get_nowait() for _ in range(2)]
+    assert [m['id'] for m in got] == [first, second]
+    assert got[1] == {'id': second, 'event': 'ui_mode', 'data': {'mode': 'glam'}}
+
+
+def test_last_event_id_replay(buses):
+    a, b = buses
+    b.subscribe()
+    ids = [a.publish('processed', {'n': i}) for i in range(5)]
+    b.poll_once()
+    # within the in-memory window
+    _, backlog = b.subscribe(ids[2])
+    assert [m['id'] for m in backlog] == ids[3:]
+    # older than the window: served from the shared log
+    _, backlog = b.subscribe(ids[0])
+    assert [m['data']['n'] for m in backlog] == [1, 2, 3, 4]
+
+
+def test_slow_client_overflow_policies():
+    client = portfolio.SSEClient(maxsize=2, overflow='drop')
+    for i in range(4):
+        client.offer({'id': i})
+    assert [client.queue.get_nowait()['id'] for _ in range(2)] == [2, 3]
+    assert client.dropped == 2
+
+    client = portfolio.SSEClient(maxsize=2, overflow='disconnect')
+    for i in range(3):
+        client.offer({'id': i})
+    assert client.closed
+    out = list(portfolio.event_stream(client))
+    assert len(out) == 1 and out[0].startswith('event: connected')
+
+
+def test_stream_heartbeat_and_ids():
+    client = portfolio.SSEClient()
+    client.offer({'id': 7, 'event': 'processed', 'data': {'a': 1}})
+    gen = portfolio.event_stream(client, heartbeat=0.01)
+    assert next(gen).startswith('event: connected')
+    assert next(gen) == 'id: 7\nevent: processed\ndata: {"a": 1}\n\n'
+    assert next(gen) == ': ping\n\n'
@@ -0,0 +1,166 @@
+import os
+import queue
+import time
+
+import pytest
+
+import app as portfolio
+
+
+def _sleepy(path):
+    time.sleep(float(os.path.basename(path).split('-')[0]))
+
+
+def _fails(path):
+    raise SystemExit(3)
+
+
+def _wait(engine, job, timeout=10, until=('done', 'failed', 'cancelled')):
+    end = time.time() + timeout
+    while time.time() < end:
+        current = engine.get(job['id'])
+        if current['status'] in until:
+            return current
+        time.sleep(0.02)
+    raise AssertionError('job did not finish')
+
+
+def _engine(tmp_path, handler=_sleepy, **kwargs):
+    kwargs.setdefault('poll_interval', 0.05)
+    e = portfolio.ImageJobEngine(handler, str(tmp_path / 'jobs.sqlite3'), **kwargs)
+    e.done = []
+    e.on_done.append(e.done.append)
+    return e
+
+
+@pytest.fixture
+def engine(tmp_path):
+    e = _engine(tmp_path, workers=1, max_depth=3, timeout=5)
+    e.start()
+    yield e
+    e.stop(timeout=5)
+
+
+def test_priority_order_and_coalescing(engine):
+    first = engine.put({'path': '0.3-a'})
+    _wait(engine, first, until=('running',))
+    bulk = engine.put({'path': '0-bulk'}, portfolio.PRIORITY_BULK)
+    preview = engine.put({'path': '0-preview'}, portfolio.PRIORITY_PREVIEW)
+    again = engine.put({'path': '0-bulk'}, portfolio.PRIORITY_BULK)
+    assert again['id'] == bulk['id'] and again['coalesced'] == 1
+    _wait(engine, bulk)
+    order = [j['path'] for j in engine.done]
+    assert order == ['0.3-a', '0-preview', '0-bulk']
+    assert all(j['status'] == 'done' for j in engine.done)
+
+
+def test_queue_depth_limit(engine):
+    _wait(engine, engine.put({'path': '0.5-running'}), until=('running',))
+    for i in range(3):
+        engine.put({'path': f'0-{i}'})
+    assert engine.full()
+    with pytest.raises(queue.Full):
+        engine.put({'path': '0-overflow'})
+
+
+def test_cancel_and_timeout(tmp_path):
+    e = _engine(tmp_path, workers=1, timeout=0.3, max_attempts=1)
+    e.start()
+    try:
+        slow = e.put({'path': '3-slow'})
+        queued = e.put({'path': '0-queued'})
+        assert e.cancel(queued['id'])
+        assert _wait(e, slow)['status'] == 'failed'
+        assert e.get(slow['id'])['error'] == 'timeout'
+        assert e.get(queued['id'])['status'] == 'cancelled'
+
+        running = e.put({'path': '2-running'})
+        _wait(e, running, until=('running',))
+        assert e.cancel(running['id'])
+        assert _wait(e, running)['status'] == 'cancelled'
+    finally:
+        e.stop(timeout=5)
+
+
+def test_failed_job_is_retried_with_backoff(tmp_path):
+    e = _engine(tmp_path, _fails, max_attempts=2, backoff=0.2)
+    e.start()
+    try:
+        job = _wait(e, e.put({'path': 'x'}))
+        assert job['status'] == 'failed' and job['error'] == 'exit code 3'
+        assert job['attempts'] == 2
+        assert job['finished'] - job['created'] >= 0.2
+    finally:
+        e.stop(timeout=5)
+
+
+def test_jobs_survive_restart_and_expired_leases_are_swept(tmp_path):
+    e = _engine(tmp_path)
+    job = e.put({'path': '0-persisted', 'kind': 'snap'})
+    # simulate a process that claimed the job and died
+    with e._db() as db:
+        db.execute("UPDATE jobs SET status = 'running', lease_owner = 'dead', lease_expires = ? WHERE id = ?",
+                   (time.time() - 1, job['id']))
+
+    restarted = _engine(tmp_path)
+    assert restarted.get(job['id'])['status'] == 'running'
+    restarted.start()
+    try:
+        done = _wait(restarted, job)
+        assert done['status'] == 'done' and done['kind'] == 'snap'
+    finally:
+        restarted.stop(timeout=5)
+
+
+def test_lease_is_renewed_and_queues_jobs_submitted_meanwhile(tmp_path):
+    e = _engine(tmp_path)
+    e.lease_time = 0.3
+    with e.lease('0-held', 'reprocess') as held:
+        assert held
+        job = e.put({'path': '0-held', 'kind': 'snap'})
+        time.sleep(0.6)
+        e.sweep()
+        assert e.get(job['id'])['status'] == 'running'
+    queued = e.get(job['id'])
+    assert queued['status'] == 'queued' and queued['kind'] == 'snap' and 'lease' not in queued
+    e.start()
+    try:
+        assert _wait(e, job)['status'] == 'done'
+    finally:
+        e.stop(timeout=5)
+
+
+def test_expired_lease_is_dropped_but_not_its_queued_job(tmp_path):
+    e = _engine(tmp_path)
+    with e._db() as db:
+        for path, payload in (('0-alone', '{"lease": "reprocess"}'),
+                              ('0-held', '{"lease": "reprocess", "queued": {"kind": "snap"}}')):
+            db.execute("INSERT INTO jobs (path, payload, priority, status, run_after, lease_owner, lease_expires, "
+                       "created) VALUES (?, ?, 0, 'running', 0, 'dead', ?, 0)", (path, payload, time.time() - 1))
+    e.sweep()
+    assert {j['path']: (j['status'], j.get('kind')) for j in e.jobs()} == {
+        '0-alone': ('failed', None), '0-held': ('queued', 'snap')}
+
+
+def test_stop_requeues_jobs_still_running_at_deadline(tmp_path):
+    e = _engine(tmp_path, workers=1, timeout=30)
+    e.start()
+    job = e.put({'path': '5-long'})
+    _wait(e, job, until=('running',))
+    e.stop(timeout=0.2)
+    current = e.get(job['id'])
+    assert current['status'] == 'queued' and current['attempts'] == 0
+    assert e.done == []
+
+
+def test_preload_runs_once_before_first_job(tmp_path):
+    calls = []
+    e = _engine(tmp_path, workers=1, timeout=5, preload=lambda: calls.append(1))
+    e.start()
+    try:
+        assert calls == []
+        _wait(e, e.put({'path': '0-a'}))
+        _wait(e, e.put({'path': '0-b'}))
+        assert calls == [1]
+    finally:
+        e.stop(timeout=5)
@@ -0,0 +1,94 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import app as portfolio
+
+
+def _jpeg(size=(1200, 900)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, (200, 80, 40)).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+@pytest.fixture
+def blob(tmp_path, monkeypatch):
+    blobs = portfolio.BlobStore(str(tmp_path / 'blobs'), str(tmp_path / 'thumbs'))
+    cache = portfolio.DerivativeCache(str(tmp_path / 'derived'), 10 * 1024 * 1024)
+    monkeypatch.setattr(portfolio, 'BLOBS', blobs)
+    monkeypatch.setattr(portfolio, 'DERIVATIVES', cache)
+    digest, _, tmp = blobs.ingest(io.BytesIO(_jpeg()))
+    blobs.commit(tmp, digest, 'jpg')
+    return digest
+
+
+def test_variant_negotiates_format_and_width(blob):
+    c = portfolio.app.test_client()
+    r = c.get(f'/img/{blob}/320.auto', headers={'Accept': 'image/webp,image/*'})
+    assert r.status_code == 200
+    assert r.mimetype == 'image/webp'
+    assert 'Accept' in r.headers['Vary']
+    assert Image.open(io.BytesIO(r.data)).size == (320, 240)
+
+    r = c.get(f'/img/{blob}/320.auto', headers={'Accept': 'image/*'})
+    assert r.mimetype == 'image/jpeg'
+    assert portfolio.DERIVATIVES.stats()['misses'] == 2
+
+    c.get(f'/img/{blob}/320.jpg')
+    assert portfolio.DERIVATIVES.stats()['hits'] == 1
+
+
+def test_variant_rejects_unknown_width(blob):
+    c = portfolio.app.test_client()
+    assert c.get(f'/img/{blob}/333.jpg').status_code == 404
+    assert c.get(f'/img/{"0" * 64}/320.jpg').status_code == 404
+
+
+def test_cache_evicts_least_recently_used(blob, tmp_path):
+    source = portfolio.BLOBS.find(blob)
+    cache = portfolio.DerivativeCache(str(tmp_path / 'small'), 1)
+    first = cache.get(blob, source, 160, 'jpg')
+    second = cache.get(blob, source, 320, 'jpg')
+    assert not os.path.exists(first) and not os.path.exists(second)
+    assert cache.stats()['evictions'] == 2
+
+    cache.max_bytes = 10 * 1024 * 1024
+    a = cache.get(blob, source, 160, 'jpg')
+    b = cache.get(blob, source, 320, 'jpg')
+    cache.get(blob, source, 160, 'jpg')  # 160 is now most recently used
+    cache.max_bytes = int(os.path.getsize(a) / 0.9) + 1
+    cache._evict()
+    assert os.path.exists(a)
+    assert not os.path.exists(b)
+
+
+def test_srcset_filter():
+    digest = 'a' * 64
+    out = portfolio.srcset_filter(f'/static/uploads/blobs/aa/{digest}.jpg')
+    assert f'/img/{digest}/320.auto 320w' in out
+    assert portfolio.srcset_filter('/static/uploads/legacy.jpg') == ''
+
+
+def test_enhance_applies_orientation_once_and_keeps_icc(tmp_path):
+    from PIL import ImageCms
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    exif = Image.Exif()
+    exif[portfolio.EXIF_ORIENTATION] = 5  # transpose: stored 4000x3000, shown 3000x4000
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (4000, 3000), (20, 120, 220)).save(path, 'JPEG', exif=exif.tobytes(), icc_profile=icc)
+
+    img = portfolio.enhance_image(str(path))
+    assert img.size == (1500, 2000)
+    saved = Image.open(path)
+    assert saved.size == (1500, 2000)
+    assert saved.info.get('icc_profile') == icc
+    assert portfolio.EXIF_ORIENTATION not in saved.getexif()
+
+
+def test_draft_decode_keeps_the_requested_width(tmp_path):
+    path = tmp_path / 'tall.jpg'
+    Image.new('RGB', (3000, 4000)).save(path, 'JPEG')
+    assert portfolio.open_image(str(path), (480, float('inf'))).width >= 480
+    assert portfolio.open_image(str(path), (2000, 2000)).size == (1500, 2000)
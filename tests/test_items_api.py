@@ -0,0 +1,67 @@
+import io
+import json
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    snaps = [{'name': f'snap-{i}', 'url': f'/static/uploads/snap-{i}.jpg'} for i in range(5)]
+    path.write_text(json.dumps({'name': 'A', 'snaps': snaps, 'projects': [
+        {'title': 'P', 'images': [{'name': 'shot', 'url': '/static/uploads/shot.png'}]}]}), encoding='utf-8')
+    store = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', store)
+    return portfolio.app.test_client()
+
+
+def names(body):
+    return [item['name'] for item in body['items']]
+
+
+def test_pages_follow_cursor(client):
+    first = client.get('/api/items/snaps?limit=2').get_json()
+    assert names(first) == ['snap-0', 'snap-1'] and first['total'] == 5
+    second = client.get(f"/api/items/snaps?limit=2&cursor={first['next']}").get_json()
+    assert names(second) == ['snap-2', 'snap-3']
+    last = client.get(f"/api/items/snaps?limit=2&cursor={second['next']}").get_json()
+    assert names(last) == ['snap-4'] and last['next'] is None
+
+
+def test_cursor_survives_removed_item(client):
+    first = client.get('/api/items/snaps?limit=2').get_json()
+
+    def drop(doc):
+        doc['snaps'] = [s for s in doc['snaps'] if s['name'] != 'snap-1']
+        return doc
+    portfolio.PROFILE_STORE.update(drop)
+    nxt = client.get(f"/api/items/snaps?limit=2&cursor={first['next']}").get_json()
+    assert names(nxt) == ['snap-2', 'snap-3']
+
+
+def test_gallery_flattens_project_images(client):
+    body = client.get('/api/items/gallery').get_json()
+    assert body['items'][0]['project'] == 'P' and body['items'][0]['name'] == 'shot'
+
+
+def test_rejects_bad_input_and_revalidates(client):
+    assert client.get('/api/items/secrets').status_code == 404
+    assert client.get('/api/items/snaps?cursor=!!!').status_code == 400
+    assert client.get('/api/items/snaps?limit=x').status_code == 400
+    r = client.get('/api/items/snaps')
+    assert client.get('/api/items/snaps', headers={'If-None-Match': r.headers['ETag']}).status_code == 304
+
+
+def test_media_meta_recorded_on_entries(client, tmp_path):
+    from PIL import Image
+    Image.new('RGB', (300, 200), (200, 10, 10)).save(tmp_path / 'p.png')
+    meta = portfolio.media_meta(str(tmp_path / 'p.png'))
+    assert (meta['width'], meta['height']) == (300, 200)
+    assert meta['lqip'].startswith('data:image/')
+    digest = 'ab' * 32
+    portfolio.PROFILE_STORE.update(lambda d: dict(d, snaps=[{'name': 'x', 'url': f'/static/uploads/blobs/ab/{digest}.png'}]))
+    portfolio.record_media_meta(digest, meta)
+    item = client.get('/api/items/snaps').get_json()['items'][0]
+    assert item['width'] == 300 and item['lqip'] == meta['lqip'] and item['srcset']
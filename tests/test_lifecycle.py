@@ -0,0 +1,58 @@
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+import pytest
+
+import app as portfolio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_has_no_side_effects():
+    # record every database and directory the import would create
+    code = ('import os, sqlite3, sys, threading; touched = []; '
+            'sqlite3.connect = lambda path, *a, **k: touched.append(path); '
+            'os.makedirs = lambda path, *a, **k: touched.append(path); '
+            'os.mkdir = lambda path, *a, **k: touched.append(path); '
+            'import app; '
+            'print(threading.active_count(), "cv2" in sys.modules, app.STARTUP["pid"], len(touched))')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.split() == ['1', 'False', 'None', '0']
+
+
+def test_first_request_starts_services_once(monkeypatch):
+    started = []
+    monkeypatch.setitem(portfolio.STARTUP, 'pid', None)
+    monkeypatch.setattr(portfolio.PROCESS_QUEUE, 'start', lambda: started.append('jobs'))
+    monkeypatch.setattr(portfolio.OUTBOX, 'start', lambda: started.append('outbox'))
+    client = portfolio.app.test_client()
+    client.get('/api/items/snaps')
+    client.get('/api/items/snaps')
+    assert started == ['jobs', 'outbox']
+    report = portfolio.startup_report()
+    assert report['pid'] == os.getpid() and set(report['steps']) == {'upload_dirs', 'assets', 'image_jobs', 'outbox', 'metrics'}
+    json.dumps(report)
+
+
+def test_shutdown_fits_gunicorn_graceful_timeout(monkeypatch):
+    conf = runpy.run_path(os.path.join(ROOT, 'gunicorn.conf.py'))
+    assert portfolio.SHUTDOWN_TIMEOUT == conf['shutdown_timeout'] < conf['graceful_timeout']
+    monkeypatch.setenv('SHUTDOWN_TIMEOUT', '30')
+    with pytest.raises(ValueError):
+        runpy.run_path(os.path.join(ROOT, 'gunicorn.conf.py'))
+
+
+def test_stop_services_shares_one_deadline(monkeypatch):
+    # both subsystems use their whole budget: together they still end by the deadline
+    monkeypatch.setitem(portfolio.STARTUP, 'pid', os.getpid())
+    monkeypatch.setattr(portfolio, 'SHUTDOWN_GRACE', 0.2)
+    monkeypatch.setattr(portfolio.PROCESS_QUEUE, 'stop', lambda timeout: time.sleep(timeout + 0.2))
+    monkeypatch.setattr(portfolio.OUTBOX, 'stop', lambda timeout: time.sleep(timeout))
+    monkeypatch.setattr(portfolio.METRICS, 'stop', lambda: None)
+    started = time.monotonic()
+    portfolio.stop_services(1.0)
+    assert time.monotonic() - started < 1.2
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app as portfolio
+
+
+class Upstream:
+    """Local stand-in for the generative language endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.delay = 0.0
+        self.status = 200
+        self.chunks = None
+
+    def handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                upstream.calls += 1
+                time.sleep(upstream.delay)
+                if upstream.status != 200:
+                    self.send_response(upstream.status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if upstream.chunks:
+                    payload = ''.join('data: %s\n\n' % json.dumps({'candidates': [{'content': {'parts': [{'text': c}]}}]})
+                                      for c in upstream.chunks).encode()
+                    ctype = 'text/event-stream'
+                else:
+                    question = body['prompt']['text'].split('User: ')[1].split('\n')[0]
+                    payload = json.dumps({'candidates': [{'content': 'echo ' + question}]}).encode()
+                    ctype = 'application/json'
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'skills': ['Python']}), encoding='utf-8')
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', portfolio.ProfileStore(str(path), portfolio.PROFILE))
+    portfolio.BOT_ANSWERS.clear()
+    stub = Upstream()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), stub.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = portfolio.LLMClient('http://127.0.0.1:%d/generate' % server.server_port, 'key', timeout=5)
+    monkeypatch.setattr(portfolio, 'LLM', client)
+    yield stub, client
+    server.shutdown()
+    server.server_close()
+
+
+def test_cached_per_data_version(upstream):
+    stub, client = upstream
+    assert client.ask('Skills?') == 'echo Skills?'
+    assert client.ask('skills') == 'echo Skills?'
+    assert stub.calls == 1
+    portfolio.PROFILE_STORE.save({'name': 'B'})
+    client.ask('skills')
+    assert stub.calls == 2
+
+
+def test_concurrent_questions_coalesce(upstream):
+    stub, client = upstream
+    stub.delay = 0.3
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(client.ask('projects'))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert replies == ['echo projects'] * 5
+    assert stub.calls == 1
+    assert client.coalesced == 4
+
+
+def test_breaker_falls_back_to_rules(upstream):
+    stub, client = upstream
+    stub.status = 500
+    c = portfolio.app.test_client()
+    for _ in range(5):
+        assert c.post('/chat-llm', json={'message': 'skills'}).get_json() == {'reply': 'Python'}
+    assert stub.calls == client.breaker.threshold
+    assert client.breaker.state == 'open'
+
+
+def test_streams_deltas(upstream):
+    stub, client = upstream
+    stub.chunks = ['Hello', ' there']
+    r = portfolio.app.test_client().post('/chat-llm', json={'message': 'hi'},
+                                         headers={'Accept': 'text/event-stream'})
+    body = r.get_data(as_text=True)
+    assert r.mimetype == 'text/event-stream'
+    assert body.count('event: delta') == 2
+    assert 'event: done\ndata: {"reply": "Hello there"}' in body
+
+
+def test_abandoned_trial_releases_breaker(upstream):
+    stub, client = upstream
+    stub.chunks = ['Hello', ' there']
+    client.breaker.failures = client.breaker.threshold
+    client.breaker.opened_at = time.monotonic() - client.breaker.cooldown
+    # the client disconnects after the first chunk of the half-open trial
+    reply = client.stream('hi')
+    assert next(reply) == 'Hello'
+    reply.close()
+    assert client.breaker.state == 'half-open'
+    assert client.ask('hi') == 'Hello there'
+    assert client.breaker.state == 'closed'
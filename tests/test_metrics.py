@@ -0,0 +1,88 @@
+import re
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def metrics(tmp_path, monkeypatch):
+    m = portfolio.Metrics(str(tmp_path / 'metrics.sqlite3'), flush_interval=60)
+    monkeypatch.setattr(portfolio, 'METRICS', m)
+    return m
+
+
+def sample(text, series):
+    match = re.search('^' + re.escape(series) + r' (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_values_are_summed_across_processes(metrics, tmp_path):
+    other = portfolio.Metrics(metrics.db_path, flush_interval=60)
+    metrics.inc('swallowed_exceptions_total', stage='ocr')
+    other.inc('swallowed_exceptions_total', 2, stage='ocr')
+    metrics.set('sse_clients', 3)
+    other.set('sse_clients', 4)
+    for v in (0.003, 0.2, 99):
+        other.observe('image_stage_seconds', v, stage='denoise')
+    other.flush()
+    text = metrics.render()
+    assert sample(text, 'swallowed_exceptions_total{stage="ocr"}') == 3
+    assert sample(text, 'sse_clients') == 7
+    assert sample(text, 'image_stage_seconds_bucket{stage="denoise",le="0.005"}') == 1
+    assert sample(text, 'image_stage_seconds_bucket{stage="denoise",le="0.25"}') == 2
+    assert sample(text, 'image_stage_seconds_bucket{stage="denoise",le="+Inf"}') == 3
+    assert sample(text, 'image_stage_seconds_count{stage="denoise"}') == 3
+
+
+def test_exited_process_keeps_counters_but_not_gauges(metrics, monkeypatch):
+    gone = portfolio.Metrics(metrics.db_path, flush_interval=60)
+    gone.inc('swallowed_exceptions_total', stage='llm')
+    gone.set('sse_clients', 5)
+    gone.flush()
+    metrics.inc('swallowed_exceptions_total', stage='llm')
+    now = portfolio.time.time()
+    monkeypatch.setattr(portfolio.time, 'time', lambda: now + 1000)
+    text = metrics.render()
+    assert sample(text, 'swallowed_exceptions_total{stage="llm"}') == 2
+    assert sample(text, 'sse_clients') is None
+    # folded into the retired row once, not counted again on the next scrape
+    assert sample(metrics.render(), 'swallowed_exceptions_total{stage="llm"}') == 2
+
+
+def test_idle_process_retired_while_alive_is_not_counted_twice(metrics, monkeypatch):
+    idle = portfolio.Metrics(metrics.db_path, flush_interval=60)
+    idle.inc('swallowed_exceptions_total', 2, stage='reprocess')
+    idle.observe('image_stage_seconds', 0.2, stage='denoise')
+    idle.flush()
+    now = portfolio.time.time()
+    monkeypatch.setattr(portfolio.time, 'time', lambda: now + 1000)
+    assert sample(metrics.render(), 'swallowed_exceptions_total{stage="reprocess"}') == 2
+    # still alive: flushes again later with its cumulative values
+    idle.inc('swallowed_exceptions_total', stage='reprocess')
+    idle.observe('image_stage_seconds', 0.2, stage='denoise')
+    idle.flush()
+    idle.flush()
+    text = metrics.render()
+    assert sample(text, 'swallowed_exceptions_total{stage="reprocess"}') == 3
+    assert sample(text, 'image_stage_seconds_count{stage="denoise"}') == 2
+    assert sample(text, 'image_stage_seconds_bucket{stage="denoise",le="0.25"}') == 2
+
+
+def test_metrics_endpoint_reports_route_latency(metrics):
+    client = portfolio.app.test_client()
+    client.post('/chat', json={'message': 'hi'})
+    r = client.get('/metrics')
+    assert r.status_code == 200 and r.mimetype == 'text/plain'
+    assert sample(r.get_data(as_text=True),
+                  'http_request_duration_seconds_count{endpoint="chat",method="POST",status="200"}') == 1
+
+
+def test_disabled_metrics_do_nothing(tmp_path, monkeypatch):
+    m = portfolio.Metrics(str(tmp_path / 'off.sqlite3'), enabled=False)
+    monkeypatch.setattr(portfolio, 'METRICS', m)
+    m.inc('swallowed_exceptions_total', stage='x')
+    with m.timer('image_stage_seconds', stage='x'):
+        pass
+    assert m._values == {} and not (tmp_path / 'off.sqlite3').exists()
+    assert portfolio.app.test_client().get('/metrics').status_code == 404
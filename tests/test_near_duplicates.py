@@ -0,0 +1,97 @@
+import io
+import json
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image, ImageDraw
+
+import app as portfolio
+from tests.test_uploads import QueueStub, upload
+
+
+def picture(seed, size=(800, 600)):
+    rnd = random.Random(seed)
+    img = Image.new('RGB', size, (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        draw.ellipse((x, y, x + rnd.randrange(50, 300), y + rnd.randrange(50, 300)),
+                     fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    return img
+
+
+def jpeg(img, quality=90):
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'snaps': []}), encoding='utf-8')
+    store = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+    blobs = portfolio.BlobStore(str(tmp_path / 'blobs'), str(tmp_path / 'thumbs'))
+    store.listeners.append(blobs.collect)
+    index = portfolio.NearDuplicateIndex(str(tmp_path / 'phash.sqlite3'))
+    blobs.on_release.append(index.forget)
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', store)
+    monkeypatch.setattr(portfolio, 'BLOBS', blobs)
+    monkeypatch.setattr(portfolio, 'NEAR_DUPS', index)
+    monkeypatch.setattr(portfolio, 'PROCESS_QUEUE', QueueStub())
+    # services are not needed (and the stub queue has no dispatcher to start)
+    monkeypatch.setitem(portfolio.STARTUP, 'pid', os.getpid())
+    monkeypatch.setattr(portfolio, 'DERIVATIVES', portfolio.DerivativeCache(str(tmp_path / 'derived'), 1 << 24))
+    c = portfolio.app.test_client()
+    with c.session_transaction() as s:
+        s['admin'] = True
+    return c
+
+
+def test_hashes_survive_reencoding_but_not_other_images():
+    original = portfolio.perceptual_hashes(picture(1))
+    smaller = portfolio.perceptual_hashes(Image.open(io.BytesIO(jpeg(picture(1).resize((400, 300)), 40))))
+    other = portfolio.perceptual_hashes(picture(2))
+    assert all((a ^ b).bit_count() <= 6 for a, b in zip(original, smaller))
+    assert (original[0] ^ other[0]).bit_count() > portfolio.PHASH_MAX_DISTANCE
+
+
+def test_near_duplicate_upload_is_not_enhanced(client):
+    first = upload(client, jpeg(picture(1)), name='me.jpg', kind='snap').get_json()
+    assert first['job'] == 1 and first['near_duplicates'] == []
+    again = upload(client, jpeg(picture(1).resize((640, 480)), 60), name='me-1.jpg', kind='snap').get_json()
+    assert again['job'] is None
+    assert [d['url'] for d in again['near_duplicates']] == [first['url']]
+    assert upload(client, jpeg(picture(2)), name='other.jpg', kind='snap').get_json()['job'] == 2
+    forced = client.post('/api/upload', data={'file': (io.BytesIO(jpeg(picture(1), 50)), 'me-2.jpg'),
+                                              'kind': 'snap', 'force': '1'}).get_json()
+    assert forced['near_duplicates'] and forced['job'] == 3
+
+
+def test_duplicate_report(client):
+    first = upload(client, jpeg(picture(1)), name='me.jpg', kind='snap').get_json()
+    copy = client.post('/api/upload', data={'file': (io.BytesIO(jpeg(picture(1), 50)), 'me-1.jpg'),
+                                            'kind': 'snap', 'force': '1'}).get_json()
+    upload(client, jpeg(picture(2)), name='other.jpg', kind='snap')
+    report = client.get('/api/duplicates').get_json()
+    [cluster] = report['clusters']
+    assert {m['url'] for m in cluster['members']} == {first['url'], copy['url']}
+    # both copies are in use, so nothing can be deleted yet
+    assert all(m['referenced'] for m in cluster['members']) and report['reclaimable'] == 0
+    # a released blob leaves the index
+    client.patch('/api/data', json=[{'op': 'remove', 'path': '/snaps/1'}])
+    assert client.get('/api/duplicates').get_json()['clusters'] == []
+
+
+def test_duplicate_report_matches_whole_urls(client):
+    first = upload(client, jpeg(picture(1)), name='me.jpg', kind='snap').get_json()
+    copy = client.post('/api/upload', data={'file': (io.BytesIO(jpeg(picture(1), 50)), 'me-1.jpg'),
+                                            'kind': 'snap', 'force': '1'}).get_json()
+    doc = {'snaps': [{'url': first['url']}], 'note': copy['url'] + '.bak'}
+    tenant = SimpleNamespace(name=portfolio.DEFAULT_TENANT.name, store=SimpleNamespace(get=lambda: doc))
+    report = portfolio.duplicate_report(tenant)
+    [cluster] = report['clusters']
+    assert [(m['url'], m['referenced']) for m in cluster['members']] == [(first['url'], True), (copy['url'], False)]
+    assert report['reclaimable'] == cluster['members'][1]['size'] > 0
@@ -0,0 +1,114 @@
+import json
+import socket
+import time
+
+import pytest
+
+import app as portfolio
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller  # noqa: E402
+from aiosmtpd.smtp import AuthResult  # noqa: E402
+
+
+class Recorder:
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.reject = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.reject:
+            self.reject -= 1
+            return '451 try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append(envelope.content.decode())
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp():
+    handler = Recorder()
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    controller = Controller(handler, hostname='127.0.0.1', port=port, auth_require_tls=False,
+                            authenticator=lambda *a: AuthResult(success=True))
+    controller.start()
+    yield handler, port
+    controller.stop()
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch, smtp):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'email': 'owner@example.com'}), encoding='utf-8')
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', portfolio.ProfileStore(str(path), portfolio.PROFILE))
+    box = portfolio.Outbox(str(tmp_path / 'outbox.sqlite3'), '127.0.0.1', smtp[1], username='site@example.com',
+                           password='secret', starttls=False, backoff=0.2, poll_interval=0.1)
+    monkeypatch.setattr(portfolio, 'OUTBOX', box)
+    yield box
+    box.stop(5)
+
+
+def _wait(box, token, until=('sent', 'failed')):
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        status = box.get(token=token)
+        if status['status'] in until:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(status)
+
+
+def _post(client, i=0):
+    return client.post('/contact', data={'from_name': f'V{i}', 'from_email': f'v{i}@example.com',
+                                         'message': 'hello'})
+
+
+def test_burst_is_queued_and_sent_over_one_connection(outbox, smtp):
+    client = portfolio.app.test_client()
+    replies = [_post(client, i) for i in range(5)]
+    assert all(r.status_code == 202 and r.get_json()['status'] == 'queued' for r in replies)
+    outbox.start()
+    for r in replies:
+        status = client.get(r.get_json()['status_url']).get_json()
+        assert status['ok']
+        assert _wait(outbox, r.get_json()['status_url'].rsplit('/', 1)[1])['status'] == 'sent'
+    handler = smtp[0]
+    assert len(handler.messages) == 5
+    assert 'Reply-To: v3@example.com' in handler.messages[3]
+    assert outbox.connections == 1 and len(handler.sessions) == 1
+
+
+def test_temporary_failure_is_retried(outbox, smtp):
+    smtp[0].reject = 1
+    outbox.start()
+    token = _post(portfolio.app.test_client()).get_json()['status_url'].rsplit('/', 1)[1]
+    status = _wait(outbox, token)
+    assert status['status'] == 'sent'
+    assert status['attempts'] == 2
+
+
+def test_missing_credentials(outbox):
+    outbox.password = None
+    r = _post(portfolio.app.test_client())
+    assert r.status_code == 500
+    assert outbox.stats()['counts'] == {}
+
+
+@pytest.mark.parametrize('field, value', [
+    ('from_email', 'v@example.com\r\nBcc: everyone@example.com'),
+    ('from_email', 'V <v@example.com>, w@example.com'),
+    ('from_email', 'not-an-address'),
+    ('from_name', 'V\nBcc: everyone@example.com'),
+])
+def test_header_injection_is_rejected(outbox, field, value):
+    form = {'from_name': 'V', 'from_email': 'v@example.com', 'message': 'hello', field: value}
+    r = portfolio.app.test_client().post('/contact', data=form)
+    assert r.status_code == 400
+    assert outbox.stats()['counts'] == {}
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'projects': [{'title': 'Traffic', 'description': 'x'}]}),
+                    encoding='utf-8')
+    s = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+    s.listeners.append(portfolio.PAGES.clear)
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', s)
+    portfolio.PAGES.clear()
+    return s
+
+
+def test_pages_are_cached_and_revalidated(store):
+    c = portfolio.app.test_client()
+    renders = portfolio.PAGES.renders
+    r = c.get('/projects')
+    assert r.status_code == 200 and b'Traffic' in r.data
+    etag = r.headers['ETag']
+    assert r.headers['Last-Modified']
+    assert c.get('/projects').data == r.data
+    assert portfolio.PAGES.renders == renders + 1
+
+    r304 = c.get('/projects', headers={'If-None-Match': etag})
+    assert r304.status_code == 304 and not r304.data
+
+    store.save({'name': 'A', 'projects': [{'title': 'Music', 'description': 'y'}]})
+    r2 = c.get('/projects', headers={'If-None-Match': etag})
+    assert r2.status_code == 200 and b'Music' in r2.data
+    assert r2.headers['ETag'] != etag
+
+
+def test_language_is_part_of_the_key(store):
+    c = portfolio.app.test_client()
+    hits = portfolio.PAGES.stats()['hits']
+    c.get('/')
+    c.post('/set-lang', json={'lang': 'telugu'})
+    c.get('/')
+    c.get('/')
+    stats = portfolio.PAGES.stats()
+    assert stats['size'] == 2
+    assert stats['hits'] == hits + 1
@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+import app as portfolio
+
+
+def test_store_caches_until_file_changes(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'skills': ['Python']}), encoding='utf-8')
+    store = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+
+    first = store.get()
+    assert first['name'] == 'A'
+    assert store.get() is first
+    assert store.stats()['hits'] == 1
+    assert store.stats()['misses'] == 1
+
+    # an external writer (another worker) changes the file
+    path.write_text(json.dumps({'name': 'Bigger name'}), encoding='utf-8')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert store.get()['name'] == 'Bigger name'
+    assert store.stats()['reloads'] == 1
+
+
+def test_store_view_is_read_only(tmp_path):
+    store = portfolio.ProfileStore(str(tmp_path / 'data.json'), portfolio.PROFILE)
+    data = store.get()
+    assert data['name'] == portfolio.PROFILE['name']
+    with pytest.raises(TypeError):
+        data['name'] = 'x'
+    with pytest.raises(TypeError):
+        data['skills'].append('Go')
+    copy = portfolio.thaw(data)
+    copy['skills'].append('Go')
+    assert 'Go' not in store.get()['skills']
+
+
+def test_save_bumps_version(tmp_path):
+    store = portfolio.ProfileStore(str(tmp_path / 'data.json'), portfolio.PROFILE)
+    v = store.get() and store.version
+    store.save({'name': 'B'})
+    assert store.version == v + 1
+    assert store.get()['name'] == 'B'
+    assert store.stats()['misses'] == 1
@@ -0,0 +1,139 @@
+import hashlib
+import io
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import app as portfolio
+
+
+def jpeg(color, size=(320, 240)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, 'JPEG')
+    return buf.getvalue()
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    uploads = tmp_path / 'uploads'
+    blobs = portfolio.BlobStore(str(uploads / 'blobs'), str(uploads / 'thumbs'))
+    entries = []
+    for color in ('red', 'green', 'blue'):
+        body = jpeg(color)
+        digest = hashlib.sha256(body).hexdigest()
+        path = blobs.path_for(digest, 'jpg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body)
+        entries.append({'name': f'{color}.jpg', 'url': blobs.url_for(digest, 'jpg')})
+    (uploads / 'thumbs').mkdir()
+    (uploads / 'old.jpg').write_bytes(jpeg('white', (900, 900)))
+    (uploads / 'thumbs' / 'old.jpg').write_bytes(jpeg('white'))
+    data = tmp_path / 'data.json'
+    data.write_text(json.dumps({'name': 'A', 'snaps': entries}), encoding='utf-8')
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', portfolio.ProfileStore(str(data), portfolio.PROFILE))
+    monkeypatch.setattr(portfolio, 'UPLOAD_FOLDER', str(uploads))
+    monkeypatch.setattr(portfolio, 'THUMB_FOLDER', str(uploads / 'thumbs'))
+    monkeypatch.setattr(portfolio, 'TENANT_UPLOAD_FOLDER', str(uploads / 'tenants'))
+    monkeypatch.setattr(portfolio, 'REPROCESS_DB_PATH', str(tmp_path / 'reprocess.sqlite3'))
+    monkeypatch.setattr(portfolio, 'PDF_PREVIEW_FOLDER', str(uploads / 'previews'))
+    monkeypatch.setattr(portfolio, 'ORIGINALS_FOLDER', str(tmp_path / 'originals'))
+    monkeypatch.setattr(portfolio, 'PROCESS_QUEUE', portfolio.ImageJobEngine(lambda path: None,
+                                                                            str(tmp_path / 'jobs.sqlite3')))
+    monkeypatch.setattr(portfolio, 'DERIVATIVES', portfolio.DerivativeCache(str(uploads / 'derived'), 1 << 24))
+    # the OpenCV pass is covered elsewhere; count the files it is asked to redo
+    enhanced = []
+    monkeypatch.setattr(portfolio, 'advanced_enhance', lambda path, *a, **k: enhanced.append(path))
+    return uploads, enhanced
+
+
+def reprocess(*args):
+    return portfolio.app.test_cli_runner().invoke(args=['reprocess-uploads', '--workers', '1', *args])
+
+
+def test_resumes_and_skips_up_to_date_files(library, monkeypatch):
+    uploads, enhanced = library
+    real = portfolio.reprocess_upload
+    calls = []
+
+    def interrupted(path, *args):
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        calls.append(path)
+        return real(path, *args)
+    monkeypatch.setattr(portfolio, 'reprocess_upload', interrupted)
+    assert reprocess().exit_code != 0
+    monkeypatch.setattr(portfolio, 'reprocess_upload', lambda path, *args: calls.append(path) or real(path, *args))
+    result = reprocess()
+    assert result.exit_code == 0, result.output
+    assert '4 uploads: 2 up to date, 2 to process' in result.output
+    # every file was processed exactly once; placeholders and the legacy thumbnail were redone
+    assert sorted(calls) == sorted(map(str, [*uploads.glob('blobs/*/*.jpg'), uploads / 'old.jpg']))
+    assert len(enhanced) == 4
+    assert all(s['lqip'] for s in portfolio.load_data()['snaps'])
+    assert Image.open(uploads / 'thumbs' / 'old.jpg').size == (300, 300)
+
+    assert '4 up to date, 0 to process' in reprocess().output
+    # new settings redo everything
+    monkeypatch.setattr(portfolio, 'ENHANCE_TILE', 256)
+    assert '0 up to date, 4 to process' in reprocess().output
+
+
+def test_dry_run_leaves_uploads_alone(library):
+    uploads, enhanced = library
+    before = {p: p.read_bytes() for p in uploads.rglob('*') if p.is_file()}
+    result = reprocess('--dry-run', '--sample', '2')
+    assert result.exit_code == 0, result.output
+    assert 'sampled 2 files' in result.output and 'estimated' in result.output
+    assert len(enhanced) == 2 and not any(p.startswith(str(uploads)) for p in enhanced)
+    assert {p: p.read_bytes() for p in uploads.rglob('*') if p.is_file()} == before
+    assert '0 up to date, 4 to process' in reprocess('--dry-run').output
+
+
+def test_legacy_pdf_gets_a_preview(library):
+    pytest.importorskip('pypdfium2')
+    uploads, _ = library
+    Image.new('RGB', (612, 792), 'white').save(uploads / 'cv.pdf', 'PDF')
+    portfolio.PROFILE_STORE.update(lambda doc: dict(doc, resume={'name': 'cv.pdf', 'url': '/static/uploads/cv.pdf'}))
+    assert reprocess().exit_code == 0
+    assert (uploads / 'previews' / 'cv.png').exists()
+    assert portfolio.load_data()['resume']['preview'] == '/static/uploads/previews/cv.png'
+    portfolio.PAGES.clear()
+    assert b'<img src="/static/uploads/previews/cv.png"' in portfolio.app.test_client().get('/resume').data
+
+
+def test_reruns_start_from_the_original(library):
+    uploads, _ = library
+    old = uploads / 'old.jpg'
+    before = old.read_bytes()
+    assert reprocess().exit_code == 0
+    once = old.read_bytes()
+    assert once != before
+    assert open(os.path.join(portfolio.ORIGINALS_FOLDER, 'old.jpg'), 'rb').read() == before
+    # redone from the original: the enhancement does not compound
+    assert reprocess('--force').exit_code == 0
+    assert old.read_bytes() == once
+    assert not list(uploads.glob('.reprocess-*'))
+
+
+def test_files_with_an_image_job_are_left_for_later(library):
+    uploads, enhanced = library
+    job = portfolio.PROCESS_QUEUE.put({'path': str(uploads / 'old.jpg')})
+    result = reprocess()
+    assert result.exit_code == 0, result.output
+    assert '0 failed, 1 busy' in result.output
+    assert len(enhanced) == 3
+    # each file was leased like a job while it was processed
+    assert [j['status'] for j in portfolio.PROCESS_QUEUE.jobs()] == ['queued', 'done', 'done', 'done']
+    portfolio.PROCESS_QUEUE.cancel(job['id'])
+    assert '3 up to date, 1 to process' in reprocess().output
+
+
+def test_tenant_name_must_match_whole(library):
+    uploads, enhanced = library
+    (uploads / 'tenants' / 'x').mkdir(parents=True)
+    result = reprocess('--tenant', 'x/../../blobs')
+    assert result.exit_code != 0 and 'no uploads for tenant' in result.output
+    assert enhanced == []
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+import app as portfolio
+
+
+DATA = {
+    'name': 'A',
+    'skills': ['React.js', 'SQL'],
+    'projects': [
+        {'title': 'Traffic', 'description': 'Signal timing with OpenCV', 'languages': 'Python, OpenCV',
+         'github': 'https://github.com/a/traffic'},
+        {'title': 'Shop', 'description': 'Online store', 'languages': 'JavaScript, Node.js'},
+        {'title': 'Vision kit', 'description': 'Camera tooling', 'languages': 'C++'},
+    ],
+    'certificates': [{'name': 'OpenCV Basics', 'url': '/static/uploads/opencv.pdf'}],
+}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(DATA), encoding='utf-8')
+    s = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+    index = portfolio.SearchIndex(str(tmp_path / 'search.sqlite3'))
+    s.listeners.append(lambda before, after: index.sync(after, s.etag))
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', s)
+    monkeypatch.setattr(portfolio, 'SEARCH', index)
+    monkeypatch.setitem(portfolio._BOT_FACTS, 'version', None)
+    portfolio.BOT_ANSWERS.clear()
+    return s
+
+
+def titles(results):
+    return [r['title'] for r in results]
+
+
+def test_ranked_prefix_and_filters(store):
+    index = portfolio.search_index()
+    assert titles(index.search('opencv')) == ['OpenCV Basics', 'Traffic']
+    assert titles(index.search('openc', collection='projects')) == ['Traffic']
+    assert titles(index.search('vis')) == ['Vision kit']
+    assert titles(index.search('python opencv')) == ['Traffic']
+    assert titles(index.search('opencv', field='languages')) == ['Traffic']
+    assert titles(index.search('node.js')) == ['Shop']
+    assert titles(index.search('react', collection='profile')) == ['skills']
+    # urls and upload paths are not indexed
+    assert index.search('github') == [] and index.search('uploads') == []
+
+
+def test_writes_update_index_incrementally(store, monkeypatch):
+    index = portfolio.search_index()
+    analyzed = []
+    real = portfolio.analyze_entry
+    monkeypatch.setattr(portfolio, 'analyze_entry', lambda *a: analyzed.append(a[0]) or real(*a))
+
+    def edit(doc):
+        doc['projects'][1]['languages'] = 'Rust'
+        doc['projects'].insert(0, {'title': 'Robot', 'languages': 'Python'})
+        return doc
+    store.update(edit)
+    assert analyzed == ['projects', 'projects']
+    assert titles(index.search('rust')) == ['Shop'] and index.search('node.js') == []
+    assert set(titles(index.search('python'))) == {'Robot', 'Traffic'}
+
+    store.update(lambda doc: dict(doc, projects=doc['projects'][1:]))
+    assert titles(index.search('python')) == ['Traffic']
+    assert analyzed == ['projects', 'projects']
+
+
+def test_persisted_index_is_reused(store, tmp_path, monkeypatch):
+    before = portfolio.search_index().search('opencv')
+    fresh = portfolio.SearchIndex(str(tmp_path / 'search.sqlite3'))
+    monkeypatch.setattr(portfolio, 'analyze_entry', lambda *a: pytest.fail('re-analyzed %s' % a[0]))
+    fresh.sync(portfolio.load_data(), store.etag)
+    assert fresh.search('opencv') == before
+
+
+def test_other_workers_writes_are_picked_up(store):
+    portfolio.search_index()
+    doc = json.loads(open(store.path, encoding='utf-8').read())
+    doc['projects'].append({'title': 'Drone', 'languages': 'Go'})
+    with open(store.path, 'w', encoding='utf-8') as f:
+        json.dump(doc, f)
+    assert titles(portfolio.search_index().search('go')) == ['Drone']
+
+
+def test_search_endpoint(store):
+    client = portfolio.app.test_client()
+    body = client.get('/api/search?q=opencv&type=projects').get_json()
+    assert body['ok'] and titles(body['results']) == ['Traffic']
+    assert body['results'][0]['url'] == 'https://github.com/a/traffic'
+    assert client.get('/api/search').status_code == 400
+    assert client.get('/api/search?q=x&type=nope').status_code == 400
+    assert client.get('/api/search?q=x&limit=z').status_code == 400
+
+
+def test_chatbot_answers_field_questions(store):
+    assert portfolio.answer_bot('Which projects use OpenCV?') == "Projects matching 'opencv': Traffic"
+    assert portfolio.answer_bot('any certificates about opencv') == "Certificates matching 'opencv': OpenCV Basics"
+    # no match: the keyword intent still answers
+    assert portfolio.answer_bot('projects in your portfolio').startswith('Projects: Traffic, Shop')
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import app as portfolio
+
+
+def make_tenant(root, name, data, **config):
+    path = root / name
+    path.mkdir(parents=True)
+    (path / 'data.json').write_text(json.dumps(data), encoding='utf-8')
+    if config:
+        (path / 'tenant.json').write_text(json.dumps(config), encoding='utf-8')
+
+
+@pytest.fixture
+def tenants(tmp_path, monkeypatch):
+    root = tmp_path / 'tenants'
+    make_tenant(root, 'alice', {'name': 'Alice', 'email': 'alice@example.com',
+                                'projects': [{'title': 'Telescope', 'languages': 'Rust'}]},
+                admin_user='alice', admin_password_hash=generate_password_hash('secret'),
+                intents=[{'name': 'hobbies', 'keywords': ['hobby'], 'reply': '{name} builds telescopes.'}])
+    make_tenant(root, 'bob', {'name': 'Bob', 'projects': [{'title': 'Sailboat', 'languages': 'Go'}]})
+    default = tmp_path / 'data.json'
+    default.write_text(json.dumps({'name': 'Default', 'projects': [{'title': 'Traffic'}]}), encoding='utf-8')
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', portfolio.ProfileStore(str(default), portfolio.PROFILE))
+    monkeypatch.setattr(portfolio, 'TENANT_UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(portfolio, 'TENANTS', portfolio.TenantRegistry(str(root)))
+    monkeypatch.setattr(portfolio, 'TENANT_MODE', 'path')
+    portfolio.PAGES.clear()
+    return portfolio.TENANTS
+
+
+def test_path_mode_serves_each_tenant(tenants):
+    c = portfolio.app.test_client()
+    alice = c.get('/t/alice/projects')
+    assert alice.status_code == 200 and b'Telescope' in alice.data and b'Sailboat' not in alice.data
+    # links and scripts stay under the tenant's prefix
+    assert b'href="/t/alice/certifications"' in alice.data and b'data-root="/t/alice"' in alice.data
+    assert b'Sailboat' in c.get('/t/bob/projects').data
+    assert b'Traffic' in c.get('/projects').data
+    assert c.get('/t/nobody/projects').status_code == 404
+    assert c.get('/t/Bad_Name/').status_code == 404
+    assert c.get('/t/bob/api/search?q=go').get_json()['results'][0]['title'] == 'Sailboat'
+    assert c.get('/t/alice/api/search?q=go').get_json()['results'] == []
+
+
+def test_host_mode(tenants, monkeypatch):
+    monkeypatch.setattr(portfolio, 'TENANT_MODE', 'host')
+    monkeypatch.setattr(portfolio, 'TENANT_DOMAIN', 'example.com')
+    c = portfolio.app.test_client()
+    assert b'Telescope' in c.get('/projects', base_url='http://alice.example.com').data
+    assert b'Traffic' in c.get('/projects', base_url='http://example.com').data
+    assert c.get('/projects', base_url='http://nobody.example.com').status_code == 404
+
+
+def test_writes_only_invalidate_their_tenant(tenants):
+    c = portfolio.app.test_client()
+    c.get('/t/alice/projects')
+    c.get('/t/bob/projects')
+    alice, bob = tenants.get('alice'), tenants.get('bob')
+    # the tenant's own admin; the session does not carry over to another tenant
+    assert c.post('/t/alice/admin/login', data={'username': 'alice', 'password': 'secret'}).status_code == 302
+    assert c.get('/t/bob/api/data').status_code == 302
+    r = c.patch('/t/alice/api/data', json=[{'op': 'replace', 'path': '/projects/0/title', 'value': 'Orrery'}])
+    assert r.status_code == 200
+    assert len(alice.pages.entries) == 0 and len(bob.pages.entries) == 1
+    assert b'Orrery' in c.get('/t/alice/projects').data
+    assert json.loads(open(bob.store.path).read())['projects'][0]['title'] == 'Sailboat'
+
+
+def test_chatbot_per_tenant(tenants):
+    c = portfolio.app.test_client()
+    assert c.post('/t/alice/chat', json={'message': 'any hobby?'}).get_json()['reply'] == 'Alice builds telescopes.'
+    # no fallback to the default portfolio's details
+    assert 'simonbaler21' not in c.post('/t/bob/chat', json={'message': 'email'}).get_json()['reply']
+    assert c.post('/t/bob/chat', json={'message': 'projects'}).get_json()['reply'] == 'Projects: Sailboat'
+
+
+def test_registry_is_bounded(tenants, monkeypatch):
+    tenants.maxsize = 1
+    alice = tenants.get('alice')
+    assert tenants.get('alice') is alice
+    tenants.get('bob')
+    assert tenants.stats()['loaded'] == 1 and tenants.evictions == 1
+    assert tenants.get('alice') is not alice
+    tenants.maxsize = 8
+    tenants.max_bytes = 1
+    tenants.get('bob')
+    # over the memory budget: only the most recently used tenant stays
+    assert tenants.stats()['loaded'] == 1
+
+
+def test_events_reach_only_their_tenant(tmp_path):
+    bus = portfolio.EventBus(str(tmp_path / 'events.sqlite3'))
+    a, _ = bus.subscribe(client=portfolio.SSEClient(tenant='alice'))
+    b, _ = bus.subscribe(client=portfolio.SSEClient(tenant='bob'))
+    first = bus.publish('ui_mode', {'mode': 'glam'}, tenant='alice')
+    bus.poll_once()
+    assert a.queue.get_nowait()['id'] == first and b.queue.empty()
+    assert [m['id'] for m in bus.replay(0, 'alice')] == [first] and bus.replay(0, 'bob') == []
@@ -0,0 +1,82 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import app as portfolio
+
+
+@pytest.fixture
+def blobs(tmp_path, monkeypatch):
+    store = portfolio.BlobStore(str(tmp_path / 'blobs'), str(tmp_path / 'thumbs'))
+    monkeypatch.setattr(portfolio, 'BLOBS', store)
+    return store
+
+
+def _pdf():
+    buf = io.BytesIO()
+    Image.new('RGB', (612, 792), (250, 250, 250)).save(buf, 'PDF')
+    return buf.getvalue() + os.urandom(50_000)
+
+
+def _send(path, **headers):
+    with portfolio.app.test_request_context(headers=headers):
+        resp = portfolio.send_upload(path)
+        return resp, b''.join(resp.response) if resp.response else b''
+
+
+def test_byte_ranges_and_immutable_blobs(blobs):
+    body = _pdf()
+    digest, _, tmp = blobs.ingest(io.BytesIO(body))
+    path, _ = blobs.commit(tmp, digest, 'pdf')
+
+    resp, data = _send(path)
+    assert resp.status_code == 200 and data == body
+    assert resp.headers['ETag'] == f'"{digest}"'
+    assert 'immutable' in resp.headers['Cache-Control']
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+    resp, data = _send(path, Range='bytes=100-199')
+    assert resp.status_code == 206 and data == body[100:200]
+    assert resp.headers['Content-Range'] == f'bytes 100-199/{len(body)}'
+    assert resp.content_length == 100
+
+    resp, data = _send(path, Range='bytes=-10')
+    assert data == body[-10:]
+    assert _send(path, Range=f'bytes={len(body)}-')[0].status_code == 416
+    # a stale If-Range gets the whole file
+    resp, data = _send(path, Range='bytes=0-9', **{'If-Range': '"other"'})
+    assert resp.status_code == 200 and data == body
+    assert _send(path, **{'If-None-Match': f'"{digest}"'})[0].status_code == 304
+
+
+def test_rewritable_uploads_revalidate(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'jpeg bytes')
+    resp, _ = _send(str(path))
+    assert 'no-cache' in resp.headers['Cache-Control']
+    etag = resp.headers['ETag']
+    path.write_bytes(b'enhanced jpeg bytes')
+    assert _send(str(path), **{'If-None-Match': etag})[0].status_code == 200
+
+
+def test_pdf_first_page_preview(blobs, tmp_path, monkeypatch):
+    pytest.importorskip('pypdfium2')
+    monkeypatch.setattr(portfolio, 'PDF_PREVIEW_FOLDER', str(tmp_path / 'previews'))
+    monkeypatch.setattr(portfolio, 'DERIVATIVES', portfolio.DerivativeCache(str(tmp_path / 'derived'), 1 << 24))
+    digest, _, tmp = blobs.ingest(io.BytesIO(_pdf()))
+    path, _ = blobs.commit(tmp, digest, 'pdf')
+
+    portfolio.process_upload(path)
+    preview = tmp_path / 'previews' / f'{digest}.png'
+    width, height = Image.open(preview).size
+    assert width == portfolio.PDF_PREVIEW_WIDTH
+    assert abs(height - width * 792 / 612) <= 1
+    mtime = preview.stat().st_mtime_ns
+    portfolio.render_pdf_preview(path)
+    assert preview.stat().st_mtime_ns == mtime
+
+    r = portfolio.app.test_client().get(f'/img/{digest}/320.auto', headers={'Accept': 'image/webp'})
+    assert r.status_code == 200 and r.mimetype == 'image/webp'
+    assert Image.open(io.BytesIO(r.data)).width == 320
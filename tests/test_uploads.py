@@ -0,0 +1,87 @@
+import io
+import json
+import os
+
+import pytest
+
+import app as portfolio
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({'name': 'A', 'projects': []}), encoding='utf-8')
+    store = portfolio.ProfileStore(str(path), portfolio.PROFILE)
+    blobs = portfolio.BlobStore(str(tmp_path / 'blobs'), str(tmp_path / 'thumbs'))
+    store.listeners.append(blobs.collect)
+    monkeypatch.setattr(portfolio, 'PROFILE_STORE', store)
+    monkeypatch.setattr(portfolio, 'BLOBS', blobs)
+    c = portfolio.app.test_client()
+    with c.session_transaction() as s:
+        s['admin'] = True
+    return c
+
+
+def upload(client, body, name='resume.pdf', kind='cert'):
+    return client.post('/api/upload', data={'file': (io.BytesIO(body), name), 'kind': kind},
+                       content_type='multipart/form-data')
+
+
+def test_identical_uploads_share_one_blob(client, tmp_path):
+    body = b'%PDF-1.4 ' + os.urandom(200_000)
+    first = upload(client, body).get_json()
+    second = upload(client, body, name='resume-2.pdf').get_json()
+    assert first['ok'] and second['ok']
+    assert first['url'] == second['url']
+    assert not first['deduplicated'] and second['deduplicated']
+    stored = [f for _, _, files in os.walk(tmp_path / 'blobs') for f in files]
+    assert len(stored) == 1
+
+    data = portfolio.load_data()
+    assert [c['name'] for c in data['certificates']] == ['resume.pdf', 'resume-2.pdf']
+    assert portfolio.BLOBS.refcounts(data)[first['hash']] == 2
+
+
+def test_blob_freed_when_last_reference_removed(client):
+    body = b'%PDF-1.4 ' + os.urandom(1000)
+    j = upload(client, body).get_json()
+    upload(client, body)
+    path = portfolio.BLOBS.path_for(j['hash'], 'pdf')
+
+    client.patch('/api/data', data=json.dumps([{'op': 'remove', 'path': '/certificates/0'}]),
+                 content_type='application/json-patch+json')
+    assert os.path.exists(path)
+    client.patch('/api/data', data=json.dumps([{'op': 'remove', 'path': '/certificates/0'}]),
+                 content_type='application/json-patch+json')
+    assert not os.path.exists(path)
+
+
+def test_upload_rejects_unknown_kind(client):
+    r = upload(client, b'data', kind='bogus')
+    assert r.status_code == 400
+    assert not any(files for _, _, files in os.walk(portfolio.BLOBS.root))
+
+
+class QueueStub:
+    def __init__(self):
+        self.jobs = []
+
+    def full(self):
+        return False
+
+    def put(self, task, priority=None):
+        self.jobs.append(task)
+        return {'id': len(self.jobs)}
+
+
+def test_image_upload_prerenders_thumbnail(client, tmp_path, monkeypatch):
+    from PIL import Image
+    monkeypatch.setattr(portfolio, 'PROCESS_QUEUE', QueueStub())
+    monkeypatch.setattr(portfolio, 'DERIVATIVES', portfolio.DerivativeCache(str(tmp_path / 'derived'), 1 << 24))
+    buf = io.BytesIO()
+    Image.new('RGB', (1600, 1200), (10, 200, 30)).save(buf, 'JPEG')
+    r = upload(client, buf.getvalue(), name='snap.jpg', kind='snap').get_json()
+    assert r['ok'] and r['job'] == 1
+    variants = sorted(os.listdir(tmp_path / 'derived' / r['hash']))
+    assert variants == ['480.jpg', '480.webp']
+    assert Image.open(tmp_path / 'derived' / r['hash'] / '480.webp').size == (480, 360)